@@ -0,0 +1,106 @@
+"""
+Streaming render benchmark.
+
+Renders a synthetic template with a large output using the default (in
+memory) and streaming render paths, each in a fresh process, and compares peak
+RSS and throughput.
+
+    python -m benchmarks.render_memory [--rows N] [--repeat N]
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# one output row is ~100 bytes, so 1M rows renders ~100MB
+TEMPLATE = (
+    "# generated table for {{ name }}\n"
+    "{% for i in range(rows) %}"
+    "{{ name }},{{ i }},{{ i * 7 % 13 }},"
+    "a fixed-width padding column to bulk out each row...........\n"
+    "{% endfor %}"
+)
+
+
+def render_once(mode, rows):
+    """Render the synthetic template in this process; return its stats"""
+    from mlops_manager.templating import TemplateTreeJob
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        template_root = os.path.join(tmp_dir, "template")
+        target_root = os.path.join(tmp_dir, "target")
+        os.makedirs(template_root)
+        with open(os.path.join(template_root, "table.csv"), 'w') as f:
+            f.write(TEMPLATE)
+
+        job = TemplateTreeJob(
+            template_root=template_root,
+            target_root=target_root,
+            template_context={"name": "bench", "rows": rows},
+            stream=(mode == "stream"),
+        )
+        start = time.perf_counter()
+        job.run()
+        elapsed = time.perf_counter() - start
+        output_bytes = os.path.getsize(os.path.join(target_root, "table.csv"))
+
+    # ru_maxrss is in KiB on Linux, bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        max_rss *= 1024
+    return {
+        "mode": mode,
+        "seconds": elapsed,
+        "output_bytes": output_bytes,
+        "max_rss_bytes": max_rss,
+    }
+
+
+def run_child(mode, rows):
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.render_memory",
+         "--child", mode, "--rows", str(rows)],
+        cwd=PROJECT_DIR,
+        stdout=subprocess.PIPE,
+        check=True,
+        text=True,
+    )
+    return json.loads(result.stdout)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=1_000_000,
+                        help="rows in the synthetic output")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="processes per mode; the fastest run is reported")
+    parser.add_argument("--child", choices=["memory", "stream"],
+                        help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main(args):
+    if args.child:
+        print(json.dumps(render_once(args.child, args.rows)))
+        return 0
+
+    print(f"{'mode':<8} {'output MB':>10} {'peak RSS MB':>12} "
+          f"{'seconds':>8} {'MB/s':>8}")
+    for mode in ["memory", "stream"]:
+        runs = [run_child(mode, args.rows) for _ in range(args.repeat)]
+        best = min(runs, key=lambda run: run["seconds"])
+        max_rss = max(run["max_rss_bytes"] for run in runs)
+        output_mb = best["output_bytes"] / 1e6
+        print(f"{mode:<8} {output_mb:>10.1f} {max_rss / 1e6:>12.1f} "
+              f"{best['seconds']:>8.2f} {output_mb / best['seconds']:>8.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(parse_args()))
@@ -0,0 +1,101 @@
+"""
+CLI startup time benchmark.
+
+Times fresh `python -m mlops_manager` processes for commands that should never
+touch the rendering engine, and fails if the median wall-clock time exceeds a
+budget or if heavy dependencies are imported along the way.
+
+    python -m benchmarks.startup [--runs N] [--budget-ms MS]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# commands which only print help, and so should only pay for CLI startup
+COMMANDS = [
+    ["--help"],
+    ["start", "--help"],
+    ["start", "task", "--help"],
+]
+
+# modules that must only be imported once a TemplateTreeJob actually runs
+LAZY_MODULES = ["jinja2", "yaml"]
+
+
+def time_command(command, runs):
+    """Wall-clock seconds for each of `runs` fresh CLI processes"""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-m", "mlops_manager", *command],
+            cwd=PROJECT_DIR,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            check=True,
+        )
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def imported_modules(command):
+    """Top-level package names imported by a CLI process (via -X importtime)"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "mlops_manager", *command],
+        cwd=PROJECT_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        check=True,
+    )
+    modules = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        name = line.rsplit("|", 1)[-1].strip()
+        modules.add(name.split(".")[0])
+    return modules
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=10,
+                        help="processes to time per command")
+    parser.add_argument("--budget-ms", type=float, default=250.0,
+                        help="maximum median startup time per command")
+    return parser.parse_args()
+
+
+def main(args):
+    # warm the template manifest cache so it is not counted against startup
+    time_command(["--help"], 1)
+
+    failures = []
+    for command in COMMANDS:
+        label = " ".join(command)
+        timings = time_command(command, args.runs)
+        median_ms = statistics.median(timings) * 1000
+        max_ms = max(timings) * 1000
+        print(f"{label:<24} median {median_ms:7.1f} ms  max {max_ms:7.1f} ms")
+        if median_ms > args.budget_ms:
+            failures.append(
+                f"`{label}` median {median_ms:.1f} ms exceeds budget of "
+                f"{args.budget_ms:.1f} ms")
+
+        eager = set(LAZY_MODULES) & imported_modules(command)
+        if eager:
+            failures.append(
+                f"`{label}` imported: {', '.join(sorted(eager))}")
+
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(parse_args()))
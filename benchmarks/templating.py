@@ -0,0 +1,374 @@
+"""
+Templating engine benchmark suite.
+
+Generates synthetic template roots and measures how `TemplateTreeJob`,
+`TemplateTreeJob._substitute_name`, and template discovery scale with file
+count, directory depth, template size, filename substitutions, and variants.
+Each scenario runs in a fresh process with a cold cache directory, and results
+are compared against a stored baseline; any metric that regresses by more than
+the tolerance fails the run.
+
+    python -m benchmarks.templating [--large] [--scenario NAME ...]
+    python -m benchmarks.templating --update-baseline
+"""
+import argparse
+import json
+import math
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(PROJECT_DIR, "benchmarks", "baseline.json")
+
+FILES_PER_DIR = 100
+
+# (name, fraction, minimum samples) of per-file latency percentiles
+PERCENTILES = [
+    ("p50", 0.50, 1),
+    ("p95", 0.95, 200),
+    ("p99", 0.99, 1000),
+]
+
+# scenario name -> (kind, parameters).  Parameters not given take the values
+# in DEFAULT_PARAMS.
+DEFAULT_PARAMS = {
+    "files": 1000,
+    "depth": 2,
+    "template_bytes": 1024,
+    "substitutions": 2,
+    "templates": 5,
+    "variants": 3,
+    "jobs": 1,
+}
+SCENARIOS = {
+    "render-files-10": ("render", {"files": 10}),
+    "render-files-1k": ("render", {"files": 1000}),
+    "render-files-10k": ("render", {"files": 10000}),
+    "render-depth-1": ("render", {"depth": 1}),
+    "render-depth-8": ("render", {"depth": 8}),
+    "render-size-64k": ("render", {"files": 100, "template_bytes": 65536}),
+    "render-subs-16": ("render", {"substitutions": 16}),
+    "render-jobs-8": ("render", {"jobs": 8}),
+    "substitute-subs-1": ("substitute", {"substitutions": 1}),
+    "substitute-subs-16": ("substitute", {"substitutions": 16}),
+    "discover-variants-1": ("discover", {"variants": 1}),
+    "discover-variants-32": ("discover", {"variants": 32}),
+    "discover-templates-50": ("discover", {"templates": 50}),
+}
+# only run with --large
+LARGE_SCENARIOS = {
+    "render-files-100k": ("render", {"files": 100000}),
+    "discover-templates-500": ("discover", {"templates": 500}),
+}
+
+
+def substitution_keys(count):
+    return [f"__SUB_{i}__" for i in range(count)]
+
+
+def make_template_body(size, substitutions):
+    """A template of roughly `size` bytes, using each substitution variable"""
+    variables = [f"var_{i}" for i in range(max(substitutions, 1))]
+    lines = []
+    length = 0
+    index = 0
+    while length < size:
+        variable = variables[index % len(variables)]
+        line = f"line {index}: {{{{ {variable} }}}} some static text\n"
+        lines.append(line)
+        length += len(line)
+        index += 1
+    return "".join(lines)
+
+
+def make_variant(variant_root, files, depth, template_bytes, substitutions):
+    """Write a synthetic variant tree of `files` files, `depth` dirs deep"""
+    keys = substitution_keys(substitutions)
+    body = make_template_body(template_bytes, substitutions)
+    num_dirs = math.ceil(files / FILES_PER_DIR)
+    fanout = max(2, math.ceil(num_dirs ** (1 / depth)))
+
+    for index in range(files):
+        dir_index = index // FILES_PER_DIR
+        parts = []
+        for level in range(depth):
+            parts.append(f"d{level}_{(dir_index // fanout ** level) % fanout}")
+        # spread the substitution keys across directory and file names
+        if keys:
+            parts[0] = f"{keys[0]}_{parts[0]}"
+        name = "_".join([f"f{index}"] + keys[1:]) + ".txt"
+        path = os.path.join(variant_root, *parts, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(body)
+
+
+def make_templates_dir(templates_dir, templates, variants, substitutions):
+    """Write a synthetic templates dir for discovery benchmarks"""
+    keys = substitution_keys(substitutions)
+    for template_index in range(templates):
+        template_root = os.path.join(templates_dir, f"template_{template_index}")
+        for variant_index in range(variants):
+            make_variant(os.path.join(template_root, f"variant_{variant_index}"),
+                         files=1, depth=1, template_bytes=64,
+                         substitutions=substitutions)
+        with open(os.path.join(template_root, "variables.yaml"), 'w') as f:
+            f.write("args:\n")
+            for i in range(max(substitutions, 1)):
+                f.write(f"  var_{i}:\n    help: variable {i}\n")
+            f.write("filename_substitutions:\n")
+            for i, key in enumerate(keys):
+                f.write(f"  {key}: var_{i}\n")
+            f.write("template_context:\n")
+            for i in range(max(substitutions, 1)):
+                f.write(f"  var_{i}: var_{i}\n")
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+def max_rss_mb():
+    # ru_maxrss is in KiB on Linux, bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        max_rss *= 1024
+    return max_rss / 1e6
+
+
+def bench_render(params, tmp_dir):
+    from mlops_manager.profiling import RenderStats
+    from mlops_manager.templating import TemplateTreeJob
+
+    template_root = os.path.join(tmp_dir, "template")
+    make_variant(template_root, params["files"], params["depth"],
+                 params["template_bytes"], params["substitutions"])
+    keys = substitution_keys(params["substitutions"])
+    job = TemplateTreeJob(
+        template_root=template_root,
+        target_root=os.path.join(tmp_dir, "target"),
+        template_context={
+            f"var_{i}": f"value_{i}"
+            for i in range(max(params["substitutions"], 1))
+        },
+        filename_substitutions={key: f"sub{i}" for i, key in enumerate(keys)},
+        jobs=params["jobs"],
+    )
+    stats = RenderStats()
+    job.add_hook(stats)
+
+    start = time.perf_counter()
+    job.run()
+    seconds = time.perf_counter() - start
+
+    latencies = [
+        file["compile_seconds"] + file["render_seconds"]
+        + file["write_seconds"]
+        for file in stats.files
+    ]
+    results = {
+        "seconds": seconds,
+        "files_per_second": len(stats.files) / seconds,
+        "mb_per_second": stats.bytes_written / 1e6 / seconds,
+        "discover_seconds": stats.phase_seconds["discover"],
+        "max_rss_mb": max_rss_mb(),
+    }
+    # only report tail percentiles with enough samples to be stable
+    for name, fraction, min_samples in PERCENTILES:
+        if len(latencies) >= min_samples:
+            results[f"file_{name}_ms"] = percentile(latencies, fraction) * 1000
+    return results
+
+
+def bench_substitute(params, tmp_dir):
+    from mlops_manager.templating import TemplateTreeJob
+
+    keys = substitution_keys(params["substitutions"])
+    job = TemplateTreeJob(
+        template_root=tmp_dir,
+        target_root=tmp_dir,
+        filename_substitutions={key: f"sub{i}" for i, key in enumerate(keys)},
+    )
+    paths = [
+        "/".join([f"{keys[0]}_dir", f"d{i % 7}", f"f{i}_{'_'.join(keys)}.py"])
+        for i in range(10000)
+    ]
+
+    timings = []
+    for _ in range(20):
+        start = time.perf_counter()
+        for path in paths:
+            job._substitute_name(path)
+        timings.append(time.perf_counter() - start)
+    per_call = statistics.median(timings) / len(paths)
+    return {
+        "call_us": per_call * 1e6,
+        "calls_per_second": 1 / per_call,
+        "max_rss_mb": max_rss_mb(),
+    }
+
+
+def bench_discover(params, tmp_dir):
+    from mlops_manager import cli, manifest
+
+    templates_dir = os.path.join(tmp_dir, "templates")
+    make_templates_dir(templates_dir, params["templates"], params["variants"],
+                       params["substitutions"])
+
+    start = time.perf_counter()
+    compiled = manifest.load_manifest(templates_dir)
+    cold_seconds = time.perf_counter() - start
+
+    timings = []
+    for _ in range(20):
+        start = time.perf_counter()
+        manifest.load_manifest(templates_dir)
+        timings.append(time.perf_counter() - start)
+
+    # the cost the lazy CLI avoids: building every template's arguments
+    parser = cli.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="template")
+    start = time.perf_counter()
+    for name, template in compiled["templates"].items():
+        cli.add_template_to_parser(subparsers.add_parser(name), template)
+    parsers_seconds = time.perf_counter() - start
+
+    return {
+        "cold_ms": cold_seconds * 1000,
+        "warm_ms": statistics.median(timings) * 1000,
+        "all_parsers_ms": parsers_seconds * 1000,
+        "max_rss_mb": max_rss_mb(),
+    }
+
+
+BENCHMARKS = {
+    "render": bench_render,
+    "substitute": bench_substitute,
+    "discover": bench_discover,
+}
+
+
+def run_scenario(name):
+    """Run a scenario in a fresh process with a cold cache directory"""
+    with tempfile.TemporaryDirectory() as cache_dir:
+        env = dict(os.environ, MLOPS_MANAGER_CACHE_DIR=cache_dir)
+        result = subprocess.run(
+            [sys.executable, "-m", "benchmarks.templating", "--child", name],
+            cwd=PROJECT_DIR,
+            env=env,
+            stdout=subprocess.PIPE,
+            check=True,
+            text=True,
+        )
+    return json.loads(result.stdout)
+
+
+def run_child(name):
+    kind, overrides = {**SCENARIOS, **LARGE_SCENARIOS}[name]
+    params = {**DEFAULT_PARAMS, **overrides}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        return BENCHMARKS[kind](params, tmp_dir)
+
+
+def higher_is_better(metric):
+    return metric.endswith("_per_second")
+
+
+def compare(results, baseline, tolerance, min_delta_ms):
+    """Return a description of every metric regressed beyond tolerance"""
+    regressions = []
+    for scenario, metrics in results.items():
+        for metric, value in metrics.items():
+            expected = baseline.get(scenario, {}).get(metric)
+            if expected is None:
+                continue
+            if higher_is_better(metric):
+                regressed = value < expected * (1 - tolerance)
+            else:
+                regressed = value > expected * (1 + tolerance)
+                # ignore jitter on timings too small to matter
+                if metric.endswith("_ms") and value - expected < min_delta_ms:
+                    regressed = False
+            if regressed:
+                regressions.append(
+                    f"{scenario} {metric}: {value:.4g} "
+                    f"(baseline {expected:.4g})")
+    return regressions
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--scenario", action="append", dest="scenarios",
+                        choices=sorted({**SCENARIOS, **LARGE_SCENARIOS}),
+                        help="scenario to run (default: all but large)")
+    parser.add_argument("--large", action="store_true",
+                        help="also run the large (100k file) scenarios")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE,
+                        help="baseline results file (default: %(default)s)")
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="write results to the baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="allowed relative regression per metric")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0,
+                        help="ignore timing regressions smaller than this")
+    parser.add_argument("--output", help="also write results to this file")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main(args):
+    if args.child:
+        print(json.dumps(run_child(args.child)))
+        return 0
+
+    scenarios = args.scenarios
+    if not scenarios:
+        scenarios = list(SCENARIOS)
+        if args.large:
+            scenarios += list(LARGE_SCENARIOS)
+
+    results = {}
+    for name in scenarios:
+        results[name] = run_scenario(name)
+        metrics = "  ".join(
+            f"{metric}={value:.4g}" for metric, value in results[name].items())
+        print(f"{name:<24} {metrics}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.update_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, 'r') as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline written to: {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --update-baseline "
+              "to create one.")
+        return 0
+    with open(args.baseline, 'r') as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance,
+                          args.min_delta_ms)
+    for regression in regressions:
+        print(f"REGRESSION: {regression}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(parse_args()))
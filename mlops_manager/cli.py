@@ -1,7 +1,52 @@
-from .templating import get_templates_dir
-from argparse import ArgumentParser
+from .manifest import load_manifest
+from argparse import ArgumentParser, _SubParsersAction
 import os
-import yaml
+
+
+class LazySubParsersAction(_SubParsersAction):
+    """
+    Subparsers action that defers populating a subparser until it is selected
+    on the command line, so that only the chosen subcommand pays for building
+    its arguments.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._builders = {}
+
+    def add_lazy_parser(self, name, builder, **kwargs):
+        """Add a subparser whose arguments are added by `builder(parser)`"""
+        parser = self.add_parser(name, **kwargs)
+        self._builders[name] = builder
+        return parser
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        builder = self._builders.pop(values[0], None)
+        if builder is not None:
+            builder(self._name_parser_map[values[0]])
+        super().__call__(parser, namespace, values, option_string)
+
+
+class TemplateArgumentParser(ArgumentParser):
+    """
+    Parser of a template subcommand, which checks the arguments that only some
+    of the template's variants require once the variant is known.
+    """
+
+    def __init__(self, *args, template=None, template_root=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.template = template
+        self.template_root = template_root
+
+    def parse_known_args(self, args=None, namespace=None):
+        namespace, extras = super().parse_known_args(args, namespace)
+        if self.template is not None:
+            # the `default` variant is a link to another variant
+            variant_root = os.path.join(self.template_root, namespace.variant)
+            check_variant_args(self, namespace, self.template["variables"],
+                               os.path.basename(os.path.realpath(variant_root)))
+        return namespace, extras
+
 
 _PARSER = ArgumentParser()
 _PARSER.add_argument("--log_level", help="Specify log level", type=str,
@@ -41,53 +86,45 @@ def template_command(args=[], parent=_COMMANDS_PARSER, strict=True):
             parser.add_argument(*arg[0], **arg[1])
         parser.set_defaults(func=func)
         templates_subparser = parser.add_subparsers(
-            title="templates", dest="template")
-
-        with os.scandir(get_templates_dir()) as scan:
-            for entry in scan:
-                # load each template directory as a subcommand
-                if entry.is_dir():
-                    template_parser = templates_subparser.add_parser(
-                        entry.name)
-
-                    with os.scandir(entry.path) as scan:
-                        variants = [
-                            variant.name for variant in scan
-                            if variant.is_dir()
-                        ]
-
-                    if "examples" in variants:
-                        variants.remove("examples")
-                        examples_path = os.path.join(entry.path, "examples")
-                        with os.scandir(examples_path) as scan:
-                            examples = [
-                                example.name for example in scan
-                                if example.is_dir()
-                            ]
-                        template_parser.add_argument(
-                            "--example",
-                            help="example to included",
-                            action='append',
-                            choices=examples,
-                            dest='examples',
-                            default=[])
-
-                    template_parser.add_argument(
-                        "--variant",
-                        help="template variant to use",
-                        default='default',
-                        choices=variants,
-                    )
-
-                    variables_path = os.path.join(entry.path, "variables.yaml")
-                    with open(variables_path, 'r') as f:
-                        variables = yaml.safe_load(f)
-                    add_template_variables_to_parser(
-                        template_parser, variables)
+            title="templates", dest="template", action=LazySubParsersAction,
+            parser_class=TemplateArgumentParser)
+
+        # load each template in the manifest as a subcommand.  Template
+        # arguments are only added once that template is selected.
+        manifest = load_manifest()
+        for template_name, template in manifest["templates"].items():
+            templates_subparser.add_lazy_parser(
+                template_name,
+                lambda parser, template=template: add_template_to_parser(
+                    parser, template),
+                template=template,
+                template_root=os.path.join(manifest["templates_dir"],
+                                           template_name))
 
     return decorator
 
 
+def add_template_to_parser(parser, template):
+    """Add the arguments of a manifest template entry to its subparser"""
+    if template["examples"]:
+        parser.add_argument(
+            "--example",
+            help="example to included",
+            action='append',
+            choices=template["examples"],
+            dest='examples',
+            default=[])
+
+    parser.add_argument(
+        "--variant",
+        help="template variant to use",
+        default='default',
+        choices=template["variants"],
+    )
+
+    add_template_variables_to_parser(parser, template["variables"])
+
+
 def add_template_variables_to_parser(parser, variables):
     args = variables.get('args', None)
     if args is None:
@@ -95,13 +132,38 @@ def add_template_variables_to_parser(parser, variables):
     for arg in args:
         long_option = arg.lower().replace("_", "-")
         long_option = f"--{long_option}"
-        kwargs = variables['args'].get(arg, None)
+        kwargs = args.get(arg, None)
         if kwargs is None:  # guard against explicit Nones in config
             kwargs = {}
-        kwargs['required'] = kwargs.get('required', True)
+        kwargs = dict(kwargs)
+        # arguments used by only some variants are checked once the variant
+        # is known, in `check_variant_args`
+        variants = kwargs.pop('variants', None)
+        kwargs['required'] = kwargs.get('required', variants is None)
         parser.add_argument(long_option, **kwargs)
 
 
+def check_variant_args(parser, args, variables, variant):
+    """
+    Exit with a usage error from `parser` if an argument which `variant`
+    requires, according to the `variants` list of its entry in `variables`,
+    was not given.
+    """
+    for arg, kwargs in (variables.get('args', None) or {}).items():
+        variants = (kwargs or {}).get('variants', None)
+        if variants is None or variant not in variants:
+            continue
+        if getattr(args, arg, None) is None:
+            long_option = "--" + arg.lower().replace("_", "-")
+            parser.error(
+                f"{long_option} is required by the '{variant}' variant")
+
+
+def parse_command(argv):
+    """Parse a full command line (excluding the program name) into args"""
+    return _PARSER.parse_args(argv)
+
+
 def arg(*args, **kwargs):
     """Argument packaging function for command decorator"""
     return ([*args], kwargs)
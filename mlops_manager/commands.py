@@ -1,7 +1,12 @@
-from .cli import command, arg, template_command
-from .templating import TemplateTreeJob, get_templates_dir
+from .cli import command, arg, parse_command, template_command
+from .manifest import get_manifest_path, load_manifest
+from .profiling import RenderStats, cprofile
+from .templating import TemplateTreeJob, check_plan_conflicts, get_templates_dir
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
 import os
-import yaml
 
 
 @template_command(
@@ -10,51 +15,292 @@ import yaml
             default="error",
             choices=TemplateTreeJob.VALID_EXISTS_POLICIES,
             help="policy for handling files which already exist.  "
+            + "`if-changed` records generated files in "
+            + ".mlops_manager.json in the target directory, and only "
+            + "updates files which have not been edited since.  "
             + "(choices: %(choices)s) (default: %(default)s)",),
         arg("--target_root", help="target directory", default="."),
+        arg("--jobs",
+            type=int,
+            default=1,
+            help="number of files to render in parallel.  "
+            + "(default: %(default)s)"),
+        arg("--stream",
+            action="store_true",
+            help="write rendered files in chunks as they are produced, "
+            + "rather than rendering each file fully in memory."),
+        arg("--profile",
+            action="store_true",
+            help="log per-phase timings, bytes written, cache hit rates, "
+            + "and the slowest files."),
+        arg("--stats-json",
+            help="write per-file and per-phase render metrics to this path."),
+        arg("--cprofile",
+            help="write cProfile stats for the whole run to this path."),
     ],
 )
 def start_template(args):
+    template_jobs = create_start_jobs(args)
 
+    stats = None
+    if args.profile or args.stats_json:
+        stats = RenderStats()
+        for job in template_jobs:
+            job.add_hook(stats)
+
+    with cprofile(args.cprofile):
+        # plan every job before executing any, so that conflicts are reported
+        # before anything is written
+        plans = [job.plan() for job in template_jobs]
+        check_plan_conflicts(plans)
+        for job, plan in zip(template_jobs, plans):
+            job.execute(plan)
+
+    if args.profile:
+        stats.log_summary()
+    if args.stats_json:
+        stats.write_json(args.stats_json)
+
+
+def create_start_jobs(args):
+    """Create the TemplateTreeJobs for parsed `start` command args"""
     template_root = os.path.join(get_templates_dir(), args.template)
     variant_root = os.path.join(template_root, args.variant)
 
-    variables_path = os.path.join(template_root, 'variables.yaml')
-    with open(variables_path, 'r') as f:
-        variables = yaml.safe_load(f)
+    variables = load_manifest()["templates"][args.template]["variables"]
 
     filename_substitutions = variables.get('filename_substitutions', None)
     if filename_substitutions is None:
         filename_substitutions = {}
-    for key in filename_substitutions:
-        arg_name = filename_substitutions[key]
-        filename_substitutions[key] = getattr(args, arg_name)
+    filename_substitutions = {
+        key: getattr(args, arg_name)
+        for key, arg_name in filename_substitutions.items()
+    }
 
     template_context = variables.get('template_context', None)
     if template_context is None:
         template_context = {}
-    for key in template_context:
-        arg_name = template_context[key]
-        template_context[key] = getattr(args, arg_name)
+    template_context = {
+        key: getattr(args, arg_name)
+        for key, arg_name in template_context.items()
+    }
 
     if "examples" in args:
-        for example in args.examples:
-            example_root = os.path.join(template_root, 'examples', example)
-            example_job = TemplateTreeJob(
-                template_root=example_root,
-                target_root=args.target_root,
-                exists_policy=args.on_exists,
-                filename_substitutions=filename_substitutions,
-                template_context=template_context,
+        job_roots = [
+            os.path.join(template_root, 'examples', example)
+            for example in args.examples
+        ]
+    else:
+        job_roots = [variant_root]
+
+    static_files = variables.get('static_files', None)
+    if static_files is None:
+        static_files = []
+
+    return [
+        TemplateTreeJob(
+            template_root=job_root,
+            target_root=args.target_root,
+            exists_policy=args.on_exists,
+            filename_substitutions=filename_substitutions,
+            template_context=template_context,
+            jobs=args.jobs,
+            static_files=static_files,
+            stream=args.stream,
+        )
+        for job_root in job_roots
+    ]
+
+
+@command()
+def rebuild_manifest(args):
+    """
+    Rebuild the cached manifest of available templates, variants, and examples.
+    """
+    manifest = load_manifest(rebuild=True)
+    template_names = ", ".join(manifest["templates"])
+    logging.info(f"Indexed templates: {template_names}")
+    logging.info(f"Manifest written to: {get_manifest_path()}")
+
+
+@command()
+def precompile_templates(args):
+    """
+    Compile every template into the on-disk bytecode cache, so that later runs
+    skip parsing and compiling them.  Run this after installing or updating
+    mlops_manager.
+    """
+    templates_dir = get_templates_dir()
+    for template_name, template in load_manifest()["templates"].items():
+        template_root = os.path.join(templates_dir, template_name)
+        roots = [
+            os.path.join(template_root, variant)
+            for variant in template["variants"]
+        ] + [
+            os.path.join(template_root, 'examples', example)
+            for example in template["examples"]
+        ]
+
+        static_files = template["variables"].get('static_files', None)
+        if static_files is None:
+            static_files = []
+
+        for root in roots:
+            job = TemplateTreeJob(
+                template_root=root,
+                target_root=".",  # nothing is rendered
+                static_files=static_files,
             )
-            example_job.run()
-        return
-
-    template_job = TemplateTreeJob(
-        template_root=variant_root,
-        target_root=args.target_root,
-        exists_policy=args.on_exists,
-        filename_substitutions=filename_substitutions,
-        template_context=template_context,
-    )
-    template_job.run()
+            count = job.precompile()
+            logging.info(f"{root} - {count} templates COMPILED")
+
+
+BATCH_OPERATION_KEYS = {
+    "template", "variant", "examples", "args", "on_exists", "target_root",
+}
+
+BATCH_REPORT_ACTIONS = [
+    "CREATED", "OVERWRITTEN", "UPDATED", "UNCHANGED", "SKIPPED", "MODIFIED",
+]
+
+
+@command([
+    arg("spec", help="YAML or JSON file listing `start` operations"),
+    arg("--jobs",
+        type=int,
+        default=None,
+        help="number of files to render in parallel, across all operations.  "
+        + "(default: chosen by the thread pool)"),
+    arg("--stream",
+        action="store_true",
+        help="write rendered files in chunks as they are produced, "
+        + "rather than rendering each file fully in memory."),
+])
+def batch(args):
+    """
+    Run many `start` operations from a spec file in a single process.  Every
+    operation is validated and planned before any file is written.
+
+    The spec is a list of operations, or a mapping with an `operations` list
+    and optional `target_root` and `on_exists` defaults.  Each operation has a
+    `template`, and optionally a `variant`, `examples`, `on_exists`,
+    `target_root`, and `args` mapping template variables to values:
+
+        target_root: .
+        operations:
+          - template: app
+            args: {app_name: my_app}
+          - template: pipeline
+            args: {app_name: my_app, pipeline_name: train}
+    """
+    operations, defaults = load_batch_spec(args.spec)
+
+    # validate every operation by parsing it as a `start` command line
+    operation_jobs = []
+    for index, operation in enumerate(operations, start=1):
+        argv = batch_operation_argv(operation, defaults, index)
+        try:
+            start_args = parse_command(argv)
+        except SystemExit:
+            raise ValueError(
+                f"Invalid batch operation {index}: {' '.join(argv)}") from None
+        start_args.stream = args.stream
+        operation_jobs.append((start_args, create_start_jobs(start_args)))
+
+    jobs = [job for _, template_jobs in operation_jobs for job in template_jobs]
+    plans = [job.plan() for job in jobs]
+    check_plan_conflicts(plans)
+
+    # create all directories up front, then render the files of every job on
+    # one shared pool
+    for job, plan in zip(jobs, plans):
+        job.create_directories(plan)
+    with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        futures = [
+            [pool.submit(job.render_file, planned) for planned in plan.files]
+            for job, plan in zip(jobs, plans)
+        ]
+        results = [[future.result() for future in fs] for fs in futures]
+    for job, job_results in zip(jobs, results):
+        job.record_results(job_results)
+
+    # report on each operation, in spec order
+    job_results = iter(results)
+    rows = []
+    for start_args, template_jobs in operation_jobs:
+        counts = Counter()
+        for _ in template_jobs:
+            counts.update(planned.action for planned in next(job_results))
+        label = f"{start_args.template} ({start_args.variant})"
+        rows.append((label, counts))
+    print_batch_report(rows)
+
+
+def load_batch_spec(path):
+    """Load a batch spec file, returning its operations and defaults"""
+    with open(path, 'r') as f:
+        if path.endswith(".json"):
+            spec = json.load(f)
+        else:
+            import yaml
+            spec = yaml.safe_load(f)
+
+    if isinstance(spec, list):
+        spec = {"operations": spec}
+    if not isinstance(spec, dict) or not isinstance(
+            spec.get("operations"), list):
+        raise ValueError(
+            f"Batch spec '{path}' must be a list of operations, or a mapping "
+            "with an `operations` list")
+
+    defaults = {
+        key: spec[key] for key in ("target_root", "on_exists") if key in spec
+    }
+    return spec["operations"], defaults
+
+
+def batch_operation_argv(operation, defaults, index):
+    """Translate a batch operation into an equivalent `start` command line"""
+    if not isinstance(operation, dict) or "template" not in operation:
+        raise ValueError(
+            f"Batch operation {index} must be a mapping with a `template`")
+    unknown_keys = set(operation) - BATCH_OPERATION_KEYS
+    if unknown_keys:
+        raise ValueError(
+            f"Batch operation {index} has unknown keys: "
+            + ", ".join(sorted(unknown_keys)))
+
+    operation = {**defaults, **operation}
+    argv = ["start"]
+    if "on_exists" in operation:
+        argv += ["--on-exists", str(operation["on_exists"])]
+    if "target_root" in operation:
+        argv += ["--target_root", str(operation["target_root"])]
+
+    argv.append(str(operation["template"]))
+    if "variant" in operation:
+        argv += ["--variant", str(operation["variant"])]
+    for example in operation.get("examples") or []:
+        argv += ["--example", str(example)]
+    for name, value in (operation.get("args") or {}).items():
+        argv += [f"--{name.lower().replace('_', '-')}", str(value)]
+    return argv
+
+
+def print_batch_report(rows):
+    """Print a table of file actions per batch operation"""
+    label_width = max([len("operation")] + [len(label) for label, _ in rows])
+    header = "  ".join(
+        [f"{'#':>3}", f"{'operation':<{label_width}}"]
+        + [f"{action:>11}" for action in BATCH_REPORT_ACTIONS])
+    print(header)
+
+    total = Counter()
+    for index, (label, counts) in enumerate(rows, start=1):
+        total.update(counts)
+        print("  ".join(
+            [f"{index:>3}", f"{label:<{label_width}}"]
+            + [f"{counts[action]:>11}" for action in BATCH_REPORT_ACTIONS]))
+    print("  ".join(
+        [f"{'':>3}", f"{'total':<{label_width}}"]
+        + [f"{total[action]:>11}" for action in BATCH_REPORT_ACTIONS]))
@@ -0,0 +1,140 @@
+"""
+Compiled index of the templates directory.
+
+Discovering templates means scanning every template directory and parsing each
+`variables.yaml`.  The manifest caches the result of that discovery on disk, and
+is only rebuilt when one of the files or directories it was built from changes.
+"""
+import hashlib
+import json
+import logging
+import os
+from typing import Any, Dict, List, Optional
+
+from .templating import get_cache_dir, get_templates_dir
+
+MANIFEST_VERSION = 1
+
+
+def get_manifest_path(templates_dir: Optional[str] = None) -> str:
+    """Path of the cached manifest for a given templates directory"""
+    if templates_dir is None:
+        templates_dir = get_templates_dir()
+    # key the cache by templates dir, so that several checkouts can coexist
+    key = hashlib.sha1(os.path.abspath(templates_dir).encode()).hexdigest()
+    return os.path.join(get_cache_dir(), f"manifest-{key[:16]}.json")
+
+
+def build_manifest(templates_dir: Optional[str] = None) -> Dict[str, Any]:
+    """Scan the templates directory and compile it into a manifest"""
+    # yaml is only needed when the manifest is (re)built
+    import yaml
+
+    if templates_dir is None:
+        templates_dir = get_templates_dir()
+
+    watched_paths = [templates_dir]
+    templates = {}
+    with os.scandir(templates_dir) as scan:
+        template_entries = sorted(
+            (entry for entry in scan if entry.is_dir()),
+            key=lambda entry: entry.name)
+
+    for entry in template_entries:
+        watched_paths.append(entry.path)
+
+        with os.scandir(entry.path) as scan:
+            variants = sorted(
+                variant.name for variant in scan if variant.is_dir())
+
+        examples = []
+        if "examples" in variants:
+            variants.remove("examples")
+            examples_path = os.path.join(entry.path, "examples")
+            watched_paths.append(examples_path)
+            with os.scandir(examples_path) as scan:
+                examples = sorted(
+                    example.name for example in scan if example.is_dir())
+
+        variables_path = os.path.join(entry.path, "variables.yaml")
+        watched_paths.append(variables_path)
+        with open(variables_path, 'r') as f:
+            variables = yaml.safe_load(f)
+        if variables is None:
+            variables = {}
+
+        templates[entry.name] = {
+            "variants": variants,
+            "examples": examples,
+            "variables": variables,
+        }
+
+    return {
+        "version": MANIFEST_VERSION,
+        "templates_dir": os.path.abspath(templates_dir),
+        "fingerprint": _fingerprint(watched_paths),
+        "templates": templates,
+    }
+
+
+def load_manifest(
+    templates_dir: Optional[str] = None,
+    rebuild: bool = False,
+) -> Dict[str, Any]:
+    """
+    Load the manifest from the on-disk cache, rebuilding it if it is missing,
+    stale, or if a rebuild is requested.
+    """
+    if templates_dir is None:
+        templates_dir = get_templates_dir()
+    manifest_path = get_manifest_path(templates_dir)
+
+    if not rebuild:
+        manifest = _read_manifest(manifest_path)
+        if manifest is not None and _is_fresh(manifest, templates_dir):
+            return manifest
+
+    manifest = build_manifest(templates_dir)
+    _write_manifest(manifest_path, manifest)
+    return manifest
+
+
+def _fingerprint(paths: List[str]) -> List[List[Any]]:
+    fingerprint = []
+    for path in paths:
+        stat = os.stat(path)
+        fingerprint.append([path, stat.st_mtime_ns, stat.st_size])
+    return fingerprint
+
+
+def _is_fresh(manifest: Dict[str, Any], templates_dir: str) -> bool:
+    if manifest.get("version") != MANIFEST_VERSION:
+        return False
+    if manifest.get("templates_dir") != os.path.abspath(templates_dir):
+        return False
+    recorded = manifest.get("fingerprint", [])
+    try:
+        current = _fingerprint([entry[0] for entry in recorded])
+    except OSError:
+        return False
+    return current == recorded
+
+
+def _read_manifest(manifest_path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(manifest_path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_manifest(manifest_path: str, manifest: Dict[str, Any]):
+    # a missing or read-only cache dir is not fatal; discovery just repeats
+    tmp_path = f"{manifest_path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, manifest_path)
+    except OSError as e:
+        logging.debug(f"Could not write template manifest cache: {e}")
@@ -0,0 +1,121 @@
+"""
+Instrumentation for template rendering.
+
+`RenderStats` is a `RenderHook` which collects per-file and per-phase timings,
+bytes written, and template cache hit rates from any number of
+`TemplateTreeJob`s.
+"""
+from collections import Counter
+import contextlib
+import json
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+from .templating import PlannedFile, RenderHook, TemplateTreeJob
+
+# per-file phases, as measured by TemplateTreeJob.render_file
+FILE_PHASES = ["compile", "render", "write"]
+
+
+class RenderStats(RenderHook):
+    """Collects metrics from the jobs it is added to as a hook"""
+
+    def __init__(self):
+        self.phase_seconds = Counter()
+        self.files = []
+        self.template_cache = Counter()
+        self._lock = threading.Lock()
+
+    def on_phase(self, job: TemplateTreeJob, phase: str, seconds: float):
+        with self._lock:
+            self.phase_seconds[phase] += seconds
+
+    def on_file(self, job: TemplateTreeJob, planned: PlannedFile):
+        with self._lock:
+            for phase in FILE_PHASES:
+                self.phase_seconds[phase] += getattr(
+                    planned, f"{phase}_seconds")
+            if planned.template_cache is not None:
+                self.template_cache[planned.template_cache] += 1
+            self.files.append({
+                "template_root": job.template_root,
+                "source": planned.source,
+                "target": planned.target,
+                "action": planned.action,
+                "static": planned.static,
+                "template_cache": planned.template_cache,
+                "compile_seconds": planned.compile_seconds,
+                "render_seconds": planned.render_seconds,
+                "write_seconds": planned.write_seconds,
+                "bytes_written": planned.bytes_written,
+            })
+
+    @property
+    def bytes_written(self) -> int:
+        return sum(file["bytes_written"] for file in self.files)
+
+    @property
+    def template_cache_hit_rate(self) -> Optional[float]:
+        """Fraction of loaded templates which did not need compiling"""
+        loads = sum(self.template_cache.values())
+        if loads == 0:
+            return None
+        return 1 - self.template_cache["compiled"] / loads
+
+    def to_dict(self) -> Dict[str, Any]:
+        actions = Counter(file["action"] for file in self.files)
+        return {
+            "phase_seconds": dict(self.phase_seconds),
+            "bytes_written": self.bytes_written,
+            "actions": dict(actions),
+            "template_cache": dict(self.template_cache),
+            "template_cache_hit_rate": self.template_cache_hit_rate,
+            "files": self.files,
+        }
+
+    def write_json(self, path: str):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+            f.write("\n")
+
+    def log_summary(self):
+        for phase in ["discover", *FILE_PHASES, "execute"]:
+            logging.info(
+                f"profile: {phase:<8} {self.phase_seconds[phase]:9.4f}s")
+        logging.info(
+            f"profile: {len(self.files)} files, "
+            f"{self.bytes_written} bytes written")
+        hit_rate = self.template_cache_hit_rate
+        if hit_rate is not None:
+            cache_counts = ", ".join(
+                f"{source}={count}"
+                for source, count in sorted(self.template_cache.items()))
+            logging.info(
+                f"profile: template cache hit rate {hit_rate:.1%} "
+                f"({cache_counts})")
+
+        # the slowest files are usually the interesting ones
+        def total_seconds(file):
+            return sum(file[f"{phase}_seconds"] for phase in FILE_PHASES)
+        for file in sorted(self.files, key=total_seconds, reverse=True)[:10]:
+            logging.info(
+                f"profile: {total_seconds(file):9.4f}s {file['target']}")
+
+
+@contextlib.contextmanager
+def cprofile(path: Optional[str]):
+    """Run the enclosed block under cProfile, dumping stats to `path`"""
+    if path is None:
+        yield
+        return
+
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        logging.info(f"cProfile stats written to: {path}")
@@ -1,6 +1,276 @@
-"""{{app_name}} Data Utilities"""
+"""{{app_name}} Data Utilities
 
-# Customize the functions below to
+Converts raw CSV or Parquet files into compressed, sharded TFRecord files, and
+streams those shards back as a tf.data.Dataset.  Converting once up front means
+training reads compact, parallelizable shards instead of re-parsing raw files
+every epoch.
 
-# def load_dataset() -> tf.data.Dataset
-#     return tf.data.Dataset.from_tensor_slices([])
+    python -m {{app_name}}.data convert --input "raw/*.csv" --output-dir shards/
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import tensorflow as tf
+
+AUTOTUNE = tf.data.AUTOTUNE
+
+# name of the file, alongside the shards, recording each column's feature type
+SCHEMA_FILE = "schema.json"
+
+COMPRESSION_SUFFIXES = {"": "", "GZIP": ".gz", "ZLIB": ".zz"}
+
+
+def convert_to_tfrecords(
+    input_paths: List[str],
+    output_dir: str,
+    records_per_shard: int = 10000,
+    compression: str = "GZIP",
+    num_workers: Optional[int] = None,
+) -> List[str]:
+    """
+    Convert CSV or Parquet files into sharded TFRecord files of tf.train.Example
+    records.  Input files are converted in parallel on a pool of processes,
+    and each is split into shards of at most `records_per_shard` records.
+    Shards are named after their input file and its position in
+    `input_paths`, so that inputs with the same name do not collide.
+    Returns the paths of the written shards.
+
+    Requires pyarrow, which streams the input files in batches rather than
+    loading them into memory.  Null values are written as NaN in float
+    columns and as empty strings in string columns, and raise a ValueError in
+    integer columns.
+    """
+    if compression not in COMPRESSION_SUFFIXES:
+        raise ValueError(
+            f"compression must be one of: {', '.join(COMPRESSION_SUFFIXES)}")
+    tf.io.gfile.makedirs(output_dir)
+
+    # tensorflow is not fork-safe, so workers are started with spawn
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=num_workers,
+                             mp_context=context) as pool:
+        futures = [
+            pool.submit(_convert_file, path, index, output_dir,
+                        records_per_shard, compression)
+            for index, path in enumerate(input_paths)
+        ]
+        results = [future.result() for future in futures]
+
+    schemas = {json.dumps(schema, sort_keys=True) for _, schema in results}
+    if len(schemas) > 1:
+        raise ValueError(f"Input files have different schemas: {schemas}")
+    if results:
+        with tf.io.gfile.GFile(os.path.join(output_dir, SCHEMA_FILE), 'w') as f:
+            json.dump(results[0][1], f, indent=2, sort_keys=True)
+
+    return [shard for shards, _ in results for shard in shards]
+
+
+def load_dataset(
+    file_pattern: str,
+    compression: str = "GZIP",
+    num_parallel_reads: int = AUTOTUNE,
+    deterministic: bool = True,
+    feature_spec: Optional[Dict[str, tf.io.FixedLenFeature]] = None,
+    num_shards: int = 1,
+    shard_index: int = 0,
+) -> tf.data.Dataset:
+    """
+    Stream records from sharded TFRecord files, reading several shards in
+    parallel.
+
+    With `deterministic`, shards are read in sorted order and records are
+    interleaved in a fixed order.  Otherwise shards are shuffled and records
+    are produced as soon as they are read, which is faster when some reads are
+    slow.  If a `feature_spec` is given, records are parsed into feature
+    dictionaries.
+
+    `num_shards` and `shard_index` split the data between the workers of a
+    distributed job, so that each worker reads only its own part.  Files are
+    divided between workers when there are enough of them, and records
+    otherwise.
+    """
+    paths = sorted(tf.io.gfile.glob(file_pattern))
+    if not paths:
+        raise ValueError(f"No files match {file_pattern}")
+    shard_files = len(paths) >= num_shards
+    if shard_files:
+        paths = paths[shard_index::num_shards]
+
+    files = tf.data.Dataset.from_tensor_slices(paths)
+    if not deterministic:
+        files = files.shuffle(len(paths))
+    dataset = files.interleave(
+        lambda path: tf.data.TFRecordDataset(
+            path, compression_type=compression),
+        cycle_length=num_parallel_reads,
+        num_parallel_calls=num_parallel_reads,
+        deterministic=deterministic,
+    )
+    if not shard_files:
+        dataset = dataset.shard(num_shards, shard_index)
+    if feature_spec is not None:
+        dataset = dataset.map(
+            lambda record: tf.io.parse_single_example(record, feature_spec),
+            num_parallel_calls=AUTOTUNE,
+            deterministic=deterministic,
+        )
+    return dataset
+
+
+def load_feature_spec(shard_dir: str) -> Dict[str, tf.io.FixedLenFeature]:
+    """Feature spec for parsing the records written by convert_to_tfrecords"""
+    with tf.io.gfile.GFile(os.path.join(shard_dir, SCHEMA_FILE), 'r') as f:
+        schema = json.load(f)
+    dtypes = {"int64": tf.int64, "float": tf.float32, "bytes": tf.string}
+    return {
+        name: tf.io.FixedLenFeature([], dtypes[kind])
+        for name, kind in schema.items()
+    }
+
+
+def _convert_file(input_path, input_index, output_dir, records_per_shard,
+                  compression):
+    """Convert a single input file; runs in a worker process"""
+    stem = os.path.splitext(os.path.basename(input_path))[0]
+    prefix = f"{stem}-{input_index:05d}"
+    suffix = ".tfrecord" + COMPRESSION_SUFFIXES[compression]
+    options = tf.io.TFRecordOptions(compression_type=compression)
+
+    shards = []
+    writer = None
+    schema = None
+    shard_records = 0
+    try:
+        for batch in _read_batches(input_path):
+            if schema is None:
+                schema = _feature_types(batch.schema)
+            columns = {
+                name: batch.column(i).to_pylist()
+                for i, name in enumerate(batch.schema.names)
+            }
+            for row in range(batch.num_rows):
+                if writer is None or shard_records >= records_per_shard:
+                    if writer is not None:
+                        writer.close()
+                    shard_path = os.path.join(
+                        output_dir, f"{prefix}-{len(shards):05d}{suffix}")
+                    writer = tf.io.TFRecordWriter(shard_path, options)
+                    shards.append(shard_path)
+                    shard_records = 0
+                values = {name: column[row] for name, column in columns.items()}
+                try:
+                    example = _to_example(values, schema)
+                except ValueError as e:
+                    raise ValueError(f"{input_path}: {e}") from e
+                writer.write(example.SerializeToString())
+                shard_records += 1
+    finally:
+        if writer is not None:
+            writer.close()
+    return shards, schema or {}
+
+
+def _read_batches(input_path):
+    """Stream record batches from a CSV or Parquet file"""
+    import pyarrow.csv
+    import pyarrow.fs
+    import pyarrow.parquet
+
+    # opened with a pyarrow filesystem, so that gs:// and other remote paths
+    # can be read
+    if "://" in input_path:
+        filesystem, path = pyarrow.fs.FileSystem.from_uri(input_path)
+    else:
+        filesystem = pyarrow.fs.LocalFileSystem()
+        path = os.path.abspath(input_path)
+    with filesystem.open_input_file(path) as f:
+        if input_path.endswith(".parquet"):
+            yield from pyarrow.parquet.ParquetFile(f).iter_batches()
+        else:
+            yield from pyarrow.csv.open_csv(f)
+
+
+def _feature_types(arrow_schema) -> Dict[str, str]:
+    import pyarrow
+
+    feature_types = {}
+    for field in arrow_schema:
+        if (pyarrow.types.is_integer(field.type)
+                or pyarrow.types.is_boolean(field.type)):
+            feature_types[field.name] = "int64"
+        elif pyarrow.types.is_floating(field.type):
+            feature_types[field.name] = "float"
+        else:
+            feature_types[field.name] = "bytes"
+    return feature_types
+
+
+def _to_example(row, schema) -> tf.train.Example:
+    feature = {}
+    for name, kind in schema.items():
+        value = row[name]
+        if kind == "int64":
+            if value is None:
+                # unlike floats, integers have no value to mark a missing one
+                raise ValueError(f"Integer column '{name}' has a null value")
+            feature[name] = tf.train.Feature(
+                int64_list=tf.train.Int64List(value=[int(value)]))
+        elif kind == "float":
+            value = float("nan") if value is None else value
+            feature[name] = tf.train.Feature(
+                float_list=tf.train.FloatList(value=[value]))
+        else:
+            value = b"" if value is None else str(value).encode()
+            feature[name] = tf.train.Feature(
+                bytes_list=tf.train.BytesList(value=[value]))
+    return tf.train.Example(features=tf.train.Features(feature=feature))
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="{{app_name}} data utilities.")
+    commands = parser.add_subparsers(
+        help="commands", dest="command", required=True)
+
+    cmd_convert = commands.add_parser(
+        "convert", help="convert CSV or Parquet files to sharded TFRecords.")
+    cmd_convert.add_argument(
+        "--input", required=True,
+        help="glob pattern of input .csv or .parquet files.")
+    cmd_convert.add_argument(
+        "--output-dir", required=True, help="directory to write shards to.")
+    cmd_convert.add_argument(
+        "--records-per-shard", type=int, default=10000,
+        help="maximum number of records per shard.")
+    cmd_convert.add_argument(
+        "--compression", default="GZIP", choices=list(COMPRESSION_SUFFIXES),
+        help="shard compression.")
+    cmd_convert.add_argument(
+        "--workers", type=int, default=None,
+        help="number of worker processes.  (default: number of CPUs)")
+
+    return parser.parse_args()
+
+
+def main(args):
+    if args.command == "convert":
+        input_paths = sorted(tf.io.gfile.glob(args.input))
+        shards = convert_to_tfrecords(
+            input_paths,
+            args.output_dir,
+            records_per_shard=args.records_per_shard,
+            compression=args.compression,
+            num_workers=args.workers,
+        )
+        print(f"Wrote {len(shards)} shards to {args.output_dir}")
+    else:
+        print(f"Command not implemented: {args.command}")
+
+
+if __name__ == "__main__":
+    main(parse_args())
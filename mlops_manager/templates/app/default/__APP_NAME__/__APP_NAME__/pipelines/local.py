@@ -0,0 +1,358 @@
+"""{{app_name}} Local Pipeline Runner
+
+Runs a compiled pipeline package on this machine rather than on Vertex AI, for
+quick iteration without network access.  Each step runs as a local process, or
+in docker, as soon as the steps it depends on have finished, so independent
+steps run concurrently.  Artifacts are passed between steps through a local
+directory, where each step's outputs are kept under a key of its spec, its
+inputs, and the runs which produced its input artifacts.  Re-runs reuse those outputs
+for steps which have not changed.
+
+    python -m {{app_name}}.pipelines.<pipeline> compile -o package.json
+    python -m {{app_name}}.pipelines.<pipeline> run-local --package package.json
+
+Only container and Python-function components are supported.  Steps which call
+Google Cloud services, such as google-cloud-pipeline-components, still do so
+when run locally.
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, NamedTuple, Optional, Set
+
+import yaml
+
+# placeholders in component commands, e.g. inputs.parameters['name'] wrapped
+# in double braces with a leading `$`
+PLACEHOLDER = re.compile(r"\{\{\$(.*?)\}\}")
+PLACEHOLDER_PATH = re.compile(
+    r"\.(inputs|outputs)\.(parameters|artifacts)\['([^']+)'\](?:\.(\w+))?$")
+
+# name of the file, in each step's directory, recording a finished step
+RESULT_FILE = "result.json"
+
+
+class LocalStep(NamedTuple):
+    """A task of the pipeline's DAG, with the container it runs"""
+    name: str
+    image: str
+    command: List[str]
+    inputs: Dict[str, Any]
+    output_parameters: List[str]
+    output_artifacts: List[str]
+    dependencies: Set[str]
+    enable_caching: bool
+
+
+class StepResult(NamedTuple):
+    name: str
+    status: str  # ran, cached, failed or skipped
+    seconds: float = 0.0
+    directory: Optional[str] = None
+    parameters: Dict[str, str] = {}
+    artifacts: Dict[str, str] = {}
+    run_id: Optional[str] = None  # identifies the run which wrote the outputs
+    error: Optional[str] = None
+
+
+def load_pipeline_spec(package_path: str) -> Dict[str, Any]:
+    """Read a compiled pipeline package, in JSON or YAML"""
+    with open(package_path) as f:
+        package = yaml.safe_load(f)
+    # KFP v1 packages wrap the spec along with a runtime config
+    spec = package.get("pipelineSpec", package)
+    defaults = {
+        name: _unwrap(value)
+        for name, value in package.get("runtimeConfig", {}).get(
+            "parameters", {}).items()
+    }
+    for name, definition in spec["root"].get("inputDefinitions", {}).get(
+            "parameters", {}).items():
+        if "defaultValue" in definition:
+            defaults.setdefault(name, definition["defaultValue"])
+    spec["defaultParameters"] = defaults
+    return spec
+
+
+def build_dag(spec: Dict[str, Any]) -> Dict[str, LocalStep]:
+    """Steps of a pipeline spec by task name"""
+    executors = spec["deploymentSpec"]["executors"]
+    steps = {}
+    for name, task in spec["root"]["dag"]["tasks"].items():
+        component = spec["components"][task["componentRef"]["name"]]
+        if "dag" in component:
+            raise ValueError(
+                f"Step {name} is a nested pipeline, which cannot be run "
+                "locally")
+        executor = executors[component["executorLabel"]]
+        if "container" not in executor:
+            raise ValueError(
+                f"Step {name} is not a container component, and cannot be "
+                "run locally")
+        container = executor["container"]
+
+        inputs = task.get("inputs", {})
+        dependencies = set(task.get("dependentTasks", []))
+        for value in inputs.get("parameters", {}).values():
+            if "taskOutputParameter" in value:
+                dependencies.add(value["taskOutputParameter"]["producerTask"])
+        for value in inputs.get("artifacts", {}).values():
+            if "taskOutputArtifact" in value:
+                dependencies.add(value["taskOutputArtifact"]["producerTask"])
+
+        outputs = component.get("outputDefinitions", {})
+        steps[name] = LocalStep(
+            name=name,
+            image=container.get("image", ""),
+            command=container.get("command", []) + container.get("args", []),
+            inputs=inputs,
+            output_parameters=sorted(outputs.get("parameters", {})),
+            output_artifacts=sorted(outputs.get("artifacts", {})),
+            dependencies=dependencies,
+            enable_caching=task.get("cachingOptions", {}).get(
+                "enableCache", True),
+        )
+
+    unknown = {d for step in steps.values() for d in step.dependencies
+               } - set(steps)
+    if unknown:
+        raise ValueError(f"Unknown steps: {', '.join(sorted(unknown))}")
+    return steps
+
+
+def run_pipeline(
+    package_path: str,
+    root: str,
+    parameters: Dict[str, Any] = {},
+    jobs: Optional[int] = None,
+    docker: bool = False,
+    use_cache: bool = True,
+    log=print,
+) -> Dict[str, StepResult]:
+    """
+    Run a compiled pipeline, with up to `jobs` steps at once, writing step
+    outputs under `root`.  Steps which fail, including those which cannot be
+    started, skip the steps which depend on them, while independent steps
+    still run.  Returns each step's result.
+    """
+    spec = load_pipeline_spec(package_path)
+    steps = build_dag(spec)
+    parameters = {**spec["defaultParameters"], **parameters}
+    root = os.path.abspath(root)
+
+    results: Dict[str, StepResult] = {}
+    pending = dict(steps)
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as executor:
+        running = {}
+        while pending or running:
+            for name, step in list(pending.items()):
+                if not step.dependencies <= set(results):
+                    continue
+                del pending[name]
+                if any(results[d].status in ("failed", "skipped")
+                       for d in step.dependencies):
+                    results[name] = StepResult(name, "skipped")
+                    log(f"{name}: skipped")
+                    continue
+                future = executor.submit(_run_step, step, parameters,
+                                         results, root, docker, use_cache)
+                running[future] = name
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                del running[future]
+                results[result.name] = result
+                log(f"{result.name}: {result.status} "
+                    f"in {result.seconds:.2f}s"
+                    + (f": {result.error}" if result.error else ""))
+    return results
+
+
+def format_timings(results: Dict[str, StepResult]) -> str:
+    """A table of each step's status and duration"""
+    rows = [("step", "status", "seconds")] + [
+        (r.name, r.status, f"{r.seconds:.2f}") for r in results.values()
+    ]
+    widths = [max(len(row[i]) for row in rows) for i in range(3)]
+    return "\n".join(
+        "  ".join(cell.ljust(width) for cell, width in zip(row, widths))
+        for row in rows)
+
+
+def _run_step(step, parameters, results, root, docker, use_cache):
+    try:
+        return _execute_step(step, parameters, results, root, docker,
+                             use_cache)
+    except (KeyError, ValueError, OSError) as e:
+        # e.g. a missing parameter or placeholder, or no docker binary
+        return StepResult(step.name, "failed",
+                          error=f"{type(e).__name__}: {e}")
+
+
+def _execute_step(step, parameters, results, root, docker, use_cache):
+    inputs = _resolve_inputs(step, parameters, results)
+    key = _cache_key(step, inputs, results)
+    directory = os.path.join(root, f"{step.name}-{key[:16]}")
+    result_path = os.path.join(directory, RESULT_FILE)
+
+    if use_cache and step.enable_caching and os.path.exists(result_path):
+        with open(result_path) as f:
+            cached = json.load(f)
+        return StepResult(step.name, "cached", 0.0, directory,
+                          cached["parameters"], cached["artifacts"],
+                          cached.get("run_id"))
+
+    shutil.rmtree(directory, ignore_errors=True)
+    artifacts = {
+        name: os.path.join(directory, "artifacts", name)
+        for name in step.output_artifacts
+    }
+    parameter_files = {
+        name: os.path.join(directory, "parameters", name)
+        for name in step.output_parameters
+    }
+    for path in list(artifacts.values()) + list(parameter_files.values()):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    executor_output = os.path.join(directory, "executor_output.json")
+
+    command = _substitute(step.command, inputs, artifacts, parameter_files,
+                          executor_output)
+    if docker:
+        command = ["docker", "run", "--rm", "-v", f"{root}:{root}",
+                   "--entrypoint", command[0], step.image] + command[1:]
+    elif command and command[0] in ("python", "python3"):
+        # run python steps in this interpreter's environment
+        command = [sys.executable] + command[1:]
+
+    start = time.perf_counter()
+    with open(os.path.join(directory, "log.txt"), 'w') as log_file:
+        returncode = subprocess.call(command, stdout=log_file,
+                                     stderr=subprocess.STDOUT)
+    seconds = time.perf_counter() - start
+    if returncode != 0:
+        return StepResult(step.name, "failed", seconds, directory)
+
+    output_parameters = {}
+    for name, path in parameter_files.items():
+        if os.path.exists(path):
+            with open(path) as f:
+                output_parameters[name] = f.read()
+    run_id = uuid.uuid4().hex
+    with open(result_path, 'w') as f:
+        json.dump({"parameters": output_parameters, "artifacts": artifacts,
+                   "run_id": run_id}, f, indent=2)
+    return StepResult(step.name, "ran", seconds, directory,
+                      output_parameters, artifacts, run_id)
+
+
+def _resolve_inputs(step, parameters, results) -> Dict[str, Dict[str, Any]]:
+    """Values of a step's input parameters and paths of its input artifacts"""
+    resolved = {"parameters": {}, "artifacts": {}}
+    for name, value in step.inputs.get("parameters", {}).items():
+        if "componentInputParameter" in value:
+            parameter = value["componentInputParameter"]
+            if parameter not in parameters:
+                raise ValueError(f"Missing pipeline parameter {parameter}")
+            resolved["parameters"][name] = parameters[parameter]
+        elif "taskOutputParameter" in value:
+            output = value["taskOutputParameter"]
+            resolved["parameters"][name] = results[
+                output["producerTask"]].parameters[
+                    output["outputParameterKey"]]
+        else:
+            runtime_value = value.get("runtimeValue", {})
+            resolved["parameters"][name] = _unwrap(
+                runtime_value.get("constantValue",
+                                  runtime_value.get("constant")))
+    for name, value in step.inputs.get("artifacts", {}).items():
+        output = value["taskOutputArtifact"]
+        resolved["artifacts"][name] = results[
+            output["producerTask"]].artifacts[output["outputArtifactKey"]]
+    return resolved
+
+
+def _cache_key(step, inputs, results) -> str:
+    """
+    Key of a step's spec, inputs, and the runs which produced its input
+    artifacts.  A step without caching re-runs into the same directory, so an
+    artifact's path does not change along with its content, but the id of the
+    run which wrote it does.
+    """
+    producer_runs = {
+        name: results[value["taskOutputArtifact"]["producerTask"]].run_id
+        for name, value in step.inputs.get("artifacts", {}).items()
+    }
+    digest = hashlib.sha256()
+    digest.update(json.dumps(
+        [step.image, step.command, inputs, producer_runs],
+        sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def _substitute(command, inputs, artifacts, parameter_files, executor_output):
+    executor_input = {
+        "inputs": {
+            "parameterValues": inputs["parameters"],
+            "parameters": {
+                name: {"stringValue": _to_string(value)}
+                for name, value in inputs["parameters"].items()
+            },
+            "artifacts": {
+                name: {"artifacts": [{"name": name, "uri": path}]}
+                for name, path in inputs["artifacts"].items()
+            },
+        },
+        "outputs": {
+            "parameters": {
+                name: {"outputFile": path}
+                for name, path in parameter_files.items()
+            },
+            "artifacts": {
+                name: {"artifacts": [{"name": name, "uri": path}]}
+                for name, path in artifacts.items()
+            },
+            "outputFile": executor_output,
+        },
+    }
+
+    def replace(match):
+        expression = match.group(1)
+        if not expression:
+            return json.dumps(executor_input)
+        if expression == ".outputs.output_file":
+            return executor_output
+        path = PLACEHOLDER_PATH.match(expression)
+        if path is None:
+            raise ValueError(f"Unsupported placeholder: {match.group(0)}")
+        direction, kind, name, attribute = path.groups()
+        if direction == "inputs" and kind == "parameters":
+            return _to_string(inputs["parameters"][name])
+        if direction == "inputs":
+            return inputs["artifacts"][name]
+        if kind == "parameters":
+            return parameter_files[name]
+        return artifacts[name]
+
+    return [PLACEHOLDER.sub(replace, part) for part in command]
+
+
+def _unwrap(value):
+    """Plain value of a KFP v1 typed value, e.g. a dict with `intValue`"""
+    if isinstance(value, dict) and len(value) == 1:
+        key = next(iter(value))
+        if key in ("stringValue", "intValue", "doubleValue"):
+            return value[key]
+    return value
+
+
+def _to_string(value) -> str:
+    return value if isinstance(value, str) else json.dumps(value)
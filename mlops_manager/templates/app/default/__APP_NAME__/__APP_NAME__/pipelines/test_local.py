@@ -0,0 +1,197 @@
+"""{{app_name}} local pipeline runner unit tests"""
+import json
+import os
+
+from {{app_name}}.pipelines import local
+
+
+def placeholder(expression):
+    return "{" "{$" + expression + "}" "}"
+
+
+# reads its input artifacts, then writes its start and end times to an
+# output artifact after a delay
+STEP_SCRIPT = """
+import sys, time
+start = time.time()
+for path in sys.argv[3:]:
+    open(path).read()
+time.sleep(float(sys.argv[1]))
+with open(sys.argv[2], "w") as f:
+    f.write(f"{start} {time.time()}")
+"""
+
+ARTIFACT_OUTPUTS = {
+    "artifacts": {"out": {"artifactType": {"schemaTitle": "system.Dataset"}}}
+}
+
+
+def container(inputs=(), delay=0.5):
+    command = ["python3", "-c", STEP_SCRIPT, str(delay),
+               placeholder(".outputs.artifacts['out'].path")]
+    for name in inputs:
+        command += [placeholder(f".inputs.artifacts['{name}'].path")]
+    return {"image": "python:3", "command": command}
+
+
+def write_package(path, message="hello"):
+    """
+    A pipeline of four steps: `first` writes a message, `left` and `right`
+    both depend on it, and `last` depends on both.
+    """
+    echo = {
+        "image": "python:3",
+        "command": [
+            "python3", "-c",
+            "import sys; open(sys.argv[2], 'w').write(sys.argv[1])",
+            placeholder(".inputs.parameters['message']"),
+            placeholder(".outputs.parameters['message'].output_file"),
+        ],
+    }
+    spec = {
+        "components": {
+            "comp-echo": {
+                "executorLabel": "exec-echo",
+                "inputDefinitions": {"parameters": {"message": {}}},
+                "outputDefinitions": {"parameters": {"message": {}}},
+            },
+            "comp-branch": {"executorLabel": "exec-branch",
+                            "outputDefinitions": ARTIFACT_OUTPUTS},
+            "comp-last": {"executorLabel": "exec-last",
+                          "outputDefinitions": ARTIFACT_OUTPUTS},
+        },
+        "deploymentSpec": {"executors": {
+            "exec-echo": {"container": echo},
+            "exec-branch": {"container": container(delay=0.5)},
+            "exec-last": {"container": container(inputs=["left", "right"],
+                                                 delay=0)},
+        }},
+        "root": {
+            "inputDefinitions": {"parameters": {"message": {}}},
+            "dag": {"tasks": {
+                "first": {
+                    "componentRef": {"name": "comp-echo"},
+                    "inputs": {"parameters": {
+                        "message": {"componentInputParameter": "message"}
+                    }},
+                },
+                "left": {"componentRef": {"name": "comp-branch"},
+                         "dependentTasks": ["first"]},
+                "right": {"componentRef": {"name": "comp-branch"},
+                          "dependentTasks": ["first"]},
+                "last": {
+                    "componentRef": {"name": "comp-last"},
+                    "inputs": {"artifacts": {
+                        name: {"taskOutputArtifact": {
+                            "producerTask": name, "outputArtifactKey": "out"}}
+                        for name in ["left", "right"]
+                    }},
+                },
+            }},
+        },
+    }
+    with open(path, 'w') as f:
+        json.dump({"pipelineSpec": spec, "runtimeConfig": {"parameters": {
+            "message": {"stringValue": message}}}}, f)
+
+
+def read_times(result):
+    with open(result.artifacts["out"]) as f:
+        return [float(t) for t in f.read().split()]
+
+
+def test_build_dag(tmp_path):
+    write_package(tmp_path / "package.json")
+    spec = local.load_pipeline_spec(str(tmp_path / "package.json"))
+    steps = local.build_dag(spec)
+
+    assert steps["last"].dependencies == {"left", "right"}
+    assert steps["left"].dependencies == {"first"}
+    assert spec["defaultParameters"] == {"message": "hello"}
+
+
+def test_runs_independent_steps_concurrently(tmp_path):
+    write_package(tmp_path / "package.json")
+    results = local.run_pipeline(str(tmp_path / "package.json"),
+                                 str(tmp_path / "root"), jobs=4,
+                                 log=lambda _: None)
+
+    assert {r.status for r in results.values()} == {"ran"}
+    assert results["first"].parameters == {"message": "hello"}
+    left_start, left_end = read_times(results["left"])
+    right_start, right_end = read_times(results["right"])
+    assert left_start < right_end and right_start < left_end
+    assert "last" in local.format_timings(results)
+
+
+def test_reruns_only_changed_steps(tmp_path):
+    package_path = str(tmp_path / "package.json")
+    root = str(tmp_path / "root")
+    write_package(package_path)
+    local.run_pipeline(package_path, root, log=lambda _: None)
+
+    results = local.run_pipeline(package_path, root, log=lambda _: None)
+    assert {r.status for r in results.values()} == {"cached"}
+
+    # a new parameter re-runs its step, but not steps which do not use it
+    results = local.run_pipeline(package_path, root,
+                                 parameters={"message": "bye"},
+                                 log=lambda _: None)
+    assert results["first"].status == "ran"
+    assert results["first"].parameters == {"message": "bye"}
+    assert results["left"].status == "cached"
+
+
+def test_steps_without_caching_rerun_their_dependents(tmp_path):
+    package_path = str(tmp_path / "package.json")
+    root = str(tmp_path / "root")
+    write_package(package_path)
+    with open(package_path) as f:
+        package = json.load(f)
+    tasks = package["pipelineSpec"]["root"]["dag"]["tasks"]
+    tasks["left"]["cachingOptions"] = {"enableCache": False}
+    with open(package_path, 'w') as f:
+        json.dump(package, f)
+    local.run_pipeline(package_path, root, log=lambda _: None)
+
+    # `left` re-runs into the same directory, and `last` reads its new output
+    results = local.run_pipeline(package_path, root, log=lambda _: None)
+    assert results["left"].status == "ran"
+    assert results["last"].status == "ran"
+    assert results["right"].status == "cached"
+
+
+def test_failed_steps_skip_their_dependents(tmp_path):
+    package_path = str(tmp_path / "package.json")
+    write_package(package_path)
+    with open(package_path) as f:
+        package = json.load(f)
+    executors = package["pipelineSpec"]["deploymentSpec"]["executors"]
+    executors["exec-echo"]["container"]["command"][2] = "raise SystemExit(1)"
+    with open(package_path, 'w') as f:
+        json.dump(package, f)
+
+    results = local.run_pipeline(package_path, str(tmp_path / "root"),
+                                 log=lambda _: None)
+
+    assert results["first"].status == "failed"
+    assert os.path.exists(os.path.join(results["first"].directory, "log.txt"))
+    assert {results[name].status for name in ["left", "right", "last"]} == {
+        "skipped"}
+
+
+def test_steps_which_cannot_start_fail(tmp_path):
+    package_path = str(tmp_path / "package.json")
+    write_package(package_path)
+    with open(package_path) as f:
+        package = json.load(f)
+    del package["runtimeConfig"]
+    with open(package_path, 'w') as f:
+        json.dump(package, f)
+
+    results = local.run_pipeline(package_path, str(tmp_path / "root"),
+                                 log=lambda _: None)
+
+    assert results["first"].status == "failed"
+    assert "message" in results["first"].error
+    assert results["last"].status == "skipped"
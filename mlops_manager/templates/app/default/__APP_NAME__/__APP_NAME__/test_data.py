@@ -0,0 +1,126 @@
+"""{{app_name}} data utilities unit tests"""
+import csv
+import time
+
+import pytest
+
+from {{app_name}} import data
+
+# a deliberately low floor, which only catches pathological regressions
+MIN_RECORDS_PER_SECOND = 1000
+
+
+def write_csv(path, start, count):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["id", "value", "label"])
+        for i in range(start, start + count):
+            writer.writerow([i, i * 0.5, f"label_{i % 3}"])
+
+
+def convert_csvs(tmp_path, num_files, rows_per_file, records_per_shard):
+    raw_dir = tmp_path / "raw"
+    raw_dir.mkdir()
+    paths = []
+    for i in range(num_files):
+        path = str(raw_dir / f"part{i}.csv")
+        write_csv(path, i * rows_per_file, rows_per_file)
+        paths.append(path)
+
+    shard_dir = str(tmp_path / "shards")
+    shards = data.convert_to_tfrecords(
+        paths, shard_dir, records_per_shard=records_per_shard, num_workers=2)
+    return shard_dir, shards
+
+
+def test_convert_shards_and_round_trips(tmp_path):
+    shard_dir, shards = convert_csvs(
+        tmp_path, num_files=2, rows_per_file=250, records_per_shard=100)
+
+    # 250 rows per file split into shards of at most 100 records
+    assert len(shards) == 6
+
+    feature_spec = data.load_feature_spec(shard_dir)
+    dataset = data.load_dataset(f"{shard_dir}/*.tfrecord.gz",
+                                feature_spec=feature_spec)
+    rows = list(dataset.as_numpy_iterator())
+
+    assert sorted(int(row["id"]) for row in rows) == list(range(500))
+    row = next(row for row in rows if row["id"] == 7)
+    assert row["value"] == pytest.approx(3.5)
+    assert row["label"] == b"label_1"
+
+
+def test_inputs_with_the_same_name_do_not_collide(tmp_path):
+    paths = []
+    for i, name in enumerate(["a/2023.01.csv", "a/2023.02.csv",
+                              "b/2023.01.csv"]):
+        path = tmp_path / name
+        path.parent.mkdir(exist_ok=True)
+        write_csv(str(path), i * 50, 50)
+        paths.append(str(path))
+
+    shard_dir = str(tmp_path / "shards")
+    shards = data.convert_to_tfrecords(paths, shard_dir, num_workers=3)
+
+    assert len(set(shards)) == 3
+    dataset = data.load_dataset(f"{shard_dir}/*.tfrecord.gz",
+                                feature_spec=data.load_feature_spec(shard_dir))
+    ids = sorted(int(row["id"]) for row in dataset.as_numpy_iterator())
+    assert ids == list(range(150))
+
+
+def test_deterministic_load_is_repeatable(tmp_path):
+    shard_dir, _ = convert_csvs(
+        tmp_path, num_files=2, rows_per_file=100, records_per_shard=30)
+    pattern = f"{shard_dir}/*.tfrecord.gz"
+
+    first = list(data.load_dataset(pattern, deterministic=True))
+    second = list(data.load_dataset(pattern, deterministic=True))
+
+    assert [r.numpy() for r in first] == [r.numpy() for r in second]
+
+
+def test_streaming_load_throughput(tmp_path):
+    shard_dir, _ = convert_csvs(
+        tmp_path, num_files=4, rows_per_file=5000, records_per_shard=1000)
+    dataset = data.load_dataset(f"{shard_dir}/*.tfrecord.gz",
+                                deterministic=False)
+
+    start = time.perf_counter()
+    count = sum(1 for _ in dataset)
+    records_per_second = count / (time.perf_counter() - start)
+    print(f"load_dataset throughput: {records_per_second:.0f} records/sec")
+
+    assert count == 20000
+    assert records_per_second > MIN_RECORDS_PER_SECOND
+
+
+@pytest.mark.parametrize("pattern,expected", [
+    # 8 files divided between the workers
+    ("*.tfrecord.gz", range(200)),
+    # too few files, so records are divided between the workers
+    ("part0-00000-0000[01].tfrecord.gz", range(60)),
+])
+def test_worker_shards_are_disjoint(tmp_path, pattern, expected):
+    shard_dir, _ = convert_csvs(
+        tmp_path, num_files=2, rows_per_file=100, records_per_shard=30)
+    feature_spec = data.load_feature_spec(shard_dir)
+
+    ids = []
+    for index in range(3):
+        dataset = data.load_dataset(f"{shard_dir}/{pattern}",
+                                    feature_spec=feature_spec,
+                                    num_shards=3, shard_index=index)
+        ids.extend(int(row["id"]) for row in dataset.as_numpy_iterator())
+
+    assert sorted(ids) == list(expected)
+
+
+def test_null_integers_are_rejected(tmp_path):
+    path = tmp_path / "nulls.csv"
+    path.write_text("id,value\n1,0.5\n,1.5\n")
+
+    with pytest.raises(ValueError, match="Integer column 'id'"):
+        data.convert_to_tfrecords([str(path)], str(tmp_path / "shards"),
+                                  num_workers=1)
@@ -0,0 +1,47 @@
+#!/bin/bash
+#
+# Report the app image's size and build times: a build from the current
+# state of the docker cache, a rebuild without changes, and a rebuild after a
+# source change.  The source change is a throwaway module which is removed
+# afterwards.
+#
+#   bin/docker_benchmark.sh [IMAGE_TAG]
+
+set -euo pipefail
+
+readonly PROJECT_DIR="$( cd "$( dirname "${BASH_SOURCE[0]}" )/.." &> /dev/null && pwd )"
+readonly IMAGE_TAG="${1:-{{app_name}}:benchmark}"
+readonly PROBE_FILE="${PROJECT_DIR}/{{app_name}}/_docker_benchmark_probe.py"
+
+export DOCKER_BUILDKIT=1
+
+if ! command -v docker > /dev/null
+then
+    echo "ERROR: Could not find docker."
+    exit 1
+fi
+
+# seconds taken to build the image
+timed_build() {
+    local start end
+    start="$(date +%s.%N)"
+    docker build --quiet --tag "${IMAGE_TAG}" "${PROJECT_DIR}" > /dev/null
+    end="$(date +%s.%N)"
+    python3 -c "print(f'{${end} - ${start}:.1f}')"
+}
+
+trap 'rm -f "${PROBE_FILE}"' EXIT
+
+echo "building ${IMAGE_TAG}"
+build_seconds="$(timed_build)"
+unchanged_seconds="$(timed_build)"
+echo "# $(date)" > "${PROBE_FILE}"
+source_seconds="$(timed_build)"
+
+image_bytes="$(docker image inspect "${IMAGE_TAG}" \
+    | python3 -c 'import json, sys; print(json.load(sys.stdin)[0]["Size"])')"
+
+echo "image size:                  $(( image_bytes / 1000000 )) MB"
+echo "build:                       ${build_seconds}s"
+echo "rebuild without changes:     ${unchanged_seconds}s"
+echo "rebuild after source change: ${source_seconds}s"
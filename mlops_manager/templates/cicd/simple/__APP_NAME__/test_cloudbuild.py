@@ -0,0 +1,110 @@
+"""{{app_name}} cloud build config tests
+
+Checks the step graph of cloudbuild.yaml offline, without submitting a build.
+"""
+import os
+import re
+
+import yaml
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "cloudbuild.yaml")
+
+# substitutions which cloud build provides for every build
+BUILTIN_SUBSTITUTIONS = {
+    "PROJECT_ID", "PROJECT_NUMBER", "BUILD_ID", "LOCATION", "TRIGGER_NAME",
+    "COMMIT_SHA", "SHORT_SHA", "REVISION_ID", "REPO_NAME", "BRANCH_NAME",
+    "TAG_NAME", "SERVICE_ACCOUNT_EMAIL",
+}
+
+# references to substitutions, e.g. $PROJECT_ID or ${SHORT_SHA:-local}, but
+# not escaped shell variables such as $$HOME
+SUBSTITUTION = re.compile(r"(?<!\$)\$(?:\{(\w+)|(\w+))")
+
+
+def load_config():
+    with open(CONFIG_PATH) as f:
+        return yaml.safe_load(f)
+
+
+def step_dependencies(config):
+    """
+    Steps which each step waits for.  A step without `waitFor` waits for all
+    earlier steps, and `waitFor: ['-']` starts with the build.
+    """
+    dependencies = {}
+    for step in config["steps"]:
+        wait_for = step.get("waitFor", list(dependencies))
+        dependencies[step["id"]] = set(wait_for) - {"-"}
+    return dependencies
+
+
+def ancestors(dependencies, step_id):
+    found = set()
+    pending = list(dependencies[step_id])
+    while pending:
+        ancestor = pending.pop()
+        if ancestor not in found:
+            found.add(ancestor)
+            pending.extend(dependencies[ancestor])
+    return found
+
+
+def test_steps_form_a_graph():
+    steps = load_config()["steps"]
+    ids = [step.get("id") for step in steps]
+    assert None not in ids, "every step needs an id"
+    assert len(ids) == len(set(ids)), "step ids must be unique"
+
+    # steps may only wait for earlier steps, so there are no cycles
+    seen = {"-"}
+    for step in steps:
+        unknown = set(step.get("waitFor", [])) - seen
+        assert not unknown, f"{step['id']} waits for unknown steps {unknown}"
+        seen.add(step["id"])
+
+
+def test_substitutions_are_defined():
+    config = load_config()
+    defined = set(config["substitutions"]) | BUILTIN_SUBSTITUTIONS
+    with open(CONFIG_PATH) as f:
+        text = f.read()
+    used = {a or b for a, b in SUBSTITUTION.findall(text)}
+    assert used <= defined, f"undefined substitutions {used - defined}"
+
+
+def test_independent_steps_run_in_parallel():
+    dependencies = step_dependencies(load_config())
+
+    # tests, push and compile each only need the image
+    for a, b in [("test", "push"), ("test", "compile"), ("push", "compile")]:
+        assert a not in ancestors(dependencies, b)
+        assert b not in ancestors(dependencies, a)
+
+    # the pipeline only runs once its image is tested and pushed
+    assert {"test", "push", "compile"} <= ancestors(dependencies, "run")
+
+
+def cache_images(args):
+    return [value for option, value in zip(args, args[1:])
+            if option == "--cache-from"]
+
+
+def test_build_reuses_cache_images():
+    config = load_config()
+    steps = {step["id"]: step for step in config["steps"]}
+    dependencies = step_dependencies(config)
+
+    # the builder stage is cached as an image of its own, as the app image
+    # only carries cache information for its final stage
+    builder_args = steps["build-builder"]["args"]
+    assert builder_args[builder_args.index("--target") + 1] == "builder"
+    builder_image = builder_args[builder_args.index("-t") + 1]
+    assert cache_images(builder_args) == [builder_image]
+    assert builder_image in cache_images(steps["build"]["args"])
+
+    for image in cache_images(steps["build"]["args"]):
+        assert image in " ".join(steps["pull-cache"]["args"])
+        assert image in " ".join(steps["push"]["args"])
+    assert "pull-cache" in ancestors(dependencies, "build-builder")
+    assert "build-builder" in ancestors(dependencies, "build")
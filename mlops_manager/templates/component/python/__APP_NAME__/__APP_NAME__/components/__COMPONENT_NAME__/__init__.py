@@ -0,0 +1 @@
+"""{{component_name}} component"""
@@ -0,0 +1,110 @@
+"""{{component_name}} Component
+
+A Python function component.  The pipeline runs the `{{component_name}}` function
+in the component's image, which should be a built version of the app's image so
+that the function can import the app's modules.
+https://www.kubeflow.org/docs/components/pipelines/sdk/python-function-components/
+
+Large data is passed between steps as files rather than as values: parameters
+annotated with InputPath and OutputPath receive the paths of artifact files,
+which should be read and written a chunk at a time rather than loaded whole.
+
+    from {{app_name}}.components.{{component_name}} import component
+
+    step = component.{{component_name}}_op(input_data=upstream.outputs["data"])
+"""
+
+import inspect
+import os
+from typing import NamedTuple
+
+from kfp.components import InputPath, OutputPath, create_component_from_func
+
+# strict image name of the component's image.  It is a best practice to use
+# the strict image name in component specifications, so that the expected
+# version is used in each component execution.
+BASE_IMAGE = "{{component_image}}"
+
+
+def {{component_name}}(
+    input_data_path: InputPath("CSV"),
+    output_data_path: OutputPath("CSV"),
+    timings_path: OutputPath("JSON"),
+    lines_per_chunk: int = 10000,
+) -> NamedTuple("Outputs", [("rows", int)]):
+    """
+    Copy the rows of a CSV file, a chunk at a time.  Replace the body of
+    process_chunk with the component's logic.
+
+    The function runs on its own in the component's container, so it must
+    import everything it uses within its body.  Its startup and execution
+    times are written to `timings`.
+    """
+    import json
+    import os
+    import time
+    from collections import namedtuple
+
+    start = time.time()
+
+    def process_age():
+        """Seconds since this process started, or None if unknown (Linux)"""
+        try:
+            with open("/proc/self/stat") as f:
+                start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+            with open("/proc/uptime") as f:
+                uptime = float(f.read().split()[0])
+        except (OSError, ValueError, IndexError):
+            return None
+        return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+
+    def process_chunk(lines):
+        # transform a chunk of lines of the input here
+        return lines
+
+    startup_seconds = process_age()
+    rows = 0
+    with open(input_data_path) as input_file, \
+            open(output_data_path, 'w') as output_file:
+        header = input_file.readline()
+        output_file.write(header)
+        chunk = []
+        for line in input_file:
+            chunk.append(line)
+            if len(chunk) >= lines_per_chunk:
+                output_file.writelines(process_chunk(chunk))
+                rows += len(chunk)
+                chunk = []
+        output_file.writelines(process_chunk(chunk))
+        rows += len(chunk)
+
+    timings = {"startup_seconds": startup_seconds,
+               "execution_seconds": time.time() - start}
+    print(f"{{component_name}}: {rows} rows, {json.dumps(timings)}")
+    with open(timings_path, 'w') as f:
+        json.dump(timings, f)
+    return namedtuple("Outputs", ["rows"])(rows)
+
+
+{{component_name}}_op = create_component_from_func(
+    {{component_name}}, base_image=BASE_IMAGE)
+
+
+def run_locally(output_dir, **arguments) -> dict:
+    """
+    Run the component function in this process, against local files.  Input
+    paths and other arguments are passed by parameter name, while each output
+    path is allocated in `output_dir`.  Returns the paths of the outputs and
+    the function's returned values by name.
+    """
+    outputs = {}
+    parameters = inspect.signature({{component_name}}).parameters
+    for name, parameter in parameters.items():
+        if isinstance(parameter.annotation, OutputPath):
+            os.makedirs(output_dir, exist_ok=True)
+            outputs[name] = arguments[name] = os.path.join(output_dir, name)
+
+    returned = {{component_name}}(**arguments)
+    if returned is not None:
+        outputs.update(returned._asdict())
+    return outputs
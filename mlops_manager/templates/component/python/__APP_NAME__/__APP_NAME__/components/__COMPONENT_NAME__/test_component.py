@@ -0,0 +1,52 @@
+"""{{component_name}} component unit tests"""
+import json
+import tracemalloc
+
+import pytest
+
+# components are defined with kfp, so these tests only run where the app's
+# pipeline dependencies are installed
+pytest.importorskip("kfp")
+
+from {{app_name}}.components.{{component_name}} import component  # noqa: E402
+
+
+def write_csv(path, rows):
+    with open(path, 'w') as f:
+        f.write("id,value\n")
+        f.writelines(f"{i},{i * 0.5}\n" for i in range(rows))
+
+
+def test_copies_rows_and_records_timings(tmp_path):
+    input_path = tmp_path / "input.csv"
+    write_csv(input_path, 25)
+
+    outputs = component.run_locally(
+        str(tmp_path / "outputs"),
+        input_data_path=str(input_path),
+        lines_per_chunk=10,
+    )
+
+    assert outputs["rows"] == 25
+    with open(outputs["output_data_path"]) as f:
+        assert f.read() == input_path.read_text()
+    with open(outputs["timings_path"]) as f:
+        timings = json.load(f)
+    assert timings["execution_seconds"] >= 0
+    assert timings["startup_seconds"] is None or timings["startup_seconds"] > 0
+
+
+def test_large_inputs_are_streamed(tmp_path):
+    input_path = tmp_path / "input.csv"
+    write_csv(input_path, 500000)
+    input_bytes = input_path.stat().st_size
+
+    tracemalloc.start()
+    outputs = component.run_locally(str(tmp_path / "outputs"),
+                                    input_data_path=str(input_path))
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert outputs["rows"] == 500000
+    # only a chunk of the input is held in memory at once
+    assert peak_bytes < input_bytes / 4
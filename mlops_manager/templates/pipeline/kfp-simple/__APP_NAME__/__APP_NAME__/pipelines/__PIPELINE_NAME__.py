@@ -1,12 +1,49 @@
 import kfp
+import abc
 import argparse
+import dataclasses
+import glob
+import hashlib
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import time
+import yaml
+import google_cloud_pipeline_components
+from concurrent.futures import ThreadPoolExecutor
 from kfp.v2 import compiler
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
 from google.cloud import aiplatform
 from google_cloud_pipeline_components import aiplatform as gcc_aip
+from {{app_name}}.pipelines import local
 
 PIPELINE_NAME = "{{pipeline_name}}".replace('_', '-')
 
+# component specs used by the app's pipelines
+COMPONENTS_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "components")
+
+# Step-level cache controls.  Vertex AI reuses a step's outputs from an
+# earlier run when the step and its inputs are unchanged, so that unchanged
+# steps are not re-executed.  Set `enable_caching` to False for steps which
+# must always run, e.g. because they read data which changes in place, or for
+# a single run to re-run a step without touching the resources it creates.
+STEP_CACHING = {
+    "dataset_create": {"enable_caching": True},
+    "training": {"enable_caching": True},
+    "create_endpoint": {"enable_caching": True},
+    "model_deploy": {"enable_caching": True},
+}
+
+
+def configure_step(op, step: str):
+    """Apply a step's cache controls from STEP_CACHING"""
+    op.set_caching_options(
+        STEP_CACHING.get(step, {}).get("enable_caching", True))
+    return op
+
 
 @kfp.dsl.pipeline(
     name=PIPELINE_NAME,
@@ -35,12 +72,15 @@ def pipeline(
     # Also see TabularDatasetCreateOp, TextDatasetCreateOp,
     # TimeSeriesDatasetCreateOp, and VideoDatasetCreateOp:
     # https://google-cloud-pipeline-components.readthedocs.io/en/google-cloud-pipeline-components-0.2.1/google_cloud_pipeline_components.aiplatform.html
+    #
+    # Each step's caching is configured by `configure_step`; see STEP_CACHING.
     ds_op = gcc_aip.ImageDatasetCreateOp(
         project=project_id,
         display_name=f"{PIPELINE_NAME}_dataset_create",
         gcs_source="gs://cloud-samples-data/vision/automl_classification/flowers/all_data_v2.csv",
         import_schema_uri=aiplatform.schema.dataset.ioformat.image.single_label_classification,
     )
+    configure_step(ds_op, "dataset_create")
 
     # The second step is a model training component. It takes the dataset
     # outputted from the first step, supplies it as an input argument to the
@@ -58,6 +98,7 @@ def pipeline(
         test_fraction_split=0.2,
         budget_milli_node_hours=8000,
     )
+    configure_step(training_job_run_op, "training")
 
     # For custom training:
     # custom_training_job_run_op = gcc_aip.CustomContainerTrainingJobRunOp(
@@ -76,12 +117,14 @@ def pipeline(
     #     validation_fraction_split=0.2,
     #     test_fraction_split=0.2,
     # )
+    # configure_step(custom_training_job_run_op, "training")
 
     # The third and fourth step are for deploying the model.
     create_endpoint_op = gcc_aip.EndpointCreateOp(
         project=project_id,
         display_name=f"{PIPELINE_NAME}_create_endpoint",
     )
+    configure_step(create_endpoint_op, "create_endpoint")
 
     model_deploy_op = gcc_aip.ModelDeployOp(
         model=training_job_run_op.outputs["model"],
@@ -89,31 +132,303 @@ def pipeline(
         automatic_resources_min_replica_count=1,
         automatic_resources_max_replica_count=1,
     )
+    configure_step(model_deploy_op, "model_deploy")
+
+
+def get_cache_dir() -> str:
+    """Directory of cached pipeline packages"""
+    if "PIPELINE_CACHE_DIR" in os.environ:
+        return os.environ["PIPELINE_CACHE_DIR"]
+    cache_home = os.environ.get(
+        "XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(cache_home, "{{app_name}}", "pipelines")
+
+
+def pipeline_hash() -> str:
+    """
+    Hash of everything which determines the compiled package: this module's
+    source, the app's component specs, and the versions of the pipeline SDKs.
+    """
+    digest = hashlib.sha256()
+    with open(os.path.abspath(__file__), 'rb') as f:
+        digest.update(f.read())
+
+    paths = glob.glob(os.path.join(COMPONENTS_DIR, "**", "*"), recursive=True)
+    for path in sorted(paths):
+        if not os.path.isfile(path) or "__pycache__" in path:
+            continue
+        digest.update(os.path.relpath(path, COMPONENTS_DIR).encode())
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+
+    digest.update(f"kfp=={kfp.__version__}".encode())
+    digest.update("google-cloud-pipeline-components=={}".format(
+        google_cloud_pipeline_components.__version__).encode())
+    return digest.hexdigest()
 
 
 def compile(
     package_path: str,
-):
+    cache_dir: Optional[str] = None,
+    use_cache: bool = True,
+) -> bool:
+    """
+    Compile the pipeline to a package file.  Packages are cached by
+    pipeline_hash(), and an unchanged pipeline is copied from the cache rather
+    than compiled again.  Returns whether the package came from the cache.
+    """
+    cache_dir = cache_dir or get_cache_dir()
+    cached_path = os.path.join(
+        cache_dir, f"{PIPELINE_NAME}-{pipeline_hash()}.json")
+    if use_cache and os.path.exists(cached_path):
+        shutil.copyfile(cached_path, package_path)
+        return True
+
     compiler.Compiler().compile(
         pipeline_func=pipeline,
         package_path=package_path,
     )
 
+    if use_cache:
+        # write via a temporary file, so that a concurrent build never reads
+        # a partial package
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        os.close(fd)
+        shutil.copyfile(package_path, temp_path)
+        os.replace(temp_path, cached_path)
+    return False
+
 
 def run_job(
     template_path: str,
     pipeline_root: str,
     pipeline_params: Dict[str, Any] = {},
+    enable_caching: Optional[bool] = None,
 ):
+    # enable_caching overrides the step-level cache controls for every step,
+    # while None keeps each step's own setting.
     job = aiplatform.PipelineJob(
         display_name=PIPELINE_NAME,
         template_path=template_path,
         pipeline_root=pipeline_root,
         parameter_values=pipeline_params,
+        enable_caching=enable_caching,
     )
     job.run()
 
 
+# pipeline job states after which a job will not change
+TERMINAL_STATES = {
+    "PIPELINE_STATE_SUCCEEDED",
+    "PIPELINE_STATE_FAILED",
+    "PIPELINE_STATE_CANCELLED",
+}
+
+
+class SweepClient(abc.ABC):
+    """
+    Submits pipeline jobs and reports their states.  Sweeps only use this
+    interface, so that they can be run against a fake client in tests.
+    """
+
+    @abc.abstractmethod
+    def submit(self, display_name: str, template_path: str,
+               pipeline_root: str, parameter_values: Dict[str, Any]) -> str:
+        """Start a pipeline job without waiting for it, returning its ID"""
+
+    @abc.abstractmethod
+    def get_state(self, job_id: str) -> str:
+        """Current state of a job, such as PIPELINE_STATE_RUNNING"""
+
+
+class VertexSweepClient(SweepClient):
+    """
+    Runs sweeps on Vertex AI Pipelines.  All jobs are polled through one
+    shared API client, rather than a client per job.
+    """
+
+    def __init__(self):
+        location = aiplatform.initializer.global_config.location
+        self._client = aiplatform.gapic.PipelineServiceClient(
+            client_options={
+                "api_endpoint": f"{location}-aiplatform.googleapis.com"
+            })
+
+    def submit(self, display_name, template_path, pipeline_root,
+               parameter_values):
+        job = aiplatform.PipelineJob(
+            display_name=display_name,
+            template_path=template_path,
+            pipeline_root=pipeline_root,
+            parameter_values=parameter_values,
+        )
+        job.submit()
+        return job.resource_name
+
+    def get_state(self, job_id):
+        return self._client.get_pipeline_job(name=job_id).state.name
+
+
+@dataclasses.dataclass
+class SweepRun:
+    """A single parameter set of a sweep, and the job running it"""
+    name: str
+    parameters: Dict[str, Any]
+    job_id: Optional[str] = None
+    state: str = "PENDING"
+    error: Optional[str] = None
+    submitted_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+
+def load_sweep(path: str) -> List[Dict[str, Any]]:
+    """
+    Read the parameter sets of a sweep from a YAML or JSON file, e.g.
+
+        # parameters shared by every run
+        parameters: {project_id: my-project}
+        # one run for each combination of these values
+        grid:
+          learning_rate: [0.1, 0.01]
+          epochs: [5, 10]
+        # and/or one run for each of these parameter sets
+        runs:
+          - {learning_rate: 0.05, epochs: 20}
+
+    A file containing only a list is read as a list of parameter sets.
+    """
+    with open(path) as f:
+        spec = yaml.safe_load(f)
+    if isinstance(spec, list):
+        spec = {"runs": spec}
+    return expand_sweep(spec)
+
+
+def expand_sweep(spec: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Parameter sets of a sweep spec; see load_sweep"""
+    unknown = set(spec) - {"parameters", "grid", "runs"}
+    if unknown:
+        raise ValueError(f"Unknown sweep keys: {', '.join(sorted(unknown))}")
+
+    base = spec.get("parameters") or {}
+    parameter_sets = []
+    grid = spec.get("grid") or {}
+    if grid:
+        names = list(grid)
+        for values in itertools.product(*(grid[name] for name in names)):
+            parameter_sets.append({**base, **dict(zip(names, values))})
+    for run in spec.get("runs") or []:
+        parameter_sets.append({**base, **run})
+    return parameter_sets
+
+
+def run_sweep(
+    parameter_sets: List[Dict[str, Any]],
+    client: SweepClient,
+    template_path: str,
+    pipeline_root: str,
+    parallelism: int = 4,
+    poll_interval: float = 10.0,
+    max_poll_interval: float = 120.0,
+    max_poll_errors: int = 3,
+    timeout: Optional[float] = None,
+    sleep=time.sleep,
+) -> List[SweepRun]:
+    """
+    Run a pipeline job for each parameter set, with at most `parallelism`
+    jobs unfinished at a time, polling until every job has finished or
+    `timeout` seconds have passed.  Polls back off from `poll_interval` to
+    `max_poll_interval` seconds while no job changes state.  A job whose
+    state cannot be read `max_poll_errors` times in a row is marked
+    POLL_FAILED.
+    """
+    runs = [
+        SweepRun(name=f"{PIPELINE_NAME}-sweep-{i}", parameters=parameters)
+        for i, parameters in enumerate(parameter_sets)
+    ]
+
+    def submit(run):
+        try:
+            run.job_id = client.submit(run.name, template_path, pipeline_root,
+                                       run.parameters)
+            run.state = "SUBMITTED"
+        except Exception as e:
+            run.state = "SUBMIT_FAILED"
+            run.error = str(e)
+            run.finished_at = time.monotonic()
+        run.submitted_at = time.monotonic()
+
+    start = time.monotonic()
+    interval = poll_interval
+    queued = list(runs)
+    active = []
+    poll_errors = {}
+    # submission waits on the API, so runs are submitted concurrently
+    with ThreadPoolExecutor(max_workers=parallelism) as executor:
+        while True:
+            # a job is submitted only when a running one has finished
+            batch = queued[:parallelism - len(active)]
+            del queued[:len(batch)]
+            list(executor.map(submit, batch))
+            active.extend(run for run in batch if run.job_id)
+            if batch:
+                interval = poll_interval
+            if not active:
+                if queued:
+                    continue
+                break
+            if timeout is not None and time.monotonic() - start > timeout:
+                break
+
+            sleep(interval)
+            changed = False
+            for run in active:
+                try:
+                    state = client.get_state(run.job_id)
+                except Exception as e:
+                    # the API is retried on the next poll, up to a limit
+                    poll_errors[run.name] = poll_errors.get(run.name, 0) + 1
+                    if poll_errors[run.name] >= max_poll_errors:
+                        run.state = "POLL_FAILED"
+                        run.error = str(e)
+                        run.finished_at = time.monotonic()
+                        changed = True
+                    continue
+                poll_errors.pop(run.name, None)
+                if state != run.state:
+                    run.state = state
+                    changed = True
+                if state in TERMINAL_STATES:
+                    run.finished_at = time.monotonic()
+            active = [run for run in active
+                      if run.state not in TERMINAL_STATES
+                      and run.state != "POLL_FAILED"]
+            interval = (poll_interval if changed
+                        else min(interval * 2, max_poll_interval))
+    return runs
+
+
+def format_sweep(runs: List[SweepRun]) -> str:
+    """A table summarizing the runs of a sweep"""
+    rows = [("run", "state", "minutes", "parameters")]
+    for run in runs:
+        minutes = ""
+        if run.submitted_at is not None and run.finished_at is not None:
+            minutes = f"{(run.finished_at - run.submitted_at) / 60:.1f}"
+        state = run.state.replace("PIPELINE_STATE_", "")
+        if run.error:
+            state = f"{state} ({run.error})"
+        rows.append((run.name, state, minutes,
+                     json.dumps(run.parameters, sort_keys=True)))
+
+    widths = [max(len(row[i]) for row in rows) for i in range(3)]
+    return "\n".join(
+        "  ".join(cell.ljust(width) for cell, width in zip(row, widths))
+        + "  " + row[3]
+        for row in rows)
+
+
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(
         description=f"{PIPELINE_NAME} pipeline operations.")
@@ -125,6 +440,13 @@ def parse_args() -> argparse.Namespace:
         "compile", help="compile pipeline function to a json package file.")
     cmd_compile.add_argument(
         "-o", "--output", required=True, help="package file output path.")
+    cmd_compile.add_argument(
+        "--cache-dir", default=None,
+        help="directory of cached packages.  (default: $PIPELINE_CACHE_DIR "
+        "or ~/.cache/{{app_name}}/pipelines)")
+    cmd_compile.add_argument(
+        "--no-cache", action="store_true",
+        help="always compile, without reading or writing the cache.")
 
     # run command arguments
     cmd_run_job = commands.add_parser(
@@ -136,17 +458,68 @@ def parse_args() -> argparse.Namespace:
         help="GCS root directory for files generated by pipeline job.")
     # if needed, add arguments here for additional pipeline parameters.
     cmd_run_job.add_argument("--project", required=True, help="project ID.")
+    cmd_run_job.add_argument(
+        "--no-step-cache", action="store_true",
+        help="re-execute every step rather than reusing cached step outputs.")
     # uncomment for custom training
     # cmd_run_job.add_argument("--app_container_uri", required=True,
     #                          help="App container URI for custom training.")
 
+    # sweep command arguments
+    cmd_sweep = commands.add_parser(
+        "sweep", help="run a pipeline job for each of many parameter sets.")
+    cmd_sweep.add_argument("--package", required=True,
+                           help="path to compiled pipeline package file.")
+    cmd_sweep.add_argument(
+        "--pipeline_root", required=True,
+        help="GCS root directory for files generated by pipeline jobs.")
+    cmd_sweep.add_argument("--project", required=True, help="project ID.")
+    cmd_sweep.add_argument(
+        "--spec", required=True,
+        help="YAML or JSON file of parameter sets.  Parameters in the file "
+        "override those from the command line.")
+    cmd_sweep.add_argument(
+        "--parallelism", type=int, default=4,
+        help="maximum number of jobs running at once.")
+    cmd_sweep.add_argument(
+        "--poll-interval", type=float, default=10.0,
+        help="initial seconds between polls of job states.")
+    cmd_sweep.add_argument(
+        "--timeout", type=float, default=None,
+        help="seconds to wait for jobs to finish.  (default: no limit)")
+
+    # run-local command arguments
+    cmd_run_local = commands.add_parser(
+        "run-local", help="run a compiled pipeline on this machine.")
+    cmd_run_local.add_argument("--package", required=True,
+                               help="path to compiled pipeline package file.")
+    cmd_run_local.add_argument(
+        "--root", default=f".pipeline_runs/{PIPELINE_NAME}",
+        help="local directory for files generated by pipeline steps.")
+    cmd_run_local.add_argument(
+        "-p", "--param", action="append", default=[], metavar="NAME=VALUE",
+        help="pipeline parameter value.  May be given more than once.")
+    cmd_run_local.add_argument(
+        "-j", "--jobs", type=int, default=None,
+        help="maximum number of steps to run at once.  "
+        "(default: number of CPUs)")
+    cmd_run_local.add_argument(
+        "--docker", action="store_true",
+        help="run each step in its component's container image.")
+    cmd_run_local.add_argument(
+        "--no-cache", action="store_true",
+        help="re-run every step rather than reusing earlier outputs.")
+
     return parser.parse_args()
 
 
 def main(args):
 
     if args.command == "compile":
-        compile(args.output)
+        hit = compile(args.output, cache_dir=args.cache_dir,
+                      use_cache=not args.no_cache)
+        print(f"compile cache {'hit' if hit else 'miss'}: "
+              f"{pipeline_hash()[:12]} -> {args.output}")
     elif args.command == "run":
         aiplatform.init()
         # If pipeline parameters are necessary, add them here.
@@ -156,7 +529,39 @@ def main(args):
             # "app_container_uri": args.app_container_uri,
         }
         run_job(args.package, args.pipeline_root,
-                pipeline_params=pipeline_params)
+                pipeline_params=pipeline_params,
+                enable_caching=False if args.no_step_cache else None)
+    elif args.command == "sweep":
+        aiplatform.init(project=args.project)
+        pipeline_params = {"project_id": args.project}
+        parameter_sets = [
+            {**pipeline_params, **parameters}
+            for parameters in load_sweep(args.spec)
+        ]
+        runs = run_sweep(
+            parameter_sets,
+            VertexSweepClient(),
+            args.package,
+            args.pipeline_root,
+            parallelism=args.parallelism,
+            poll_interval=args.poll_interval,
+            timeout=args.timeout,
+        )
+        print(format_sweep(runs))
+    elif args.command == "run-local":
+        pipeline_params = dict(param.split("=", 1) for param in args.param)
+        results = local.run_pipeline(
+            args.package,
+            args.root,
+            parameters=pipeline_params,
+            jobs=args.jobs,
+            docker=args.docker,
+            use_cache=not args.no_cache,
+        )
+        print(local.format_timings(results))
+        if any(result.status not in ("ran", "cached")
+               for result in results.values()):
+            raise SystemExit(1)
     else:
         print(f"Command not implemented: {args.command}")
 
@@ -1,6 +1,7 @@
 """{{pipeline_name}} pipeline unit tests"""
 import tempfile
 import os
+import threading
 
 from {{app_name}}.pipelines import {{pipeline_name}}
 
@@ -11,3 +12,120 @@ def test_can_compile():
         {{pipeline_name}}.compile(package_path)
         assert os.path.exists(package_path)
         assert os.path.getsize(package_path) > 0
+
+
+def test_compile_cache():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache_dir = os.path.join(tmp_dir, 'cache')
+        first_path = os.path.join(tmp_dir, 'first.json')
+        second_path = os.path.join(tmp_dir, 'second.json')
+
+        assert not {{pipeline_name}}.compile(first_path, cache_dir=cache_dir)
+        assert {{pipeline_name}}.compile(second_path, cache_dir=cache_dir)
+
+        with open(first_path) as first, open(second_path) as second:
+            assert first.read() == second.read()
+
+
+class FakeOp:
+    def set_caching_options(self, enable_caching):
+        self.enable_caching = enable_caching
+
+
+def test_disabling_a_step_cache_reruns_only_that_step(monkeypatch):
+    monkeypatch.setitem({{pipeline_name}}.STEP_CACHING, "training",
+                        {"enable_caching": False})
+
+    training = {{pipeline_name}}.configure_step(FakeOp(), "training")
+    deploy = {{pipeline_name}}.configure_step(FakeOp(), "model_deploy")
+    assert not training.enable_caching
+    assert deploy.enable_caching
+
+
+class FakeSweepClient({{pipeline_name}}.SweepClient):
+    """Jobs which run for a fixed number of polls, failing on request"""
+
+    def __init__(self, polls_to_finish=2):
+        self.polls_to_finish = polls_to_finish
+        self.jobs = {}
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def submit(self, display_name, template_path, pipeline_root,
+               parameter_values):
+        if parameter_values.get("fail_submit"):
+            raise RuntimeError("quota exceeded")
+        with self.lock:
+            job_id = f"jobs/{len(self.jobs)}"
+            self.jobs[job_id] = {"polls": 0, "parameters": parameter_values}
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        return job_id
+
+    def get_state(self, job_id):
+        job = self.jobs[job_id]
+        job["polls"] += 1
+        if job["polls"] <= job["parameters"].get("poll_errors", 0):
+            raise ConnectionError("service unavailable")
+        if job["polls"] < self.polls_to_finish:
+            return "PIPELINE_STATE_RUNNING"
+        if not job.get("finished"):
+            job["finished"] = True
+            self.running -= 1
+        if job["parameters"].get("fail"):
+            return "PIPELINE_STATE_FAILED"
+        return "PIPELINE_STATE_SUCCEEDED"
+
+
+def test_expand_sweep():
+    parameter_sets = {{pipeline_name}}.expand_sweep({
+        "parameters": {"project_id": "p"},
+        "grid": {"a": [1, 2], "b": ["x", "y"]},
+        "runs": [{"a": 10}],
+    })
+    assert len(parameter_sets) == 5
+    assert {"project_id": "p", "a": 2, "b": "x"} in parameter_sets
+    assert parameter_sets[-1] == {"project_id": "p", "a": 10}
+
+
+def test_sweep_with_fake_client():
+    client = FakeSweepClient(polls_to_finish=3)
+    sleeps = []
+    runs = {{pipeline_name}}.run_sweep(
+        [{"a": 1}, {"a": 2, "fail": True}, {"a": 3, "fail_submit": True}],
+        client, "package.json", "gs://root",
+        parallelism=2, poll_interval=1.0, sleep=sleeps.append)
+
+    states = [run.state for run in runs]
+    assert states == ["PIPELINE_STATE_SUCCEEDED", "PIPELINE_STATE_FAILED",
+                      "SUBMIT_FAILED"]
+    assert len(client.jobs) == 2
+    # polls back off while jobs are running, and stop once they finish
+    assert sleeps == [1.0, 1.0, 2.0]
+
+    table = {{pipeline_name}}.format_sweep(runs)
+    assert "SUCCEEDED" in table and "quota exceeded" in table
+
+
+def test_sweep_limits_unfinished_jobs():
+    client = FakeSweepClient(polls_to_finish=2)
+    runs = {{pipeline_name}}.run_sweep(
+        [{"a": i} for i in range(5)], client, "package.json", "gs://root",
+        parallelism=2, poll_interval=1.0, sleep=lambda seconds: None)
+
+    assert all(run.state == "PIPELINE_STATE_SUCCEEDED" for run in runs)
+    assert client.max_running == 2
+
+
+def test_sweep_retries_failed_polls():
+    client = FakeSweepClient(polls_to_finish=2)
+    runs = {{pipeline_name}}.run_sweep(
+        [{"a": 1, "poll_errors": 2}, {"a": 2, "poll_errors": 3}],
+        client, "package.json", "gs://root",
+        parallelism=2, poll_interval=1.0, max_poll_errors=3,
+        sleep=lambda seconds: None)
+
+    assert runs[0].state == "PIPELINE_STATE_SUCCEEDED"
+    assert runs[1].state == "POLL_FAILED"
+    assert runs[1].error == "service unavailable"
@@ -0,0 +1,296 @@
+"""a brief docstring describing the task"""
+
+import argparse
+import collections
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import tensorflow as tf
+
+from {{app_name}} import data
+
+AUTOTUNE = tf.data.AUTOTUNE
+
+# name of the file, in the output directory, recording prediction throughput
+METRICS_FILE = "prediction_metrics.json"
+
+# prefix of the output shards, which are written as JSON lines
+OUTPUT_PREFIX = "predictions"
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    """Parse task arguments"""
+    parser = argparse.ArgumentParser()
+
+    # Define any command line arguments for the task here.
+    #
+    # parser.add_argument(...)
+    parser.add_argument(
+        "--model", required=True,
+        help="SavedModel directory to predict with, such as one written by a "
+        "training task.  Local and GCS paths are supported.")
+    parser.add_argument(
+        "--input-data", required=True,
+        help="glob pattern of TFRecord files to predict on, such as those "
+        "written by `python -m {{app_name}}.data convert`.  Records are parsed "
+        "with the schema.json next to the files, if there is one.")
+    parser.add_argument(
+        "--output-dir", required=True,
+        help="directory to write prediction shards and metrics to.")
+    parser.add_argument(
+        "--compression", default="GZIP", choices=["", "GZIP", "ZLIB"],
+        help="compression of the input files.")
+    parser.add_argument(
+        "--key-feature",
+        help="feature which identifies each record.  It is copied to the "
+        "output rather than passed to the model.  Requires a schema.json "
+        "next to the input files.")
+
+    # Performance arguments.  Memory use is bounded by the number of batches
+    # in flight, rather than by the size of the input.
+    performance = parser.add_argument_group("performance")
+    performance.add_argument(
+        "--workers", type=int, default=os.cpu_count(),
+        help="number of worker processes, each with its own copy of the "
+        "model.  (default: number of CPUs)")
+    performance.add_argument(
+        "--threads-per-worker", type=int, default=None,
+        help="number of threads each worker's model may use.  (default: CPUs "
+        "divided between the workers)")
+    performance.add_argument(
+        "--batch-size", type=int, default=1024,
+        help="number of records per prediction batch.")
+    performance.add_argument(
+        "--max-in-flight", type=int, default=None,
+        help="maximum number of batches being predicted or waiting to be "
+        "written.  (default: twice the number of workers)")
+    performance.add_argument(
+        "--rows-per-shard", type=int, default=100000,
+        help="maximum number of predictions per output shard.")
+    performance.add_argument(
+        "--num-parallel-reads", type=int, default=AUTOTUNE,
+        help="number of input files to read concurrently.  "
+        "(default: autotune)")
+    performance.add_argument(
+        "--log-every-batches", type=int, default=100,
+        help="log throughput every this many batches.  0 disables progress "
+        "logs.")
+
+    return parser.parse_args(argv)
+
+
+def load_data(args) -> tf.data.Dataset:
+    """
+    Stream batches of serialized records.  Files are read in sorted order, so
+    that predictions are written in the same order as their records.
+    """
+    dataset = data.load_dataset(
+        args.input_data,
+        compression=args.compression,
+        num_parallel_reads=args.num_parallel_reads,
+        deterministic=True,
+    )
+    return dataset.batch(args.batch_size).prefetch(AUTOTUNE)
+
+
+def load_feature_spec(args):
+    """Feature spec of the input records, or None to pass them on unparsed"""
+    shard_dir = os.path.dirname(args.input_data)
+    if not tf.io.gfile.exists(os.path.join(shard_dir, data.SCHEMA_FILE)):
+        return None
+    return data.load_feature_spec(shard_dir)
+
+
+def preprocess_batch(features):
+    """Transform a batch of parsed records into model inputs"""
+
+    # perform any feature engineering or transformation which the model
+    # expects, e.g. the same preprocessing as the training task.  Operating on
+    # whole batches with tf ops is much faster than transforming each record.
+
+    return features
+
+
+def load_model(path):
+    """Load the model to predict with"""
+    return tf.saved_model.load(path)
+
+
+def predict(model, inputs):
+    """Predictions for a batch of model inputs"""
+    # Keras 3 exports models with a `serve` endpoint, while other SavedModels
+    # are called directly
+    return getattr(model, "serve", model)(inputs)
+
+
+class ShardedWriter:
+    """
+    Writes lines to numbered shards in `output_dir`, starting a new shard
+    after every `rows_per_shard` lines.
+    """
+
+    def __init__(self, output_dir, rows_per_shard):
+        self.output_dir = output_dir
+        self.rows_per_shard = rows_per_shard
+        self.paths = []
+        self._file = None
+        self._shard_rows = 0
+
+    def write(self, lines):
+        while lines:
+            if self._file is None or self._shard_rows >= self.rows_per_shard:
+                self._next_shard()
+            count = self.rows_per_shard - self._shard_rows
+            self._file.write("".join(line + "\n" for line in lines[:count]))
+            self._shard_rows += len(lines[:count])
+            lines = lines[count:]
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _next_shard(self):
+        self.close()
+        path = os.path.join(self.output_dir,
+                            f"{OUTPUT_PREFIX}-{len(self.paths):05d}.jsonl")
+        self._file = tf.io.gfile.GFile(path, 'w')
+        self.paths.append(path)
+        self._shard_rows = 0
+
+
+def predict_batches(batches, pool, writer, max_in_flight,
+                    log_every_batches=0) -> dict:
+    """
+    Predict each batch on the worker pool, and write the results in order.
+    At most `max_in_flight` batches are submitted before the oldest one is
+    written, which bounds memory use.  Returns throughput metrics.
+
+    The first batch includes loading the model, so it is timed separately
+    rather than counted towards throughput.
+    """
+    pending = collections.deque()
+    start = time.perf_counter()
+    metrics = {"rows": 0, "batches": 0, "first_batch_seconds": None}
+    steady_rows = 0
+    steady_start = None
+
+    def write_oldest():
+        nonlocal steady_rows, steady_start
+        lines = pending.popleft().result()
+        writer.write(lines)
+        metrics["rows"] += len(lines)
+        metrics["batches"] += 1
+        if steady_start is None:
+            steady_start = time.perf_counter()
+            metrics["first_batch_seconds"] = steady_start - start
+        else:
+            steady_rows += len(lines)
+        if log_every_batches and metrics["batches"] % log_every_batches == 0:
+            rows_per_second = steady_rows / max(
+                time.perf_counter() - steady_start, 1e-9)
+            print(f"batch {metrics['batches']}: {metrics['rows']} rows, "
+                  f"{rows_per_second:.1f} rows/sec")
+
+    for records in batches:
+        if len(pending) >= max_in_flight:
+            write_oldest()
+        pending.append(pool.submit(_predict_records, records))
+    while pending:
+        write_oldest()
+
+    end = time.perf_counter()
+    metrics["seconds"] = end - start
+    metrics["rows_per_second"] = (
+        steady_rows / (end - steady_start)
+        if steady_start is not None and end > steady_start else 0.0)
+    return metrics
+
+
+# state of each worker process, which loads the model once when it starts
+_worker = {}
+
+
+def _init_worker(model_path, feature_spec, key_feature, threads):
+    if threads:
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(threads)
+    _worker["model"] = load_model(model_path)
+    _worker["feature_spec"] = feature_spec
+    _worker["key_feature"] = key_feature
+
+
+def _predict_records(records):
+    """Predict a batch of serialized records; runs in a worker process"""
+    features = tf.constant(records)
+    if _worker["feature_spec"] is not None:
+        features = tf.io.parse_example(features, _worker["feature_spec"])
+    keys = None
+    if _worker["key_feature"]:
+        keys = _to_list(features.pop(_worker["key_feature"]))
+
+    outputs = predict(_worker["model"], preprocess_batch(features))
+    outputs = tf.nest.map_structure(_to_list, outputs)
+    if isinstance(outputs, dict):
+        rows = [dict(zip(outputs, values)) for values in zip(*outputs.values())]
+    else:
+        rows = outputs
+
+    if keys is None:
+        return [json.dumps({"prediction": row}) for row in rows]
+    return [json.dumps({"key": key, "prediction": row})
+            for key, row in zip(keys, rows)]
+
+
+def _to_list(tensor) -> list:
+    values = tensor.numpy() if hasattr(tensor, "numpy") else np.asarray(tensor)
+    if values.dtype == object:
+        return [value.decode() for value in values.tolist()]
+    return values.tolist()
+
+
+def run(args):
+    workers = max(args.workers or 1, 1)
+    threads = args.threads_per_worker or max((os.cpu_count() or 1) // workers,
+                                             1)
+    max_in_flight = args.max_in_flight or 2 * workers
+    feature_spec = load_feature_spec(args)
+    if args.key_feature and (feature_spec is None
+                             or args.key_feature not in feature_spec):
+        # unparsed records have no features to take the key from
+        raise ValueError(
+            f"--key-feature {args.key_feature} is not a feature of the "
+            f"schema.json next to {args.input_data}")
+    tf.io.gfile.makedirs(args.output_dir)
+
+    # tensorflow is not fork-safe, so workers are started with spawn
+    context = multiprocessing.get_context("spawn")
+    writer = ShardedWriter(args.output_dir, args.rows_per_shard)
+    try:
+        with ProcessPoolExecutor(
+                max_workers=workers, mp_context=context,
+                initializer=_init_worker,
+                initargs=(args.model, feature_spec, args.key_feature,
+                          threads)) as pool:
+            metrics = predict_batches(load_data(args).as_numpy_iterator(),
+                                      pool, writer, max_in_flight,
+                                      args.log_every_batches)
+    finally:
+        writer.close()
+
+    metrics.update(workers=workers, threads_per_worker=threads,
+                   batch_size=args.batch_size, output_shards=len(writer.paths))
+    print(f"predicted {metrics['rows']} rows in {metrics['seconds']:.1f}s: "
+          f"{metrics['rows_per_second']:.1f} rows/sec")
+    with tf.io.gfile.GFile(os.path.join(args.output_dir, METRICS_FILE),
+                           'w') as f:
+        json.dump(metrics, f, indent=2)
+    return metrics
+
+
+if __name__ == "__main__":
+    run(parse_args())
@@ -0,0 +1,119 @@
+"""{{task_name}} task unit tests"""
+import json
+import os
+
+import pytest
+import tensorflow as tf
+
+from {{app_name}} import data
+from {{app_name}}.tasks import {{task_name}}
+
+pytest.importorskip("pyarrow")
+
+
+class TinyModel(tf.Module):
+    """Doubles the `x` feature"""
+
+    def __init__(self):
+        super().__init__()
+        self.weight = tf.Variable(2.0)
+
+    @tf.function(input_signature=[{"x": tf.TensorSpec([None], tf.float32)}])
+    def serve(self, features):
+        return features["x"] * self.weight
+
+
+def write_inputs(tmp_path, num_files, rows_per_file, records_per_shard):
+    """Convert CSV files of ids and `x` values to TFRecord shards"""
+    csv_dir = tmp_path / "csv"
+    csv_dir.mkdir()
+    paths = []
+    for index in range(num_files):
+        path = csv_dir / f"part{index}.csv"
+        start = index * rows_per_file
+        path.write_text("id,x\n" + "".join(
+            f"{i},{i}.5\n" for i in range(start, start + rows_per_file)))
+        paths.append(str(path))
+    shard_dir = str(tmp_path / "shards")
+    data.convert_to_tfrecords(paths, shard_dir,
+                              records_per_shard=records_per_shard)
+    return shard_dir
+
+
+def save_tiny_model(tmp_path):
+    path = str(tmp_path / "model")
+    tf.saved_model.save(TinyModel(), path)
+    return path
+
+
+def read_predictions(output_dir):
+    prefix = {{task_name}}.OUTPUT_PREFIX
+    rows = []
+    for path in sorted(output_dir.glob(f"{prefix}-*")):
+        with open(path) as f:
+            rows.extend(json.loads(line) for line in f)
+    return rows
+
+
+def test_predictions_are_written_in_order(tmp_path):
+    shard_dir = write_inputs(tmp_path, num_files=2, rows_per_file=250,
+                             records_per_shard=100)
+    output_dir = tmp_path / "output"
+    args = {{task_name}}.parse_args([
+        "--model", save_tiny_model(tmp_path),
+        "--input-data", f"{shard_dir}/*.tfrecord.gz",
+        "--output-dir", str(output_dir),
+        "--key-feature", "id",
+        "--workers", "2",
+        "--batch-size", "64",
+        "--max-in-flight", "3",
+        "--rows-per-shard", "200",
+    ])
+
+    metrics = {{task_name}}.run(args)
+
+    rows = read_predictions(output_dir)
+    assert [row["key"] for row in rows] == list(range(500))
+    assert all(row["prediction"] == 2 * (row["key"] + 0.5) for row in rows)
+    assert metrics["rows"] == 500 and metrics["output_shards"] == 3
+    with open(output_dir / {{task_name}}.METRICS_FILE) as f:
+        assert json.load(f)["batches"] == 8
+
+
+def test_key_feature_requires_a_schema(tmp_path):
+    shard_dir = write_inputs(tmp_path, num_files=1, rows_per_file=10,
+                             records_per_shard=10)
+    os.remove(os.path.join(shard_dir, data.SCHEMA_FILE))
+    args = {{task_name}}.parse_args([
+        "--model", save_tiny_model(tmp_path),
+        "--input-data", f"{shard_dir}/*.tfrecord.gz",
+        "--output-dir", str(tmp_path / "output"),
+        "--key-feature", "id",
+    ])
+
+    with pytest.raises(ValueError, match="--key-feature id"):
+        {{task_name}}.run(args)
+    assert not (tmp_path / "output").exists()
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_prediction_throughput(tmp_path, workers):
+    shard_dir = write_inputs(tmp_path, num_files=4, rows_per_file=5000,
+                             records_per_shard=2500)
+    args = {{task_name}}.parse_args([
+        "--model", save_tiny_model(tmp_path),
+        "--input-data", f"{shard_dir}/*.tfrecord.gz",
+        "--output-dir", str(tmp_path / "output"),
+        "--key-feature", "id",
+        "--workers", str(workers),
+        "--batch-size", "1000",
+        "--log-every-batches", "0",
+    ])
+
+    metrics = {{task_name}}.run(args)
+    print(f"{workers} workers: {metrics['rows_per_second']:.0f} rows/sec, "
+          f"first batch {metrics['first_batch_seconds']:.2f}s")
+
+    assert metrics["rows"] == 20000
+    assert metrics["rows_per_second"] > 0
+    assert os.listdir(tmp_path / "output")
@@ -0,0 +1,452 @@
+"""a brief docstring describing the task"""
+
+import argparse
+import asyncio
+import bisect
+import json
+import os
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, NamedTuple
+
+import numpy as np
+import tensorflow as tf
+
+# upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+STATUS_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found",
+                  405: "Method Not Allowed", 411: "Length Required",
+                  413: "Payload Too Large", 500: "Internal Server Error",
+                  503: "Service Unavailable"}
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    """Parse task arguments"""
+    parser = argparse.ArgumentParser()
+
+    # Vertex AI sets these environment variables for custom prediction
+    # containers.
+    # See: https://cloud.google.com/vertex-ai/docs/predictions/custom-container-requirements
+    parser.add_argument(
+        "--model", default=os.environ.get("AIP_STORAGE_URI"),
+        help="SavedModel directory to serve.  Local and GCS paths are "
+        "supported.  (default: $AIP_STORAGE_URI)")
+    parser.add_argument(
+        "--port", type=int, default=int(os.environ.get("AIP_HTTP_PORT", 8080)),
+        help="port to listen on.  (default: $AIP_HTTP_PORT or 8080)")
+    parser.add_argument(
+        "--predict-route", default=os.environ.get("AIP_PREDICT_ROUTE",
+                                                  "/predict"),
+        help="path of prediction requests.  (default: $AIP_PREDICT_ROUTE)")
+    parser.add_argument(
+        "--health-route", default=os.environ.get("AIP_HEALTH_ROUTE",
+                                                 "/health"),
+        help="path of health checks, which succeed once the model is warmed "
+        "up.  (default: $AIP_HEALTH_ROUTE)")
+    parser.add_argument(
+        "--metrics-route", default="/metrics",
+        help="path of latency and batch size histograms, in the Prometheus "
+        "text format.")
+    parser.add_argument(
+        "--max-request-bytes", type=int, default=10 * 1024 * 1024,
+        help="largest request body accepted; larger requests are rejected "
+        "before they are read.")
+    parser.add_argument(
+        "--warmup-file",
+        help="JSON prediction request to warm the model up with.  (default: "
+        "zeros shaped like the model's input signature)")
+
+    # Batching arguments.  Concurrent requests are predicted together, which
+    # trades a little latency for much higher throughput.
+    batching = parser.add_argument_group("batching")
+    batching.add_argument(
+        "--max-batch-size", type=int, default=64,
+        help="maximum number of instances predicted together.  Larger "
+        "requests are predicted on their own.")
+    batching.add_argument(
+        "--max-wait-ms", type=float, default=5.0,
+        help="maximum time a request waits for others to join its batch.")
+
+    return parser.parse_args(argv)
+
+
+def load_model(path):
+    """Load the model to serve"""
+    return tf.saved_model.load(path)
+
+
+def preprocess(instances):
+    """
+    Transform the instances of a batch of requests into model inputs.
+    Instances are either values, or dictionaries of named features.
+    """
+
+    # perform any feature engineering or transformation which the model
+    # expects, e.g. the same preprocessing as the training task.
+
+    if instances and isinstance(instances[0], dict):
+        return {
+            name: tf.constant([instance[name] for instance in instances])
+            for name in instances[0]
+        }
+    return tf.constant(instances)
+
+
+def predict(model, inputs):
+    """Predictions for a batch of model inputs"""
+    # Keras 3 exports models with a `serve` endpoint, while other SavedModels
+    # are called directly
+    return getattr(model, "serve", model)(inputs)
+
+
+def postprocess(outputs) -> list:
+    """Transform model outputs into one JSON-serializable prediction each"""
+    outputs = tf.nest.map_structure(lambda tensor: np.asarray(tensor).tolist(),
+                                    outputs)
+    if isinstance(outputs, dict):
+        return [dict(zip(outputs, values)) for values in zip(*outputs.values())]
+    return outputs
+
+
+def warmup_instances(model, args) -> list:
+    """
+    Instances to warm the model up with, from --warmup-file, or zeros shaped
+    like the model's input signature.  Returns an empty list if neither is
+    available.
+    """
+    if args.warmup_file:
+        with tf.io.gfile.GFile(args.warmup_file) as f:
+            return json.load(f)["instances"]
+    signature = getattr(getattr(model, "serve", None), "input_signature", None)
+    if not signature or len(signature) != 1:
+        return []
+    instance = tf.nest.map_structure(
+        lambda spec: np.zeros(spec.shape[1:], spec.dtype.as_numpy_dtype)
+        .tolist(), signature[0])
+    return [instance]
+
+
+class Histogram:
+    """Counts of observed values in buckets with the given upper bounds"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def to_prometheus(self, name, help_text) -> str:
+        lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            cumulative += count
+            lines.append(name + '_bucket{le="' + str(bound) + '"} '
+                         + str(cumulative))
+        lines += [f"{name}_sum {self.sum}", f"{name}_count {self.count}"]
+        return "\n".join(lines) + "\n"
+
+
+class ServingMetrics:
+    """Histograms of request latency and batching"""
+
+    def __init__(self, max_batch_size):
+        self.request_seconds = Histogram(LATENCY_BUCKETS)
+        self.queue_seconds = Histogram(LATENCY_BUCKETS)
+        self.inference_seconds = Histogram(LATENCY_BUCKETS)
+        self.batch_size = Histogram(sorted(
+            {2 ** i for i in range(max_batch_size.bit_length())}
+            | {max_batch_size}))
+
+    def to_prometheus(self) -> str:
+        return "".join([
+            self.request_seconds.to_prometheus(
+                "request_latency_seconds",
+                "Time from receiving a request to sending its response."),
+            self.queue_seconds.to_prometheus(
+                "queue_wait_seconds",
+                "Time requests wait for their batch to be predicted."),
+            self.inference_seconds.to_prometheus(
+                "inference_seconds",
+                "Time to preprocess, predict and postprocess a batch."),
+            self.batch_size.to_prometheus(
+                "batch_size", "Number of instances predicted together."),
+        ])
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent requests into batches of up to `max_batch_size`
+    instances.  A batch is predicted once it is full, or `max_wait_seconds`
+    after its first request arrived.  Batches are predicted one at a time on a
+    separate thread, so requests which arrive meanwhile join the next batch.
+    Must be started on the event loop which serves the requests.
+    """
+
+    def __init__(self, predict_batch, max_batch_size, max_wait_seconds,
+                 metrics):
+        self.predict_batch = predict_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_seconds
+        self.metrics = metrics
+        self._queue = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._task = None
+
+    def start(self):
+        # asyncio objects are bound to the running loop on Python < 3.10, so
+        # they are created once it is running
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+        self._executor.shutdown(wait=False)
+
+    async def predict(self, instances) -> list:
+        """Predictions for a request's instances"""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((instances, future, time.perf_counter()))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        held = None
+        while True:
+            batch = [held or await self._queue.get()]
+            held = None
+            size = len(batch[0][0])
+            # requests which queued behind the previous batch do not wait again
+            deadline = batch[0][2] + self.max_wait_seconds
+            while size < self.max_batch_size:
+                if self._queue.empty():
+                    timeout = deadline - time.perf_counter()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(),
+                                                      timeout)
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    item = self._queue.get_nowait()
+                if size + len(item[0]) > self.max_batch_size:
+                    # too big for this batch, so it starts the next one
+                    held = item
+                    break
+                batch.append(item)
+                size += len(item[0])
+            await self._predict(loop, batch)
+
+    async def _predict(self, loop, batch):
+        start = time.perf_counter()
+        for _, _, enqueued in batch:
+            self.metrics.queue_seconds.observe(start - enqueued)
+        instances = [instance for item in batch for instance in item[0]]
+        try:
+            predictions = await loop.run_in_executor(
+                self._executor, self.predict_batch, instances)
+        except Exception as e:  # pylint: disable=broad-except
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.metrics.inference_seconds.observe(time.perf_counter() - start)
+        self.metrics.batch_size.observe(len(instances))
+
+        offset = 0
+        for request_instances, future, _ in batch:
+            end = offset + len(request_instances)
+            # requests whose client disconnected have been cancelled
+            if not future.done():
+                future.set_result(predictions[offset:end])
+            offset = end
+
+
+class PredictionServer:
+    """
+    HTTP server for Vertex AI custom prediction containers.  Requests to the
+    predict route have a JSON body of `{"instances": [...]}`, and receive
+    `{"predictions": [...]}` in response.
+    See: https://cloud.google.com/vertex-ai/docs/predictions/custom-container-requirements
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.metrics = ServingMetrics(args.max_batch_size)
+        self.model = None
+        self.batcher = MicroBatcher(self.predict_batch, args.max_batch_size,
+                                    args.max_wait_ms / 1000, self.metrics)
+        self.ready = None  # set once the model is warmed up, by serve()
+
+    def predict_batch(self, instances) -> list:
+        return postprocess(predict(self.model, preprocess(instances)))
+
+    def load(self):
+        """Load the model and warm it up, so that the first requests are fast"""
+        start = time.perf_counter()
+        self.model = load_model(self.args.model)
+        instances = warmup_instances(self.model, self.args)
+        if instances:
+            for batch_size in sorted({1, self.args.max_batch_size}):
+                self.predict_batch(
+                    [instances[i % len(instances)] for i in range(batch_size)])
+        else:
+            print("no warm-up instances; the first requests will be slower")
+        print(f"model loaded in {time.perf_counter() - start:.2f}s")
+
+    async def serve(self):
+        """Serve requests until interrupted"""
+        loop = asyncio.get_running_loop()
+        self.ready = asyncio.Event()
+        stopped = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stopped.set)
+
+        # listen while the model loads, so that health checks see it starting
+        server = await asyncio.start_server(self.handle_connection,
+                                            port=self.args.port)
+        print(f"listening on port {self.args.port}")
+        await loop.run_in_executor(None, self.load)
+        self.batcher.start()
+        self.ready.set()
+
+        async with server:
+            await stopped.wait()
+        await self.batcher.stop()
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await read_http_message(
+                        reader, self.args.max_request_bytes)
+                except HttpError as e:
+                    # the body was not read, so the connection cannot be reused
+                    writer.write(format_http_response(
+                        e.status, "application/json",
+                        json.dumps({"error": str(e)}).encode(),
+                        keep_alive=False))
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+                start = time.perf_counter()
+                method, path, version = request.start_line.split(" ", 2)
+                status, content_type, body = await self.route(
+                    method, path.split("?")[0], request.body)
+                keep_alive = (version == "HTTP/1.1" and request.headers.get(
+                    "connection", "").lower() != "close")
+                writer.write(format_http_response(status, content_type, body,
+                                                  keep_alive))
+                await writer.drain()
+                if path.startswith(self.args.predict_route):
+                    self.metrics.request_seconds.observe(
+                        time.perf_counter() - start)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            # the client disconnected mid-request, or sent an invalid one
+            pass
+        finally:
+            writer.close()
+
+    async def route(self, method, path, body):
+        """Status, content type and body of the response to a request"""
+        if path == self.args.health_route:
+            if self.ready.is_set():
+                return 200, "application/json", b"{}"
+            return 503, "application/json", b'{"error": "model is loading"}'
+        if path == self.args.metrics_route:
+            return 200, "text/plain; version=0.0.4", \
+                self.metrics.to_prometheus().encode()
+        if path != self.args.predict_route:
+            return 404, "application/json", b'{"error": "not found"}'
+
+        if method != "POST":
+            return 405, "application/json", b'{"error": "use POST"}'
+        if not self.ready.is_set():
+            return 503, "application/json", b'{"error": "model is loading"}'
+        try:
+            instances = json.loads(body)["instances"]
+            if not isinstance(instances, list) or not instances:
+                raise ValueError("`instances` must be a non-empty list")
+        except (ValueError, KeyError, TypeError) as e:
+            return 400, "application/json", json.dumps(
+                {"error": f"invalid request: {e}"}).encode()
+        try:
+            predictions = await self.batcher.predict(instances)
+        except Exception as e:  # pylint: disable=broad-except
+            return 500, "application/json", json.dumps(
+                {"error": str(e)}).encode()
+        return 200, "application/json", json.dumps(
+            {"predictions": predictions}).encode()
+
+
+class HttpMessage(NamedTuple):
+    """An HTTP request or response"""
+    start_line: str
+    headers: Dict[str, str]
+    body: bytes
+
+
+class HttpError(Exception):
+    """A request which cannot be read, and the status to respond with"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+async def read_http_message(reader, max_body_bytes=None):
+    """
+    Read an HTTP/1.1 message with a Content-Length body, or None if the
+    connection closed before one started.  Raises an HttpError for chunked
+    bodies, which are not supported, and for bodies over `max_body_bytes`.
+    """
+    start_line = await reader.readline()
+    if not start_line:
+        return None
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    if "transfer-encoding" in headers:
+        raise HttpError(411, "chunked bodies are not supported; send a "
+                        "Content-Length")
+    length = int(headers.get("content-length", 0))
+    if max_body_bytes is not None and length > max_body_bytes:
+        raise HttpError(413, f"request body is over {max_body_bytes} bytes")
+    body = await reader.readexactly(length)
+    return HttpMessage(start_line.decode("latin-1").strip(), headers, body)
+
+
+def format_http_response(status, content_type, body, keep_alive=True) -> bytes:
+    head = (f"HTTP/1.1 {status} {STATUS_REASONS.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    return head.encode("latin-1") + body
+
+
+def run(args):
+    if not args.model:
+        raise ValueError(
+            "--model is required, unless the `AIP_STORAGE_URI` environment "
+            "variable is set")
+    asyncio.run(PredictionServer(args).serve())
+
+
+if __name__ == "__main__":
+    run(parse_args())
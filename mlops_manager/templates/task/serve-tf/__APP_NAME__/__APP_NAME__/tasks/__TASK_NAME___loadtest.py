@@ -0,0 +1,120 @@
+"""{{task_name}} load test
+
+Sends prediction requests to the {{task_name}} server over many concurrent
+connections, and reports throughput and latency percentiles.
+
+    python -m {{app_name}}.tasks.{{task_name}} --model model/ &
+    python -m {{app_name}}.tasks.{{task_name}}_loadtest --request request.json
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from {{app_name}}.tasks.{{task_name}} import read_http_message
+
+PERCENTILES = (50, 90, 99)
+
+
+async def send_requests(host, port, path, body, count, latencies, errors):
+    """Send `count` requests, one after another, over a single connection"""
+    reader, writer = await asyncio.open_connection(host, port)
+    request = (f"POST {path} HTTP/1.1\r\n"
+               f"Host: {host}\r\n"
+               "Content-Type: application/json\r\n"
+               f"Content-Length: {len(body)}\r\n\r\n").encode() + body
+    try:
+        for _ in range(count):
+            start = time.perf_counter()
+            writer.write(request)
+            await writer.drain()
+            response = await read_http_message(reader)
+            if response is None:
+                raise ConnectionError("the server closed the connection")
+            latencies.append(time.perf_counter() - start)
+            status = int(response.start_line.split(" ")[1])
+            if status != 200:
+                errors[status] = errors.get(status, 0) + 1
+    finally:
+        writer.close()
+
+
+async def run_load_test(url, body, concurrency=16, requests=1000) -> dict:
+    """
+    Send `requests` copies of a JSON request `body` to `url`, from
+    `concurrency` connections at once.  Returns throughput, latency
+    percentiles in seconds, and counts of unsuccessful responses by status.
+    """
+    split = urlsplit(url)
+    latencies = []
+    errors = {}
+    counts = [requests // concurrency + (i < requests % concurrency)
+              for i in range(concurrency)]
+
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        send_requests(split.hostname, split.port or 80, split.path or "/",
+                      body, count, latencies, errors)
+        for count in counts if count
+    ])
+    seconds = time.perf_counter() - start
+
+    report = {
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": seconds,
+        "requests_per_second": len(latencies) / seconds,
+    }
+    for percentile in PERCENTILES:
+        report[f"latency_p{percentile}"] = float(
+            np.percentile(latencies, percentile)) if latencies else None
+    return report
+
+
+def format_report(report) -> str:
+    lines = [
+        f"requests:    {report['requests']} in {report['seconds']:.2f}s",
+        f"throughput:  {report['requests_per_second']:.1f} requests/sec",
+    ]
+    if report["requests"]:
+        lines.append("latency:     " + ", ".join(
+            f"p{p}={report[f'latency_p{p}'] * 1000:.1f}ms"
+            for p in PERCENTILES))
+    if report["errors"]:
+        lines.append(f"errors:      {json.dumps(report['errors'])}")
+    return "\n".join(lines)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="load test the {{task_name}} prediction server.")
+    parser.add_argument(
+        "--url", default="http://localhost:8080/predict",
+        help="URL of the server's predict route.")
+    parser.add_argument(
+        "--request", required=True,
+        help="JSON file of the request to send, e.g. "
+        '{"instances": [[1.0, 2.0]]}')
+    parser.add_argument(
+        "--concurrency", type=int, default=16,
+        help="number of concurrent connections.")
+    parser.add_argument(
+        "--requests", type=int, default=1000,
+        help="total number of requests to send.")
+    return parser.parse_args()
+
+
+def main(args):
+    with open(args.request, 'rb') as f:
+        body = f.read()
+    report = asyncio.run(run_load_test(args.url, body, args.concurrency,
+                                       args.requests))
+    print(format_report(report))
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -0,0 +1,182 @@
+"""{{task_name}} task unit tests"""
+import asyncio
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+import tensorflow as tf
+
+from {{app_name}}.tasks import {{task_name}}, {{task_name}}_loadtest
+
+
+class TinyModel(tf.Module):
+    """Doubles its input"""
+
+    def __init__(self):
+        super().__init__()
+        self.weight = tf.Variable(2.0)
+
+    @tf.function(input_signature=[tf.TensorSpec([None], tf.float32)])
+    def serve(self, x):
+        return x * self.weight
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def request(url, body=None):
+    """Status and body of a GET, or of a POST if there is a body"""
+    try:
+        with urllib.request.urlopen(url, data=body, timeout=30) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+@pytest.fixture(scope="module")
+def server(tmp_path_factory):
+    """URL of a server for a tiny model, which batches for up to 20ms"""
+    model_path = str(tmp_path_factory.mktemp("model"))
+    tf.saved_model.save(TinyModel(), model_path)
+    port = free_port()
+    app_root = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "{{app_name}}.tasks.{{task_name}}",
+         "--max-batch-size", "32", "--max-wait-ms", "20"],
+        cwd=app_root,
+        env=dict(os.environ, CUDA_VISIBLE_DEVICES="",
+                 AIP_STORAGE_URI=model_path, AIP_HTTP_PORT=str(port)),
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+    )
+    url = f"http://localhost:{port}"
+
+    deadline = time.monotonic() + 120
+    while True:
+        assert process.poll() is None, process.communicate()[0]
+        assert time.monotonic() < deadline, "server did not become healthy"
+        try:
+            if request(f"{url}/health")[0] == 200:
+                break
+        except OSError:
+            pass
+        time.sleep(0.1)
+
+    yield url
+    process.terminate()
+    process.wait(timeout=30)
+
+
+def batch_size_count(metrics_text):
+    return int(re.search(r"^batch_size_count (\d+)$", metrics_text,
+                         re.MULTILINE).group(1))
+
+
+def test_predict(server):
+    status, body = request(f"{server}/predict",
+                           json.dumps({"instances": [1.0, 2.5]}).encode())
+    assert status == 200
+    assert json.loads(body) == {"predictions": [2.0, 5.0]}
+
+
+def test_invalid_requests(server):
+    assert request(f"{server}/predict", b"not json")[0] == 400
+    assert request(f"{server}/predict", b'{"instances": []}')[0] == 400
+    assert request(f"{server}/predict")[0] == 405
+    assert request(f"{server}/unknown")[0] == 404
+
+
+def test_concurrent_requests_are_batched(server):
+    before = batch_size_count(request(f"{server}/metrics")[1].decode())
+
+    report = asyncio.run({{task_name}}_loadtest.run_load_test(
+        f"{server}/predict", json.dumps({"instances": [1.0]}).encode(),
+        concurrency=16, requests=320))
+    print({{task_name}}_loadtest.format_report(report))
+
+    assert report["requests"] == 320 and not report["errors"]
+    metrics = request(f"{server}/metrics")[1].decode()
+    # 320 requests of 1 instance were predicted in fewer batches
+    assert batch_size_count(metrics) - before < 320
+    assert 'request_latency_seconds_bucket{le="+Inf"}' in metrics
+
+
+class ClosingWriter:
+    """
+    Stand-in for a StreamWriter, which records what was written and whether
+    it was closed
+    """
+
+    def __init__(self):
+        self.data = b""
+        self.closed = False
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def test_client_disconnecting_mid_request():
+    server = {{task_name}}.PredictionServer(
+        {{task_name}}.parse_args(["--model", "unused"]))
+    writer = ClosingWriter()
+
+    async def disconnect():
+        # the body is cut short of its Content-Length
+        reader = asyncio.StreamReader()
+        reader.feed_data(b"POST /predict HTTP/1.1\r\n"
+                         b"Content-Length: 100\r\n\r\n"
+                         b'{"instances": [1')
+        reader.feed_eof()
+        await server.handle_connection(reader, writer)
+
+    asyncio.run(disconnect())
+    assert writer.closed
+
+
+@pytest.mark.parametrize("headers,status", [
+    (b"Content-Length: 11\r\n", b"413"),
+    (b"Transfer-Encoding: chunked\r\n", b"411"),
+])
+def test_unreadable_bodies_are_rejected(headers, status):
+    server = {{task_name}}.PredictionServer(
+        {{task_name}}.parse_args(["--model", "unused",
+                                  "--max-request-bytes", "10"]))
+    writer = ClosingWriter()
+
+    async def send():
+        reader = asyncio.StreamReader()
+        reader.feed_data(b"POST /predict HTTP/1.1\r\n" + headers + b"\r\n")
+        await server.handle_connection(reader, writer)
+
+    asyncio.run(send())
+    assert writer.data.startswith(b"HTTP/1.1 " + status)
+    assert b"Connection: close" in writer.data
+    assert writer.closed
+
+
+def test_histogram_buckets():
+    histogram = {{task_name}}.Histogram([0.1, 1.0])
+    for value in [0.05, 0.1, 0.5, 2.0]:
+        histogram.observe(value)
+
+    text = histogram.to_prometheus("latency", "help")
+    assert 'latency_bucket{le="0.1"} 2' in text
+    assert 'latency_bucket{le="1.0"} 3' in text
+    assert 'latency_bucket{le="+Inf"} 4' in text
+    assert "latency_count 4" in text
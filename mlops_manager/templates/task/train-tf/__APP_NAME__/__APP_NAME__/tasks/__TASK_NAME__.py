@@ -1,12 +1,26 @@
 """a brief docstring describing the task"""
 
 import argparse
+import itertools
+import json
 import os
+import shutil
+import tempfile
+import time
 
+import numpy as np
 import tensorflow as tf
 
+from {{app_name}} import data
 
-def parse_args() -> argparse.Namespace:
+AUTOTUNE = tf.data.AUTOTUNE
+
+# name of the file, in the model output directory, recording training
+# throughput
+METRICS_FILE = "training_metrics.json"
+
+
+def parse_args(argv=None) -> argparse.Namespace:
     """Parse task arguments"""
     parser = argparse.ArgumentParser()
 
@@ -14,50 +28,348 @@ def parse_args() -> argparse.Namespace:
     # hyperparameters such as layer depth or width.
     #
     # parser.add_argument(...)
+    parser.add_argument("--epochs", type=int, default=10,
+                        help="number of training epochs.")
+    parser.add_argument(
+        "--steps-per-epoch", type=int, default=None,
+        help="number of batches per epoch.  When set, the training data is "
+        "repeated, which keeps workers in step when their shards are uneven.  "
+        "(default: one pass over the data)")
+    parser.add_argument(
+        "--jit-compile", action="store_true",
+        help="compile the model's forward and backward pass with XLA.")
+    parser.add_argument("--learning-rate", type=float, default=0.001,
+                        help="optimizer learning rate.")
+
+    # Instrumentation arguments.  Throughput is logged and written as JSON
+    # next to the model.
+    metrics = parser.add_argument_group("instrumentation")
+    metrics.add_argument(
+        "--log-every-steps", type=int, default=100,
+        help="log training throughput every this many steps.  0 disables "
+        "per-step logs.")
+    metrics.add_argument(
+        "--profile-steps", type=int, nargs=2, metavar=("START", "STOP"),
+        help="capture a tf.profiler trace from step START until step STOP.")
+    metrics.add_argument(
+        "--profile-dir", default=os.environ.get("AIP_TENSORBOARD_LOG_DIR"),
+        help="directory to write profiler traces to, which can be viewed in "
+        "TensorBoard.  (default: $AIP_TENSORBOARD_LOG_DIR)")
+
+    # Checkpoint arguments.  Checkpoints let a preempted or restarted job
+    # resume where it stopped rather than starting over.
+    checkpoints = parser.add_argument_group("checkpoints")
+    checkpoints.add_argument(
+        "--checkpoint-dir", default=os.environ.get("AIP_CHECKPOINT_DIR"),
+        help="directory to save checkpoints to and resume from.  Local and "
+        "GCS paths are supported.  (default: $AIP_CHECKPOINT_DIR, which "
+        "Vertex AI sets for jobs with an output directory)")
+    checkpoints.add_argument(
+        "--checkpoint-every-steps", type=int, default=None,
+        help="save a checkpoint every this many training steps.")
+    checkpoints.add_argument(
+        "--checkpoint-every-secs", type=float, default=600,
+        help="save a checkpoint when this many seconds have passed since the "
+        "last one.  0 disables time-based checkpoints.")
+    checkpoints.add_argument(
+        "--keep-checkpoints", type=int, default=3,
+        help="number of recent checkpoints to keep.")
+
+    # Input pipeline arguments.  By default, tf.data tunes parallelism and
+    # buffer sizes to the machine it is running on.
+    pipeline = parser.add_argument_group("input pipeline")
+    pipeline.add_argument(
+        "--train-data",
+        help="glob pattern of TFRecord files to train on, such as those "
+        "written by `python -m {{app_name}}.data convert`.  Local and GCS "
+        "paths are supported.")
+    pipeline.add_argument(
+        "--compression", default="GZIP", choices=["", "GZIP", "ZLIB"],
+        help="compression of the training data files.")
+    pipeline.add_argument(
+        "--batch-size", type=int, default=64,
+        help="number of examples per training batch, across all replicas.")
+    pipeline.add_argument(
+        "--shuffle-buffer", type=int, default=10000,
+        help="number of examples to shuffle across.  0 disables shuffling.")
+    pipeline.add_argument(
+        "--shuffle-seed", type=int, default=0,
+        help="random seed of the shuffle order, so that a resumed run trains "
+        "on the examples in the same order as an uninterrupted one.")
+    pipeline.add_argument(
+        "--num-parallel-reads", type=int, default=AUTOTUNE,
+        help="number of files to read concurrently.  (default: autotune)")
+    pipeline.add_argument(
+        "--num-parallel-calls", type=int, default=AUTOTUNE,
+        help="number of examples to preprocess concurrently.  "
+        "(default: autotune)")
+    pipeline.add_argument(
+        "--prefetch", type=int, default=AUTOTUNE,
+        help="number of batches to prepare ahead of training.  "
+        "(default: autotune)")
+    pipeline.add_argument(
+        "--cache", default="none",
+        choices=["none", "memory", "disk", "snapshot"],
+        help="where to cache preprocessed examples.  `memory` only lasts for "
+        "the run, while `disk` and `snapshot` are written to --cache-path and "
+        "reused by later runs.")
+    pipeline.add_argument(
+        "--cache-path",
+        help="directory for the `disk` or `snapshot` cache.  Use a new "
+        "directory whenever the data or preprocessing changes.")
+    pipeline.add_argument(
+        "--nondeterministic", action="store_true",
+        help="allow the input pipeline to produce examples out of order, "
+        "which can improve throughput.")
 
-    return parser.parse_args()
+    return parser.parse_args(argv)
 
 
-def load_data() -> tf.data.Dataset:
+def load_data(args, input_context=None) -> tf.data.Dataset:
     """Load data into a tf Dataset"""
+    if not args.train_data:
+        # Load your data from network or disk.
+        # See: https://www.tensorflow.org/io
+        return tf.data.Dataset.from_tensor_slices([])
 
-    # Load your data from network or disk.
-    # See: https://www.tensorflow.org/io
-    return tf.data.Dataset.from_tensor_slices([])
+    # stream the shards, reading several at once.  In a distributed job, each
+    # worker reads only its own part of the data.
+    input_context = input_context or tf.distribute.InputContext()
+    return data.load_dataset(
+        args.train_data,
+        compression=args.compression,
+        num_parallel_reads=args.num_parallel_reads,
+        deterministic=not args.nondeterministic,
+        num_shards=input_context.num_input_pipelines,
+        shard_index=input_context.input_pipeline_id,
+    )
 
 
-def preprocess(dataset) -> tf.data.Dataset:
-    """Prepare tf dataset for training"""
+def preprocess_record(record):
+    """Transform a single raw record into a training example"""
 
     # perform any feature engineering or transformation necessary prior to
-    # training.
+    # training, e.g. parsing records with tf.io.parse_single_example.  This
+    # runs in parallel inside the tf.data pipeline, so prefer tf ops over
+    # python code.
 
     # for more complex functionality, consider using a dedicated library
 
-    return dataset
+    return record
+
+
+def preprocess(dataset, args, input_context=None,
+               epoch=0) -> tf.data.Dataset:
+    """
+    Prepare tf dataset for training.  Without --steps-per-epoch, the dataset
+    is one pass over the data, shuffled in the order of `epoch`.
+    """
+    deterministic = not args.nondeterministic
+    input_context = input_context or tf.distribute.InputContext()
+
+    dataset = dataset.map(preprocess_record,
+                          num_parallel_calls=args.num_parallel_calls,
+                          deterministic=deterministic)
+
+    # cache before shuffling, so that each epoch is still shuffled differently.
+    # The order is seeded, so that it is the same when training resumes.  A
+    # repeated dataset is reshuffled on each pass, in a seeded order too.
+    dataset = cache_dataset(dataset, args)
+    if args.shuffle_buffer > 0:
+        dataset = dataset.shuffle(args.shuffle_buffer,
+                                  seed=args.shuffle_seed + epoch)
+    if args.steps_per_epoch:
+        dataset = dataset.repeat()
 
+    # each input pipeline produces the batches for its own replicas
+    batch_size = input_context.get_per_replica_batch_size(args.batch_size)
+    dataset = dataset.batch(batch_size,
+                            num_parallel_calls=args.num_parallel_calls,
+                            deterministic=deterministic)
+    return dataset.prefetch(args.prefetch)
 
-def build_model() -> tf.keras.Model:
-    """Build a new, uncompiled model for training"""
+
+def cache_dataset(dataset, args) -> tf.data.Dataset:
+    """Cache preprocessed examples according to the --cache argument"""
+    if args.cache == "none":
+        return dataset
+    if args.cache == "memory":
+        return dataset.cache()
+
+    if not args.cache_path:
+        raise ValueError(f"--cache-path is required with --cache {args.cache}")
+    tf.io.gfile.makedirs(args.cache_path)
+    if args.cache == "disk":
+        return dataset.cache(os.path.join(args.cache_path, "cache"))
+    return dataset.snapshot(args.cache_path)
+
+
+def get_tf_config() -> dict:
+    """
+    Cluster configuration of a distributed job.  Vertex AI sets TF_CONFIG for
+    training jobs with more than one replica.
+    See: https://cloud.google.com/vertex-ai/docs/training/distributed-training
+    """
+    return json.loads(os.environ.get("TF_CONFIG", "{}"))
+
+
+def get_strategy() -> tf.distribute.Strategy:
+    """Choose a distribution strategy for the cluster the task is running on"""
+    cluster = get_tf_config().get("cluster", {})
+    num_workers = len(cluster.get("chief", [])) + len(cluster.get("worker", []))
+    if num_workers > 1:
+        # synchronous training across all replicas of all workers
+        return tf.distribute.MultiWorkerMirroredStrategy()
+    if len(tf.config.list_physical_devices("GPU")) > 1:
+        # synchronous training across the GPUs of a single machine
+        return tf.distribute.MirroredStrategy()
+    return tf.distribute.get_strategy()
+
+
+def is_chief() -> bool:
+    """Whether this worker is responsible for writing the model"""
+    tf_config = get_tf_config()
+    task = tf_config.get("task", {})
+    task_type = task.get("type")
+    if task_type is None or task_type == "chief":
+        return True
+    # without a chief, the first worker takes its place
+    return (task_type == "worker" and task.get("index", 0) == 0
+            and "chief" not in tf_config.get("cluster", {}))
+
+
+def build_model(args) -> tf.keras.Model:
+    """
+    Build a new model for training.  Model hyperparameters, such as layer
+    depth or width, can be added to parse_args and read from `args`.
+    """
 
     # Define or import your model here.
     return tf.keras.Sequential([])
 
 
-def train_model(model, dataset, epochs=10) -> tf.keras.Model:
-    """Train a model on a given dataset"""
-    model.compile(
-        optimizer='adam',
-        # tf.keras.losses.MeanSquaredError is used below as a sane default loss
-        # function.  Replace with a loss from tf.keras.losses that is
-        # appropriate for the problem.
-        loss=tf.keras.losses.MeanSquaredError(),
-        metrics=['accuracy'],
-    )
-    model.fit(
-        dataset,
-        epochs=epochs,  # replace with an appropriate number of epochs for
-    )
+def build_optimizer(args) -> tf.keras.optimizers.Optimizer:
+    """Build the optimizer which updates the model's weights"""
+    return tf.keras.optimizers.Adam(learning_rate=args.learning_rate)
+
+
+def compute_loss(labels, predictions):
+    """Loss of each example in a batch"""
+
+    # tf.keras.losses.MeanSquaredError is used below as a sane default loss
+    # function.  Replace with a loss from tf.keras.losses that is appropriate
+    # for the problem, keeping reduction="none".
+    loss = tf.keras.losses.MeanSquaredError(reduction="none")
+    return loss(labels, predictions)
+
+
+def train_model(model, optimizer, make_dataset, strategy, epochs=10,
+                steps_per_epoch=None, checkpointer=None, callbacks=(),
+                jit_compile=False) -> tf.keras.Model:
+    """
+    Train a model on a distributed dataset.  Each step runs on every replica
+    of every worker, and gradients are summed across replicas before the
+    weights are updated.
+
+    `make_dataset(skip_batches, epoch)` builds the distributed dataset of an
+    epoch, skipping batches which have already been trained on.  With
+    `steps_per_epoch`, the dataset repeats and is built once for all epochs.
+    With a `checkpointer`, training resumes from the latest checkpoint, if
+    any, and the input is fast-forwarded past the batches already trained:
+    those of the interrupted epoch, or with `steps_per_epoch`, every batch
+    of the repeated dataset trained so far.
+    `callbacks` are TrainingCallbacks which are notified of training progress.
+    """
+
+    # only the model's computation is compiled with XLA; the optimizer update
+    # includes the cross-replica gradient sum
+    @tf.function(jit_compile=jit_compile)
+    def compute_gradients(features, labels):
+        with tf.GradientTape() as tape:
+            predictions = model(features, training=True)
+            # average over the global batch, as gradients are summed across
+            # replicas
+            loss = tf.nn.compute_average_loss(
+                compute_loss(labels, predictions))
+            if model.losses:
+                loss += tf.nn.scale_regularization_loss(
+                    tf.add_n(model.losses))
+        return loss, tape.gradient(loss, model.trainable_variables)
+
+    # the loss is summed on the device, and only read at the end of an epoch,
+    # so that the host does not wait for each step to finish
+    epoch_loss = tf.Variable(0.0)
+
+    @tf.function
+    def train_step(inputs):
+
+        def replica_step(inputs):
+            loss, gradients = compute_gradients(*inputs)
+            optimizer.apply_gradients(
+                zip(gradients, model.trainable_variables))
+            return loss
+
+        losses = strategy.run(replica_step, args=(inputs,))
+        epoch_loss.assign_add(
+            strategy.reduce(tf.distribute.ReduceOp.SUM, losses, axis=None))
+
+    # training progress, which is saved along with the model
+    step = tf.Variable(0, dtype=tf.int64)
+    epoch = tf.Variable(0, dtype=tf.int64)
+    epoch_step = tf.Variable(0, dtype=tf.int64)
+    if checkpointer and checkpointer.restore(
+            model=model, optimizer=optimizer,
+            step=step, epoch=epoch, epoch_step=epoch_step):
+        print(f"resuming from epoch {int(epoch) + 1} "
+              f"step {int(epoch_step)}")
+
+    # with --steps-per-epoch the dataset repeats, and each epoch continues
+    # where the last one stopped.  Otherwise each epoch is one pass.
+    if steps_per_epoch:
+        iterator = iter(make_dataset(int(step)))
+    else:
+        iterator = iter(make_dataset(int(epoch_step), int(epoch)))
+    while int(epoch) < epochs:
+        epoch_loss.assign(0.0)
+        steps = 0
+        remaining = steps_per_epoch and steps_per_epoch - int(epoch_step)
+        batches = itertools.islice(iterator, remaining)
+        while True:
+            start = time.perf_counter()
+            inputs = next(batches, None)
+            if inputs is None:
+                break
+            input_seconds = time.perf_counter() - start
+            for callback in callbacks:
+                callback.on_step_begin(int(step))
+            # steps run asynchronously, so this times how long the host waits
+            # to queue each one, which the device bounds once it is busy
+            train_start = time.perf_counter()
+            train_step(inputs)
+            step_seconds = input_seconds + time.perf_counter() - train_start
+
+            steps += 1
+            step.assign_add(1)
+            epoch_step.assign_add(1)
+            for callback in callbacks:
+                callback.on_step_end(int(step), input_seconds, step_seconds)
+            if checkpointer:
+                checkpointer.maybe_save(int(step))
+        print(f"epoch {int(epoch) + 1}/{epochs}: "
+              f"loss={float(epoch_loss) / max(steps, 1):.4f} steps={steps}")
+
+        epoch.assign_add(1)
+        epoch_step.assign(0)
+        for callback in callbacks:
+            callback.on_epoch_end(int(epoch))
+        if not steps_per_epoch:
+            iterator = iter(make_dataset(0, int(epoch)))
+
+    if checkpointer:
+        checkpointer.save(int(step))
+        checkpointer.close()
+    for callback in callbacks:
+        callback.on_train_end()
 
     # If model outputs are classifications, optionally add a softmax layer for
     # interpretability:
@@ -66,7 +378,231 @@ def train_model(model, dataset, epochs=10) -> tf.keras.Model:
     return model
 
 
-def run(_args):
+class TrainingCallback:
+    """
+    Base class for objects notified of training progress by train_model.  Step
+    numbers count from the start of training, including any resumed steps.
+    """
+
+    def on_step_begin(self, step):
+        """Called once a step's batch has been fetched, before training on it"""
+
+    def on_step_end(self, step, input_seconds, step_seconds):
+        """
+        Called after each step, with the seconds spent waiting for input and
+        the seconds spent on the whole step, including the wait.
+        """
+
+    def on_epoch_end(self, epoch):
+        pass
+
+    def on_train_end(self):
+        pass
+
+
+class ThroughputMetrics(TrainingCallback):
+    """
+    Records step times and training throughput.  Logs a summary every
+    `log_every_steps` steps and at the end of each epoch, and writes all
+    epochs' summaries to `path` as JSON when training ends.
+
+    The first step of a run includes tracing and compiling the training step,
+    so it is reported separately rather than skewing the percentiles.
+    """
+
+    PERCENTILES = (50, 90, 99)
+
+    def __init__(self, batch_size, path=None, log_every_steps=100,
+                 details=None):
+        self.batch_size = batch_size
+        self.path = path
+        self.log_every_steps = log_every_steps
+        self.details = details or {}
+        self.first_step_seconds = None
+        self.epochs = []
+        self._steps = []
+
+    def on_step_end(self, step, input_seconds, step_seconds):
+        if self.first_step_seconds is None:
+            self.first_step_seconds = step_seconds
+        else:
+            self._steps.append((input_seconds, step_seconds))
+
+        if self.log_every_steps and step % self.log_every_steps == 0:
+            summary = self.summarize(self._steps[-self.log_every_steps:])
+            print(f"step {step}: {self.format_summary(summary)}")
+
+    def on_epoch_end(self, epoch):
+        summary = dict(epoch=epoch, **self.summarize(self._steps))
+        print(f"epoch {epoch} throughput: {self.format_summary(summary)}")
+        self.epochs.append(summary)
+        self._steps = []
+
+    def on_train_end(self):
+        if self.path:
+            self.write_json(self.path)
+
+    def summarize(self, steps) -> dict:
+        """Throughput and step time percentiles of (input, step) timings"""
+        if not steps:
+            return {"steps": 0}
+        input_seconds, step_seconds = np.array(steps).T
+        total_seconds = float(step_seconds.sum())
+        summary = {
+            "steps": len(steps),
+            "seconds": total_seconds,
+            "examples_per_second": len(steps) * self.batch_size / total_seconds,
+            "input_fraction": float(input_seconds.sum()) / total_seconds,
+            "step_seconds_mean": float(step_seconds.mean()),
+        }
+        for percentile in self.PERCENTILES:
+            summary[f"step_seconds_p{percentile}"] = float(
+                np.percentile(step_seconds, percentile))
+        return summary
+
+    @staticmethod
+    def format_summary(summary) -> str:
+        if not summary["steps"]:
+            return "no steps"
+        return (f"{summary['examples_per_second']:.1f} examples/sec, "
+                f"step p50={summary['step_seconds_p50'] * 1000:.1f}ms "
+                f"p99={summary['step_seconds_p99'] * 1000:.1f}ms, "
+                f"{summary['input_fraction']:.0%} waiting on input")
+
+    def to_dict(self) -> dict:
+        return {
+            **self.details,
+            "batch_size": self.batch_size,
+            "first_step_seconds": self.first_step_seconds,
+            "epochs": self.epochs,
+        }
+
+    def write_json(self, path):
+        tf.io.gfile.makedirs(os.path.dirname(path))
+        with tf.io.gfile.GFile(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+class Profiler(TrainingCallback):
+    """Captures a tf.profiler trace of the steps from `start` until `stop`"""
+
+    def __init__(self, logdir, start, stop):
+        self.logdir = logdir
+        self.start = start
+        self.stop = stop
+        self._active = False
+
+    def on_step_begin(self, step):
+        if step == self.start and not self._active:
+            tf.profiler.experimental.start(self.logdir)
+            self._active = True
+        elif step == self.stop:
+            self.on_train_end()
+
+    def on_train_end(self):
+        if self._active:
+            tf.profiler.experimental.stop()
+            self._active = False
+
+
+class Checkpointer:
+    """
+    Saves training state every `every_steps` steps and/or `every_secs`
+    seconds, keeping only the latest `max_to_keep` checkpoints.
+
+    Every worker of a distributed job must take part in saving, but only the
+    chief writes to `directory`; the others write to a temporary directory
+    which is removed when training finishes.  Workers agree on time-based
+    saves only every `sync_every_steps` steps, as agreeing waits for all of
+    them.
+    """
+
+    def __init__(self, directory, strategy, every_steps=None, every_secs=None,
+                 max_to_keep=3, sync_every_steps=100):
+        self.directory = directory
+        self.strategy = strategy
+        self.every_steps = every_steps
+        self.every_secs = every_secs
+        self.max_to_keep = max_to_keep
+        self.sync_every_steps = sync_every_steps
+        self._multi_worker = isinstance(
+            strategy, tf.distribute.MultiWorkerMirroredStrategy)
+        self.manager = None
+        self._write_directory = directory if is_chief() else tempfile.mkdtemp()
+        self._last_save_time = time.monotonic()
+
+    def restore(self, **objects) -> bool:
+        """
+        Track the given objects, and restore them from the latest checkpoint.
+        Returns whether there was a checkpoint to restore.
+        """
+        checkpoint = tf.train.Checkpoint(**objects)
+        self.manager = tf.train.CheckpointManager(
+            checkpoint, self._write_directory, max_to_keep=self.max_to_keep)
+        latest = tf.train.latest_checkpoint(self.directory)
+        if latest is None:
+            return False
+        checkpoint.restore(latest).expect_partial()
+        return True
+
+    def maybe_save(self, step):
+        """Save a checkpoint if one is due"""
+        due = bool(self.every_steps) and step % self.every_steps == 0
+        if self.every_secs and not due:
+            elapsed = time.monotonic() - self._last_save_time
+            due = elapsed >= self.every_secs
+            if self._multi_worker:
+                # workers' clocks differ, but they must all save at the same
+                # step, so they compare them at fixed steps
+                due = (step % self.sync_every_steps == 0
+                       and self._any_worker(due))
+        if due:
+            self.save(step)
+
+    def save(self, step):
+        self.manager.save(checkpoint_number=step)
+        self._last_save_time = time.monotonic()
+
+    def close(self):
+        if self._write_directory != self.directory:
+            shutil.rmtree(self._write_directory, ignore_errors=True)
+
+    def _any_worker(self, flag) -> bool:
+        return int(self._sum_replicas(tf.constant(int(flag)))) > 0
+
+    @tf.function
+    def _sum_replicas(self, value):
+        values = self.strategy.run(lambda: value)
+        return self.strategy.reduce(
+            tf.distribute.ReduceOp.SUM, values, axis=None)
+
+
+def save_model(model, output_directory):
+    """
+    Write the model as a SavedModel.  Every worker of a distributed job must
+    take part in saving, but only the chief writes to the output directory;
+    the others write to a temporary directory which is then removed.
+    """
+    if is_chief():
+        _export(model, output_directory)
+        return
+
+    temp_directory = tempfile.mkdtemp()
+    try:
+        _export(model, temp_directory)
+    finally:
+        shutil.rmtree(temp_directory, ignore_errors=True)
+
+
+def _export(model, directory):
+    # Keras 3 writes SavedModels with export(), while older versions use save()
+    if hasattr(model, "export"):
+        model.export(directory)
+    else:
+        model.save(directory)
+
+
+def run(args):
     # validate and parse environment variables
     if 'AIP_MODEL_DIR' not in os.environ:
         raise KeyError(
@@ -75,11 +611,53 @@ def run(_args):
         )
     output_directory = os.environ['AIP_MODEL_DIR']
 
-    dataset = load_data()
-    dataset = preprocess(dataset)
-    model = build_model()
-    model = train_model(model, dataset)
-    model.save(output_directory)
+    strategy = get_strategy()
+
+    def make_dataset(skip_batches=0, epoch=0):
+        return strategy.distribute_datasets_from_function(
+            lambda input_context: preprocess(
+                load_data(args, input_context), args, input_context, epoch,
+            ).skip(skip_batches))
+
+    checkpointer = None
+    if args.checkpoint_dir:
+        checkpointer = Checkpointer(
+            args.checkpoint_dir,
+            strategy,
+            every_steps=args.checkpoint_every_steps,
+            every_secs=args.checkpoint_every_secs,
+            max_to_keep=args.keep_checkpoints,
+        )
+
+    # only the chief writes metrics, next to the model
+    metrics = ThroughputMetrics(
+        args.batch_size,
+        path=(os.path.join(output_directory, METRICS_FILE)
+              if is_chief() else None),
+        log_every_steps=args.log_every_steps,
+        details={
+            "num_replicas": strategy.num_replicas_in_sync,
+            "jit_compile": args.jit_compile,
+        },
+    )
+    callbacks = [metrics]
+    if args.profile_steps:
+        if not args.profile_dir:
+            raise ValueError("--profile-dir is required with --profile-steps")
+        callbacks.append(Profiler(args.profile_dir, *args.profile_steps))
+
+    # variables must be created within the strategy's scope to be mirrored
+    with strategy.scope():
+        model = build_model(args)
+        optimizer = build_optimizer(args)
+
+    model = train_model(model, optimizer, make_dataset, strategy,
+                        epochs=args.epochs,
+                        steps_per_epoch=args.steps_per_epoch,
+                        checkpointer=checkpointer,
+                        callbacks=callbacks,
+                        jit_compile=args.jit_compile)
+    save_model(model, output_directory)
 
 
 if __name__ == "__main__":
@@ -1,6 +0,0 @@
-"""{{task_name}} task unit tests"""
-
-
-# replace this with task unit tests
-def test_dummy():
-    assert 1 + 1 == 2
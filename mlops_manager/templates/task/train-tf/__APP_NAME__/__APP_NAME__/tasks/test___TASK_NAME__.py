@@ -0,0 +1,311 @@
+"""{{task_name}} task unit tests"""
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import time
+
+import tensorflow as tf
+
+from {{app_name}}.tasks import {{task_name}}
+
+
+# Runs the task in a worker process, with stand-ins for the placeholder model
+# and preprocessing so that there is something to train.
+WORKER_SCRIPT = """
+import sys
+
+import tensorflow as tf
+
+from {{app_name}}.tasks import {{task_name}} as task
+
+
+def preprocess_record(record):
+    x = tf.reshape(tf.strings.to_number(record), [1])
+    return x, 2 * x
+
+
+task.preprocess_record = preprocess_record
+task.build_model = lambda args: tf.keras.Sequential(
+    [tf.keras.Input(shape=(1,)), tf.keras.layers.Dense(1)])
+task.run(task.parse_args(sys.argv[1:]))
+"""
+
+
+def write_records(path, values):
+    with tf.io.TFRecordWriter(path, options="GZIP") as writer:
+        for value in values:
+            writer.write(str(value).encode())
+
+
+def write_shards(directory, num_shards, records_per_shard):
+    for shard in range(num_shards):
+        start = shard * records_per_shard
+        write_records(
+            os.path.join(directory, f"data-{shard:05d}.tfrecord.gz"),
+            range(start, start + records_per_shard))
+
+
+def test_input_pipeline_batches_every_record(tmp_path):
+    write_shards(str(tmp_path), num_shards=4, records_per_shard=25)
+    args = {{task_name}}.parse_args([
+        "--train-data", str(tmp_path / "*.tfrecord.gz"),
+        "--batch-size", "8",
+    ])
+
+    dataset = {{task_name}}.preprocess({{task_name}}.load_data(args), args)
+    batches = list(dataset.as_numpy_iterator())
+
+    assert all(len(batch) <= 8 for batch in batches)
+    records = sorted(int(record) for batch in batches for record in batch)
+    assert records == list(range(100))
+
+
+def test_disk_cache_is_written(tmp_path):
+    data_dir = tmp_path / "data"
+    cache_dir = tmp_path / "cache"
+    data_dir.mkdir()
+    write_shards(str(data_dir), num_shards=2, records_per_shard=10)
+    args = {{task_name}}.parse_args([
+        "--train-data", str(data_dir / "*.tfrecord.gz"),
+        "--cache", "disk",
+        "--cache-path", str(cache_dir),
+    ])
+
+    dataset = {{task_name}}.preprocess({{task_name}}.load_data(args), args)
+    for _ in dataset:
+        pass
+
+    assert any(cache_dir.iterdir())
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def start_task(args, **env):
+    """Run the task in a new process"""
+    app_root = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    return subprocess.Popen(
+        [sys.executable, "-c", WORKER_SCRIPT] + args,
+        cwd=app_root,
+        env=dict(os.environ, CUDA_VISIBLE_DEVICES="", **env),
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+    )
+
+
+def test_multi_worker_training(tmp_path):
+    data_dir = tmp_path / "data"
+    model_dir = tmp_path / "model"
+    checkpoint_dir = tmp_path / "checkpoints"
+    data_dir.mkdir()
+    write_shards(str(data_dir), num_shards=4, records_per_shard=32)
+
+    num_workers = 2
+    cluster = {
+        "worker": [f"localhost:{free_port()}" for _ in range(num_workers)]
+    }
+    workers = [
+        start_task(
+            ["--train-data", str(data_dir / "*.tfrecord.gz"),
+             "--batch-size", "16", "--epochs", "2",
+             "--checkpoint-dir", str(checkpoint_dir),
+             "--checkpoint-every-secs", "0.01"],
+            AIP_MODEL_DIR=str(model_dir),
+            TF_CONFIG=json.dumps({
+                "cluster": cluster,
+                "task": {"type": "worker", "index": index},
+            }),
+        )
+        for index in range(num_workers)
+    ]
+
+    for worker in workers:
+        output, _ = worker.communicate(timeout=300)
+        assert worker.returncode == 0, output
+        # each worker reads half of the 128 records, in batches of 16 / 2
+        assert "epoch 2/2" in output and "steps=8" in output, output
+
+    # only the chief writes the model, metrics and checkpoints
+    model = tf.saved_model.load(str(model_dir))
+    assert model is not None
+    assert (model_dir / {{task_name}}.METRICS_FILE).exists()
+    assert tf.train.latest_checkpoint(str(checkpoint_dir)).endswith("-16")
+    assert sorted(os.listdir(tmp_path)) == ["checkpoints", "data", "model"]
+
+
+def test_resumes_after_being_killed(tmp_path):
+    data_dir = tmp_path / "data"
+    model_dir = tmp_path / "model"
+    checkpoint_dir = tmp_path / "checkpoints"
+    data_dir.mkdir()
+    write_shards(str(data_dir), num_shards=4, records_per_shard=32)
+    args = [
+        "--train-data", str(data_dir / "*.tfrecord.gz"),
+        "--batch-size", "8", "--epochs", "20", "--shuffle-buffer", "0",
+        "--checkpoint-dir", str(checkpoint_dir),
+        "--checkpoint-every-steps", "2",
+        "--checkpoint-every-secs", "0",
+        "--keep-checkpoints", "2",
+    ]
+
+    # kill training as soon as it has saved a checkpoint
+    task = start_task(args, AIP_MODEL_DIR=str(model_dir))
+    while tf.train.latest_checkpoint(str(checkpoint_dir)) is None:
+        assert task.poll() is None, task.communicate()[0]
+        time.sleep(0.05)
+    task.kill()
+    task.communicate()
+    assert not model_dir.exists()
+
+    task = start_task(args, AIP_MODEL_DIR=str(model_dir))
+    output, _ = task.communicate(timeout=300)
+    assert task.returncode == 0, output
+
+    match = re.search(r"resuming from epoch (\d+) step (\d+)", output)
+    assert match, output
+    epoch, epoch_step = map(int, match.groups())
+    # the interrupted epoch only trains on the 16 batches it had not reached
+    steps = re.search(rf"epoch {epoch}/20: .* steps=(\d+)", output).group(1)
+    assert int(steps) == 16 - epoch_step
+    assert "epoch 20/20" in output
+
+    assert tf.saved_model.load(str(model_dir)) is not None
+    assert len(list(checkpoint_dir.glob("*.index"))) == 2
+
+
+class Interrupted(Exception):
+    pass
+
+
+class InterruptAt({{task_name}}.TrainingCallback):
+    def __init__(self, step):
+        self.step = step
+
+    def on_step_begin(self, step):
+        if step == self.step:
+            raise Interrupted()
+
+
+def train_recording_inputs(args, checkpoint_dir, callbacks=()):
+    """
+    Train in this process, checkpointing every step.  Returns the trained
+    model and the inputs of each step, which include steps that were fetched
+    but interrupted.
+    """
+    inputs = []
+
+    class RecordingDataset:
+        def __init__(self, dataset):
+            self.dataset = dataset
+
+        def __iter__(self):
+            for batch in self.dataset:
+                inputs.append(batch[0].numpy().ravel().tolist())
+                yield batch
+
+    strategy = tf.distribute.get_strategy()
+
+    def make_dataset(skip_batches=0, epoch=0):
+        return RecordingDataset(
+            {{task_name}}.preprocess(
+                {{task_name}}.load_data(args), args, epoch=epoch,
+            ).skip(skip_batches))
+
+    tf.keras.utils.set_random_seed(0)
+    model = tf.keras.Sequential(
+        [tf.keras.Input(shape=(1,)), tf.keras.layers.Dense(1)])
+    optimizer = {{task_name}}.build_optimizer(args)
+    checkpointer = {{task_name}}.Checkpointer(
+        str(checkpoint_dir), strategy, every_steps=1, every_secs=0)
+    try:
+        {{task_name}}.train_model(
+            model, optimizer, make_dataset, strategy, epochs=args.epochs,
+            steps_per_epoch=args.steps_per_epoch, checkpointer=checkpointer,
+            callbacks=callbacks)
+    except Interrupted:
+        pass
+    return model, inputs
+
+
+def test_resumes_in_the_same_input_order(tmp_path, monkeypatch):
+    def preprocess_record(record):
+        x = tf.reshape(tf.strings.to_number(record), [1])
+        return x, 2 * x
+
+    monkeypatch.setattr({{task_name}}, "preprocess_record", preprocess_record)
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    write_shards(str(data_dir), num_shards=2, records_per_shard=10)
+    # 5 batches per pass over the data, so epochs of 3 steps cross passes
+    args = {{task_name}}.parse_args([
+        "--train-data", str(data_dir / "*.tfrecord.gz"),
+        "--batch-size", "4", "--epochs", "4", "--steps-per-epoch", "3",
+    ])
+
+    model, inputs = train_recording_inputs(args, tmp_path / "uninterrupted")
+
+    # interrupt the second step of the third epoch, then resume
+    _, interrupted_inputs = train_recording_inputs(
+        args, tmp_path / "resumed", callbacks=[InterruptAt(7)])
+    resumed_model, resumed_inputs = train_recording_inputs(
+        args, tmp_path / "resumed")
+
+    assert len(inputs) == 12
+    assert interrupted_inputs[:7] + resumed_inputs == inputs
+    for weights, resumed_weights in zip(model.get_weights(),
+                                        resumed_model.get_weights()):
+        assert (weights == resumed_weights).all()
+
+
+def test_workers_agree_on_time_based_checkpoints_at_fixed_steps(tmp_path):
+    checkpointer = {{task_name}}.Checkpointer(
+        str(tmp_path), tf.distribute.get_strategy(), every_secs=1e-9,
+        sync_every_steps=4)
+    checkpointer._multi_worker = True
+    agreed, saved = [], []
+    checkpointer._any_worker = lambda flag: agreed.append(flag) or flag
+    checkpointer.save = saved.append
+
+    for step in range(1, 9):
+        checkpointer.maybe_save(step)
+
+    assert agreed == [True, True]
+    assert saved == [4, 8]
+
+
+def test_throughput_metrics_and_profile(tmp_path):
+    data_dir = tmp_path / "data"
+    model_dir = tmp_path / "model"
+    profile_dir = tmp_path / "profile"
+    data_dir.mkdir()
+    write_shards(str(data_dir), num_shards=2, records_per_shard=64)
+
+    task = start_task(
+        ["--train-data", str(data_dir / "*.tfrecord.gz"),
+         "--batch-size", "8", "--epochs", "2",
+         "--jit-compile",
+         "--log-every-steps", "4",
+         # the trace starts on the first step of the second epoch
+         "--profile-steps", "16", "20",
+         "--profile-dir", str(profile_dir)],
+        AIP_MODEL_DIR=str(model_dir),
+    )
+    output, _ = task.communicate(timeout=300)
+    assert task.returncode == 0, output
+    assert "step 4: " in output and "examples/sec" in output
+
+    with open(model_dir / {{task_name}}.METRICS_FILE) as f:
+        metrics = json.load(f)
+    assert metrics["jit_compile"] is True
+    assert [epoch["steps"] for epoch in metrics["epochs"]] == [15, 16]
+    for epoch in metrics["epochs"]:
+        assert epoch["examples_per_second"] > 0
+        assert epoch["step_seconds_p50"] <= epoch["step_seconds_p99"]
+
+    assert list(profile_dir.glob("plugins/profile/*/*.xplane.pb"))
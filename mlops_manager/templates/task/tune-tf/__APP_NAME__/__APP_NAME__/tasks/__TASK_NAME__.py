@@ -0,0 +1,335 @@
+"""a brief docstring describing the task"""
+
+import argparse
+import importlib
+import json
+import math
+import multiprocessing
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import tensorflow as tf
+import yaml
+
+# names of the files, in the output directory, recording the search
+TRIALS_FILE = "trials.json"
+RESULTS_FILE = "results.jsonl"
+BEST_TRIAL_FILE = "best_trial.json"
+
+EARLY_STOPPING_RULES = ("halving", "median", "none")
+
+
+def parse_args(argv=None):
+    """
+    Parse task arguments.  Returns the tuning arguments, and the remaining
+    arguments, which are passed on to the training task.
+    """
+    parser = argparse.ArgumentParser(
+        epilog="Any other arguments are passed on to every trial of the "
+        "training task, e.g. --train-data.")
+    parser.add_argument(
+        "--task", required=True,
+        help="training task to tune, such as a train-tf task of this app.  "
+        "Either a module of {{app_name}}.tasks, or a full module path.")
+    parser.add_argument(
+        "--search-space", required=True,
+        help="YAML or JSON file mapping training task arguments to the "
+        "values to search, e.g. `learning_rate: {type: loguniform, min: "
+        "0.0001, max: 0.1}`.  Types are choice (with `values`), uniform, "
+        "loguniform and int (with `min` and `max`).")
+    parser.add_argument(
+        "--output-dir", default=os.environ.get("AIP_MODEL_DIR"),
+        help="directory to write trial checkpoints and results to.  Running "
+        "the search again with the same directory resumes it.  (default: "
+        "$AIP_MODEL_DIR)")
+    parser.add_argument(
+        "--eval-data",
+        help="glob pattern of TFRecord files to evaluate trials on.  "
+        "(default: the training data)")
+    parser.add_argument(
+        "--trials", type=int, default=9,
+        help="number of configurations to sample from the search space.")
+    parser.add_argument(
+        "--seed", type=int, default=0,
+        help="random seed for sampling configurations.")
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count(),
+        help="number of trials to train at once, each in its own process.  "
+        "(default: number of CPUs)")
+
+    # Early stopping arguments.  Trials train for an increasing number of
+    # epochs in rounds, called rungs, and only the most promising trials
+    # continue to the next rung.
+    stopping = parser.add_argument_group("early stopping")
+    stopping.add_argument(
+        "--early-stopping", default="halving", choices=EARLY_STOPPING_RULES,
+        help="`halving` continues the best 1/--reduction-factor of trials "
+        "after each rung, and `median` continues the trials which are at "
+        "least as good as the median.  `none` trains every trial for "
+        "--max-epochs.")
+    stopping.add_argument(
+        "--min-epochs", type=int, default=1,
+        help="number of epochs of the first rung.")
+    stopping.add_argument(
+        "--max-epochs", type=int, default=9,
+        help="number of epochs of the last rung.")
+    stopping.add_argument(
+        "--reduction-factor", type=int, default=3,
+        help="factor by which each rung's epochs grow, and by which `halving` "
+        "reduces the number of trials.")
+
+    return parser.parse_known_args(argv)
+
+
+def load_search_space(path) -> dict:
+    with tf.io.gfile.GFile(path) as f:
+        space = yaml.safe_load(f)
+    for name, spec in space.items():
+        if spec.get("type") not in ("choice", "uniform", "loguniform", "int"):
+            raise ValueError(f"Unknown type of search space argument {name}: "
+                             f"{spec.get('type')}")
+    return space
+
+
+def sample_trials(space, num_trials, seed) -> list:
+    """Sample `num_trials` configurations of the search space"""
+    rng = random.Random(seed)
+
+    def sample(spec):
+        if spec["type"] == "choice":
+            return rng.choice(spec["values"])
+        if spec["type"] == "int":
+            return rng.randint(spec["min"], spec["max"])
+        if spec["type"] == "loguniform":
+            return math.exp(rng.uniform(math.log(spec["min"]),
+                                        math.log(spec["max"])))
+        return rng.uniform(spec["min"], spec["max"])
+
+    return [
+        {"id": i, "params": {name: sample(spec) for name, spec in space.items()}}
+        for i in range(num_trials)
+    ]
+
+
+def rung_epochs(min_epochs, max_epochs, reduction_factor, rule) -> list:
+    """Epochs trained by the end of each rung"""
+    if rule == "none":
+        return [max_epochs]
+    epochs = [min(min_epochs, max_epochs)]
+    while epochs[-1] < max_epochs:
+        epochs.append(min(epochs[-1] * reduction_factor, max_epochs))
+    return epochs
+
+
+def select_trials(losses, rule, reduction_factor) -> list:
+    """Trials which continue to the next rung, given each trial's loss"""
+    ranked = sorted(losses, key=lambda trial: _sort_key(losses[trial]))
+    if rule == "halving":
+        return ranked[:max(len(ranked) // reduction_factor, 1)]
+    if rule == "median":
+        median = _sort_key(losses[ranked[(len(ranked) - 1) // 2]])
+        return [t for t in ranked if _sort_key(losses[t]) <= median]
+    return ranked
+
+
+def trial_argv(params) -> list:
+    """Training task arguments for a trial's configuration"""
+    argv = []
+    for name, value in params.items():
+        argv += ["--" + name.replace("_", "-"), str(value)]
+    return argv
+
+
+def evaluate(task, model, args) -> float:
+    """Mean loss of the model over one pass of the evaluation data"""
+    eval_args = argparse.Namespace(**{
+        **vars(args), "shuffle_buffer": 0, "steps_per_epoch": None,
+        "cache": "none"})
+    total = 0.0
+    count = 0
+    dataset = task.preprocess(task.load_data(eval_args), eval_args)
+    for features, labels in dataset:
+        losses = task.compute_loss(labels, model(features, training=False))
+        total += float(tf.reduce_sum(losses))
+        count += int(tf.size(losses))
+    return total / count if count else float("nan")
+
+
+def run_trial(task_name, argv, eval_data, checkpoint_dir, epochs) -> dict:
+    """
+    Train a trial until it has trained for `epochs` epochs, continuing from
+    its checkpoint if it has one, then evaluate it.  Runs in a worker process.
+    """
+    start = time.perf_counter()
+    task = _import_task(task_name)
+    args = task.parse_args(argv + ["--epochs", str(epochs)])
+    tf.keras.backend.clear_session()
+
+    strategy = tf.distribute.get_strategy()
+
+    def make_dataset(skip_batches=0, epoch=0):
+        return strategy.distribute_datasets_from_function(
+            lambda input_context: task.preprocess(
+                task.load_data(args, input_context), args, input_context,
+                epoch,
+            ).skip(skip_batches))
+
+    checkpointer = task.Checkpointer(
+        checkpoint_dir, strategy,
+        every_secs=args.checkpoint_every_secs, max_to_keep=1)
+    model = task.build_model(args)
+    optimizer = task.build_optimizer(args)
+    model = task.train_model(model, optimizer, make_dataset, strategy,
+                             epochs=epochs,
+                             steps_per_epoch=args.steps_per_epoch,
+                             checkpointer=checkpointer)
+
+    if eval_data:
+        args.train_data = eval_data
+    return {"loss": evaluate(task, model, args),
+            "seconds": time.perf_counter() - start}
+
+
+def run_search(args, task_argv) -> dict:
+    """
+    Run the search, resuming from any earlier results in the output
+    directory, and return the best trial.  Trials which raise an error are
+    recorded with no loss, and do not continue to the next rung.
+    """
+    tf.io.gfile.makedirs(args.output_dir)
+    trials_path = os.path.join(args.output_dir, TRIALS_FILE)
+    results_path = os.path.join(args.output_dir, RESULTS_FILE)
+
+    space = load_search_space(args.search_space)
+    if tf.io.gfile.exists(trials_path):
+        with tf.io.gfile.GFile(trials_path) as f:
+            search = json.load(f)
+        if search["search_space"] != space:
+            raise ValueError(
+                f"{args.output_dir} holds a search of a different search "
+                "space.  Use a new --output-dir.")
+        print(f"resuming the search in {args.output_dir}")
+    else:
+        search = {"search_space": space,
+                  "trials": sample_trials(space, args.trials, args.seed)}
+        with tf.io.gfile.GFile(trials_path, 'w') as f:
+            json.dump(search, f, indent=2)
+    trials = {trial["id"]: trial for trial in search["trials"]}
+
+    # results of (trial, epochs) which finished before an interruption
+    results = {}
+    if tf.io.gfile.exists(results_path):
+        with tf.io.gfile.GFile(results_path) as f:
+            for line in f:
+                result = json.loads(line)
+                results[result["trial"], result["epochs"]] = result
+
+    threads = max((os.cpu_count() or 1) // max(args.workers, 1), 1)
+    # tensorflow is not fork-safe, so workers are started with spawn
+    context = multiprocessing.get_context("spawn")
+    survivors = sorted(trials)
+    epochs_per_rung = rung_epochs(args.min_epochs, args.max_epochs,
+                                  args.reduction_factor, args.early_stopping)
+    for rung, epochs in enumerate(epochs_per_rung):
+        # each rung has its own pool, so that a worker process which dies
+        # only affects the trials of its rung
+        with ProcessPoolExecutor(max_workers=args.workers, mp_context=context,
+                                 initializer=_init_worker,
+                                 initargs=(threads,)) as pool:
+            futures = {
+                pool.submit(run_trial, args.task,
+                            task_argv + trial_argv(trials[t]["params"]),
+                            args.eval_data,
+                            os.path.join(args.output_dir, f"trial-{t}"),
+                            epochs): t
+                for t in survivors if (t, epochs) not in results
+            }
+            for future in as_completed(futures):
+                result = {"trial": futures[future], "epochs": epochs,
+                          "params": trials[futures[future]]["params"]}
+                record = True
+                try:
+                    result.update(future.result())
+                except BrokenProcessPool as e:
+                    # a worker process died, e.g. killed for running out of
+                    # memory.  The trial which caused it is unknown, so the
+                    # failure is not recorded, and a resumed search retries.
+                    result.update(loss=None, error=f"worker died: {e}")
+                    record = False
+                except Exception as e:
+                    result.update(loss=None, error=f"{type(e).__name__}: {e}")
+                results[result["trial"], epochs] = result
+                if record:
+                    _append_result(results_path, result)
+                print(f"trial {result['trial']} epochs {epochs}: "
+                      f"{_format_result(result)}")
+
+        losses = {t: results[t, epochs]["loss"] for t in survivors
+                  if results[t, epochs]["loss"] is not None}
+        if not losses:
+            raise RuntimeError(
+                f"Every trial of rung {rung + 1} ({epochs} epochs) failed")
+        if rung < len(epochs_per_rung) - 1:
+            survivors = select_trials(losses, args.early_stopping,
+                                      args.reduction_factor)
+            print(f"rung {rung + 1} ({epochs} epochs): "
+                  f"{len(survivors)} of {len(losses)} trials continue")
+        else:
+            survivors = list(losses)
+
+    final_epochs = epochs_per_rung[-1]
+    best = min((results[t, final_epochs] for t in survivors),
+               key=lambda result: _sort_key(result["loss"]))
+    with tf.io.gfile.GFile(os.path.join(args.output_dir, BEST_TRIAL_FILE),
+                           'w') as f:
+        json.dump(best, f, indent=2)
+    print(f"best trial {best['trial']}: loss={best['loss']:.4f} "
+          f"{json.dumps(best['params'])}")
+    return best
+
+
+def _init_worker(threads):
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(threads)
+
+
+def _import_task(task_name):
+    if "." not in task_name:
+        task_name = "{{app_name}}.tasks." + task_name
+    return importlib.import_module(task_name)
+
+
+def _append_result(path, result):
+    # GCS files cannot be appended to, so the file is rewritten
+    contents = ""
+    if tf.io.gfile.exists(path):
+        with tf.io.gfile.GFile(path) as f:
+            contents = f.read()
+    with tf.io.gfile.GFile(path, 'w') as f:
+        f.write(contents + json.dumps(result) + "\n")
+
+
+def _format_result(result) -> str:
+    if result["loss"] is None:
+        return f"failed, {result['error']}"
+    return f"loss={result['loss']:.4f} ({result['seconds']:.1f}s)"
+
+
+def _sort_key(loss) -> float:
+    # failed or diverged trials rank last
+    return float("inf") if loss is None or math.isnan(loss) else loss
+
+
+def run(args, task_argv):
+    if not args.output_dir:
+        raise ValueError(
+            "--output-dir is required, unless the `AIP_MODEL_DIR` environment "
+            "variable is set")
+    run_search(args, task_argv)
+
+
+if __name__ == "__main__":
+    run(*parse_args())
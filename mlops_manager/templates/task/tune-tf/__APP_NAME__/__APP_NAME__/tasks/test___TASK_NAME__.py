@@ -0,0 +1,190 @@
+"""{{task_name}} task unit tests"""
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+from {{app_name}}.tasks import {{task_name}}
+
+# A stand-in for a train-tf task, with the functions the search uses, which
+# learns y = 2x.  Each trained epoch is logged to $EPOCH_LOG, and the trial
+# whose checkpoint directory is named $FAILING_TRIAL raises an error.
+TRAINING_TASK = """
+import argparse
+import os
+
+import tensorflow as tf
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--epochs", type=int, default=1)
+    parser.add_argument("--learning-rate", type=float, default=0.01)
+    parser.add_argument("--steps-per-epoch", type=int)
+    parser.add_argument("--checkpoint-every-secs", type=float, default=0)
+    parser.add_argument("--train-data")
+    return parser.parse_args(argv)
+
+
+def load_data(args, input_context=None):
+    x = tf.reshape(tf.range(64, dtype=tf.float32) / 64, [64, 1])
+    return tf.data.Dataset.from_tensor_slices((x, 2 * x))
+
+
+def preprocess(dataset, args, input_context=None, epoch=0):
+    return dataset.batch(16)
+
+
+def build_model(args):
+    return tf.keras.Sequential(
+        [tf.keras.Input(shape=(1,)), tf.keras.layers.Dense(1)])
+
+
+def build_optimizer(args):
+    return tf.keras.optimizers.SGD(learning_rate=args.learning_rate)
+
+
+def compute_loss(labels, predictions):
+    return tf.square(labels - predictions)
+
+
+def train_model(model, optimizer, make_dataset, strategy, epochs=10,
+                steps_per_epoch=None, checkpointer=None):
+    if os.path.basename(checkpointer.directory) == os.environ["FAILING_TRIAL"]:
+        raise FloatingPointError("loss is NaN")
+    epoch = tf.Variable(0)
+    checkpointer.restore(model=model, optimizer=optimizer, epoch=epoch)
+    while int(epoch) < epochs:
+        for x, y in make_dataset():
+            with tf.GradientTape() as tape:
+                loss = tf.reduce_mean(compute_loss(y, model(x)))
+            gradients = tape.gradient(loss, model.trainable_variables)
+            optimizer.apply_gradients(zip(gradients, model.trainable_variables))
+        epoch.assign_add(1)
+        with open(os.environ["EPOCH_LOG"], "a") as f:
+            f.write(f"{checkpointer.directory} {int(epoch)}\\n")
+    checkpointer.save(int(epoch))
+    return model
+
+
+class Checkpointer:
+    def __init__(self, directory, strategy, every_steps=None, every_secs=None,
+                 max_to_keep=3):
+        self.directory = directory
+        self.max_to_keep = max_to_keep
+
+    def restore(self, **objects):
+        self.manager = tf.train.CheckpointManager(
+            tf.train.Checkpoint(**objects), self.directory, self.max_to_keep)
+        return self.manager.restore_or_initialize() is not None
+
+    def save(self, step):
+        self.manager.save(checkpoint_number=step)
+"""
+
+SEARCH_SPACE = """
+learning_rate:
+  type: loguniform
+  min: 0.0001
+  max: 0.5
+"""
+
+
+def test_rung_epochs():
+    assert {{task_name}}.rung_epochs(1, 9, 3, "halving") == [1, 3, 9]
+    assert {{task_name}}.rung_epochs(2, 10, 3, "median") == [2, 6, 10]
+    assert {{task_name}}.rung_epochs(1, 9, 3, "none") == [9]
+
+
+def test_select_trials():
+    losses = {0: 0.5, 1: 0.1, 2: float("nan"), 3: 0.3, 4: 0.2, 5: 0.4}
+    assert {{task_name}}.select_trials(losses, "halving", 3) == [1, 4]
+    assert {{task_name}}.select_trials(losses, "median", 3) == [1, 4, 3]
+    assert len({{task_name}}.select_trials(losses, "none", 3)) == 6
+
+
+def read_results(output_dir):
+    with open(output_dir / {{task_name}}.RESULTS_FILE) as f:
+        return [json.loads(line) for line in f]
+
+
+def write_stand_in(tmp_path):
+    (tmp_path / "stand_in").mkdir()
+    (tmp_path / "stand_in" / "__init__.py").write_text("")
+    (tmp_path / "stand_in" / "training_task.py").write_text(TRAINING_TASK)
+    (tmp_path / "space.yaml").write_text(SEARCH_SPACE)
+
+
+def start_search(tmp_path, output_dir, *args, failing_trial="none"):
+    app_root = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    return subprocess.Popen(
+        [sys.executable, "-m", "{{app_name}}.tasks.{{task_name}}",
+         "--task", "stand_in.training_task",
+         "--search-space", str(tmp_path / "space.yaml"),
+         "--output-dir", str(output_dir),
+         "--trials", "3", "--workers", "3",
+         "--min-epochs", "1", "--max-epochs", "9",
+         "--train-data", "unused", *args],
+        cwd=app_root,
+        env=dict(os.environ, CUDA_VISIBLE_DEVICES="",
+                 EPOCH_LOG=str(tmp_path / "epochs.log"),
+                 FAILING_TRIAL=failing_trial,
+                 PYTHONPATH=os.pathsep.join([str(tmp_path), app_root])),
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+        start_new_session=True,
+    )
+
+
+def test_search_stops_trials_early_and_resumes(tmp_path):
+    write_stand_in(tmp_path)
+    output_dir = tmp_path / "output"
+    results_path = output_dir / {{task_name}}.RESULTS_FILE
+
+    # interrupt the search once every trial has finished the first rung
+    search = start_search(tmp_path, output_dir)
+    while not (results_path.exists()
+               and len(results_path.read_text().splitlines()) >= 3):
+        assert search.poll() is None, search.communicate()[0]
+        time.sleep(0.05)
+    os.killpg(search.pid, signal.SIGKILL)
+    search.communicate()
+    assert not (output_dir / {{task_name}}.BEST_TRIAL_FILE).exists()
+
+    search = start_search(tmp_path, output_dir)
+    output, _ = search.communicate(timeout=300)
+    assert search.returncode == 0, output
+    assert "resuming the search" in output
+
+    # 3 trials train for 1 epoch, then the best trains for 3, then 9
+    results = read_results(output_dir)
+    assert sorted(r["epochs"] for r in results) == [1, 1, 1, 3, 9]
+    first_rung = {r["trial"]: r["loss"] for r in results if r["epochs"] == 1}
+    best_trial = min(first_rung, key=first_rung.get)
+    assert {r["trial"] for r in results if r["epochs"] > 1} == {best_trial}
+    with open(output_dir / {{task_name}}.BEST_TRIAL_FILE) as f:
+        assert json.load(f)["trial"] == best_trial
+
+    # the resumed search does not repeat the first rung
+    with open(tmp_path / "epochs.log") as f:
+        epochs = [int(line.split()[1]) for line in f]
+    assert epochs.count(1) == 3 and epochs.count(9) == 1
+
+
+def test_failed_trials_are_recorded(tmp_path):
+    write_stand_in(tmp_path)
+    output_dir = tmp_path / "output"
+
+    search = start_search(tmp_path, output_dir, "--early-stopping", "median",
+                          failing_trial="trial-1")
+    output, _ = search.communicate(timeout=300)
+    assert search.returncode == 0, output
+
+    results = read_results(output_dir)
+    failed = [r for r in results if r["trial"] == 1]
+    assert len(failed) == 1 and failed[0]["loss"] is None
+    assert "FloatingPointError: loss is NaN" in failed[0]["error"]
+    with open(output_dir / {{task_name}}.BEST_TRIAL_FILE) as f:
+        assert json.load(f)["trial"] != 1
@@ -1,10 +1,15 @@
-from genericpath import exists
+from concurrent.futures import ThreadPoolExecutor
+import codecs
+import errno
+import fnmatch
+import hashlib
+import json
 import logging
 import os
-from typing import Optional, Dict, Any
-import pathlib
-
-from jinja2 import Environment, FileSystemLoader, select_autoescape
+import shutil
+import threading
+import time
+from typing import Optional, Dict, Any, List, NamedTuple
 
 
 def get_templates_dir():
@@ -14,16 +19,308 @@ def get_templates_dir():
     return os.path.join(path, 'templates')
 
 
+def get_cache_dir() -> str:
+    """Directory for mlops_manager caches (override: MLOPS_MANAGER_CACHE_DIR)"""
+    path = os.environ.get("MLOPS_MANAGER_CACHE_DIR")
+    if path:
+        return path
+    cache_home = os.environ.get("XDG_CACHE_HOME")
+    if not cache_home:
+        cache_home = os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "mlops_manager")
+
+
+_ENVIRONMENTS = {}
+_ENVIRONMENTS_LOCK = threading.Lock()
+
+# per-thread record of where the last template was loaded from: "memory" if
+# the Environment already held it, "bytecode" if it was read from the bytecode
+# cache, and "compiled" if it was parsed and compiled from source
+_TEMPLATE_LOADS = threading.local()
+
+
+def get_environment(template_root: str):
+    """
+    Get the jinja Environment for a template root.  One Environment is shared
+    per root within a process, so each template is only loaded and compiled
+    once.  Compiled templates are also kept in an on-disk bytecode cache
+    shared between processes, which jinja invalidates when a template's source
+    changes.
+    """
+    template_root = os.path.abspath(template_root)
+    with _ENVIRONMENTS_LOCK:
+        env = _ENVIRONMENTS.get(template_root)
+        if env is None:
+            # jinja2 is imported here so that CLI startup does not pay for it
+            from jinja2 import Environment, select_autoescape
+
+            loader_class, bytecode_cache_class = _get_tracking_classes()
+            bytecode_cache = None
+            bytecode_dir = os.path.join(get_cache_dir(), "bytecode")
+            try:
+                os.makedirs(bytecode_dir, exist_ok=True)
+                bytecode_cache = bytecode_cache_class(bytecode_dir)
+            except OSError as e:
+                logging.debug(f"Template bytecode cache disabled: {e}")
+
+            env = Environment(loader=loader_class(template_root),
+                              autoescape=select_autoescape(),
+                              keep_trailing_newline=True,
+                              bytecode_cache=bytecode_cache)
+            _ENVIRONMENTS[template_root] = env
+    return env
+
+
+_TRACKING_CLASSES = None
+
+
+def _get_tracking_classes():
+    """
+    jinja loader and bytecode cache classes which record in _TEMPLATE_LOADS
+    how each template was loaded.  Created lazily, as they subclass jinja2.
+    """
+    global _TRACKING_CLASSES
+    if _TRACKING_CLASSES is None:
+        from jinja2 import FileSystemBytecodeCache, FileSystemLoader
+
+        class TrackingLoader(FileSystemLoader):
+            # only called when the Environment does not hold the template
+            def load(self, environment, name, globals=None):
+                _TEMPLATE_LOADS.source = "compiled"
+                return super().load(environment, name, globals)
+
+        class TrackingBytecodeCache(FileSystemBytecodeCache):
+            def load_bytecode(self, bucket):
+                super().load_bytecode(bucket)
+                if bucket.code is not None:
+                    _TEMPLATE_LOADS.source = "bytecode"
+
+        _TRACKING_CLASSES = (TrackingLoader, TrackingBytecodeCache)
+    return _TRACKING_CLASSES
+
+
+class PlannedFile(NamedTuple):
+    """A single file operation resolved by `TemplateTreeJob.plan`"""
+    source: str  # template name, relative to the template root
+    target: str  # path of the rendered file
+    action: str  # one of: CREATED, OVERWRITTEN, SKIPPED, UPDATED, UNCHANGED,
+    #              MODIFIED
+    template_hash: Optional[str] = None
+    output_hash: Optional[str] = None
+    static: bool = False  # copied verbatim rather than rendered
+    # filled in by `TemplateTreeJob.render_file`
+    compile_seconds: float = 0.0
+    render_seconds: float = 0.0
+    write_seconds: float = 0.0
+    bytes_written: int = 0
+    template_cache: Optional[str] = None  # memory, bytecode, or compiled
+
+
+class TreePlan(NamedTuple):
+    """Directories and files that a `TemplateTreeJob` will produce"""
+    directories: List[str]
+    files: List[PlannedFile]
+
+
+def hash_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_binary_file(path: str, sample_size: int = 8192) -> bool:
+    """Guess whether a file is binary from its first `sample_size` bytes"""
+    with open(path, 'rb') as f:
+        sample = f.read(sample_size)
+    if b"\0" in sample:
+        return True
+    try:
+        # incremental, so that a character split by the sample is not an error
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+    except UnicodeDecodeError:
+        return True
+    return False
+
+
+def copy_file(source: str, target: str):
+    """
+    Copy a file's contents and permission bits.  Contents are copied in the
+    kernel (copy_file_range, then sendfile) where the platform supports it,
+    without passing through user space.
+    """
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        size = os.fstat(src.fileno()).st_size
+        offset = _copy_in_kernel(src.fileno(), dst.fileno(), size)
+        if offset < size:
+            src.seek(offset)
+            dst.seek(offset)
+            shutil.copyfileobj(src, dst)
+    shutil.copymode(source, target)
+
+
+# errors meaning an in-kernel copy is unsupported for this pair of files
+_COPY_FALLBACK_ERRNOS = {
+    errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP,
+}
+
+
+def _copy_in_kernel(src_fd: int, dst_fd: int, size: int) -> int:
+    """Copy as much as possible in the kernel, returning bytes copied"""
+    offset = 0
+    if hasattr(os, "copy_file_range"):
+        try:
+            while offset < size:
+                copied = os.copy_file_range(
+                    src_fd, dst_fd, size - offset, offset, offset)
+                if copied == 0:
+                    break
+                offset += copied
+        except OSError as e:
+            if e.errno not in _COPY_FALLBACK_ERRNOS:
+                raise
+    if offset < size and hasattr(os, "sendfile"):
+        try:
+            os.lseek(dst_fd, offset, os.SEEK_SET)
+            while offset < size:
+                copied = os.sendfile(dst_fd, src_fd, offset, size - offset)
+                if copied == 0:
+                    break
+                offset += copied
+        except OSError as e:
+            if e.errno not in _COPY_FALLBACK_ERRNOS:
+                raise
+    return offset
+
+
+class GenerationManifest(object):
+    """
+    Record of the files generated into a target directory, stored alongside
+    them.  Each entry holds hashes of the rendered output, the template source,
+    and the template context, which lets later runs tell whether a file needs
+    to be re-rendered, and whether it has been edited by hand since.
+    """
+
+    FILE_NAME = ".mlops_manager.json"
+    VERSION = 1
+
+    def __init__(self, target_root: str):
+        self.target_root = target_root
+        self.path = os.path.join(target_root, self.FILE_NAME)
+        self.files = self._read()
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def get(self, target: str) -> Optional[Dict[str, str]]:
+        return self.files.get(self._key(target))
+
+    def record(self, target: str, output_hash: str, template_hash: str,
+               context_hash: str):
+        self.files[self._key(target)] = {
+            "output": output_hash,
+            "template": template_hash,
+            "context": context_hash,
+        }
+
+    def save(self):
+        # merge with entries written since this manifest was read, e.g. by
+        # another job rendering into the same target
+        files = self._read()
+        files.update(self.files)
+        self.files = files
+
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"version": self.VERSION, "files": files}, f,
+                      indent=2, sort_keys=True)
+            f.write("\n")
+        os.replace(tmp_path, self.path)
+
+    def _key(self, target: str) -> str:
+        relative = os.path.relpath(target, self.target_root)
+        return relative.replace(os.sep, "/")
+
+    def _read(self) -> Dict[str, Dict[str, str]]:
+        try:
+            with open(self.path, 'r') as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return {}
+        if manifest.get("version") != self.VERSION:
+            return {}
+        return manifest.get("files", {})
+
+
+def check_plan_conflicts(plans: List[TreePlan]):
+    """Raise if several plans would render to the same target file"""
+    sources = {}
+    for plan in plans:
+        for planned in plan.files:
+            if planned.action == "SKIPPED":
+                continue
+            if planned.target in sources:
+                raise ValueError(
+                    f"Templates '{sources[planned.target]}' and "
+                    f"'{planned.source}' both render to '{planned.target}'")
+            sources[planned.target] = planned.source
+
+
+class RenderHook(object):
+    """
+    Receives instrumentation events from a `TemplateTreeJob`.  Subclass and
+    override any of the methods, then register with `TemplateTreeJob.add_hook`.
+    """
+
+    def on_phase(self, job: "TemplateTreeJob", phase: str, seconds: float):
+        """
+        Called when a job phase completes.  Phases are "discover" (planning)
+        and "execute" (creating directories and rendering files).
+        """
+
+    def on_file(self, job: "TemplateTreeJob", planned: PlannedFile):
+        """
+        Called with each file's final result, in plan order, including its
+        compile, render, and write timings and the bytes it wrote.
+        """
+
+
 class TemplateTreeJob(object):
     """
     Reproduces a templated file tree into a target directory, making
     necessary substitutions.
+
+    Files matching one of the `static_files` glob patterns (relative to the
+    template root), and files that look binary, are copied verbatim instead of
+    being rendered.  All files keep the permission bits of their source.
+
+    Running a job happens in two phases.  `plan` walks the template tree,
+    resolves target paths, and applies the exists policy, raising on any
+    conflict before anything is written.  `execute` then creates directories
+    and renders files, using a pool of `jobs` worker threads.
+
+    The `if-changed` exists policy records the generated files in a
+    `GenerationManifest` in the target root, and only updates files whose
+    template or context has changed and which have not been edited since.
+    Other policies keep an existing manifest up to date, but never create one.
+
+    With `stream` enabled, files are rendered with jinja's generator API and
+    written chunk by chunk, so memory use does not grow with output size.
+
+    Timings and other metrics are reported to any `RenderHook`s added with
+    `add_hook`.
     """
 
     VALID_EXISTS_POLICIES = [
         "skip",
         "error",
         "overwrite",
+        "if-changed",
     ]
 
     def __init__(
@@ -32,7 +329,10 @@ class TemplateTreeJob(object):
         target_root: str,
         template_context: Dict[str, Any] = {},
         filename_substitutions: Dict[str, str] = {},
-        exists_policy: str = "error"
+        exists_policy: str = "error",
+        jobs: int = 1,
+        static_files: List[str] = [],
+        stream: bool = False,
     ):
         self.template_root = template_root
         self.target_root = target_root
@@ -45,58 +345,299 @@ class TemplateTreeJob(object):
         self.exists_policy = exists_policy
 
         self.filename_substitutions = filename_substitutions
+        self.static_files = static_files
+        self.stream = stream
 
-    def run(self):
-        logging.info(
-            f"Rendering template: {self.template_root}->{self.target_root}")
+        if jobs < 1:
+            raise ValueError("jobs must be a positive integer")
+        self.jobs = jobs
+
+        self.hooks = []
+        self._generation_manifest = None
+        self._context_hash = hash_bytes(json.dumps(
+            template_context, sort_keys=True, default=str).encode())
 
-        loader = FileSystemLoader(self.template_root)
-        env = Environment(loader=loader,
-                          autoescape=select_autoescape(),
-                          keep_trailing_newline=True)
+    def add_hook(self, hook: RenderHook):
+        self.hooks.append(hook)
 
-        # apply templates in each directory
-        for dir_name, _, file_list in os.walk(self.template_root):
+    def run(self):
+        self.execute(self.plan())
 
-            relative_dir = dir_name[len(self.template_root) + 1:]
+    def plan(self) -> TreePlan:
+        """
+        Resolve every directory and file in the template tree to its target,
+        without writing anything.
+        """
+        start = time.perf_counter()
+        directories = []
+        files = []
+        self._generation_manifest = GenerationManifest(self.target_root)
+
+        for relative_dir, file_list in self._walk():
             target_dir = self._substitute_name(relative_dir)
             target_dir = os.path.join(self.target_root, target_dir)
-            self._ensure_dir(target_dir)
+            if os.path.exists(target_dir) and not os.path.isdir(target_dir):
+                raise IOError(
+                    f"Path is a non-directory file: '{target_dir}'")
+            directories.append(target_dir)
 
             for file_name in file_list:
                 file_load_path = os.path.join(relative_dir, file_name)
-                file_write_path = os.path.join(target_dir, file_name)
-                file_write_path = self._substitute_name(file_write_path)
-
-                # handle files that already exist according to policy
-                if os.path.exists(file_write_path):
-                    message = ""
-                    if(self.exists_policy == "skip"):
-                        logging.info(
-                            f"{file_write_path} - SKIPPED")
-                    elif(self.exists_policy == "error"):
-                        raise IOError(
-                            f"File '{file_write_path}' already exists.")
-                    elif(self.exists_policy == "overwrite"):
-                        template = env.get_template(file_load_path)
-                        with open(file_write_path, 'w') as f:
-                            f.write(template.render(**self.template_context))
-                        logging.info(
-                            f"{file_write_path} - OVERWRITTEN")
-                    else:
-                        raise ValueError(
-                            f"Encountered unimplemented exists_policy: {self.exists_policy}")
-
-                # if file does not exist, render from template
-                else:
-                    template = env.get_template(file_load_path)
-                    with open(file_write_path, 'w') as f:
-                        f.write(template.render(**self.template_context))
-                    logging.info(f"{file_write_path} - CREATED")
+                file_write_path = os.path.join(
+                    self.target_root, self._substitute_name(file_load_path))
+
+                source_path = os.path.join(self.template_root, file_load_path)
+                template_hash = hash_file(source_path)
+                action = self._resolve_action(file_write_path, template_hash)
+                files.append(PlannedFile(
+                    source=file_load_path.replace(os.sep, "/"),
+                    target=file_write_path,
+                    action=action,
+                    template_hash=template_hash,
+                    static=self._is_static(file_load_path, source_path),
+                ))
+
+        plan = TreePlan(directories=directories, files=files)
+        check_plan_conflicts([plan])
+
+        for hook in self.hooks:
+            hook.on_phase(self, "discover", time.perf_counter() - start)
+        return plan
+
+    def precompile(self) -> int:
+        """
+        Compile every rendered template in the tree into the bytecode cache,
+        returning the number of templates compiled.
+        """
+        env = get_environment(self.template_root)
+        count = 0
+        for relative_dir, file_list in self._walk():
+            for file_name in file_list:
+                file_load_path = os.path.join(relative_dir, file_name)
+                source_path = os.path.join(self.template_root, file_load_path)
+                if self._is_static(file_load_path, source_path):
+                    continue
+                env.get_template(file_load_path.replace(os.sep, "/"))
+                count += 1
+        return count
+
+    def execute(self, plan: TreePlan,
+                executor: Optional[ThreadPoolExecutor] = None):
+        """
+        Create the directories and render the files of a plan.  Files are
+        rendered on `executor` if given, otherwise on a thread pool of size
+        `self.jobs`.  If a file fails, the files already written are still
+        recorded before the error is raised.
+
+        Only thread pools are supported, as rendering relies on state held in
+        this process, such as the cached Jinja environments.
+        """
+        if executor is not None and not isinstance(executor,
+                                                   ThreadPoolExecutor):
+            raise TypeError("executor must be a ThreadPoolExecutor")
+        start = time.perf_counter()
+        self.create_directories(plan)
+
+        results = []
+        try:
+            if executor is not None:
+                self._render_on(executor, plan.files, results)
+            elif self.jobs > 1:
+                with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+                    self._render_on(pool, plan.files, results)
+            else:
+                for planned in plan.files:
+                    results.append(self.render_file(planned))
+            for hook in self.hooks:
+                hook.on_phase(self, "execute", time.perf_counter() - start)
+        finally:
+            # record the files that were written even if others failed, so
+            # that the manifest still matches what is on disk
+            self.record_results(results)
+
+    def _render_on(self, executor: ThreadPoolExecutor,
+                   files: List[PlannedFile], results: List[PlannedFile]):
+        # wait for every file before raising the first error, so that
+        # `results` holds all of the files which were written
+        futures = [executor.submit(self.render_file, planned)
+                   for planned in files]
+        error = None
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                error = error or e
+        if error is not None:
+            raise error
+
+    def create_directories(self, plan: TreePlan):
+        """Create the target directories of a plan"""
+        logging.info(
+            f"Rendering template: {self.template_root}->{self.target_root}")
+
+        for directory in plan.directories:
+            self._ensure_dir(directory)
+
+    def record_results(self, results: List[PlannedFile]):
+        """
+        Log the outcome of each rendered file, and record them in the target's
+        generation manifest, if the exists policy uses one or it already
+        exists.
+        """
+        # log in plan order, regardless of the order files completed in
+        for planned in results:
+            if planned.action == "MODIFIED":
+                logging.warning(
+                    f"{planned.target} - MODIFIED (edited since it was "
+                    "generated; not updated)")
+            else:
+                logging.info(f"{planned.target} - {planned.action}")
+            for hook in self.hooks:
+                hook.on_file(self, planned)
+
+        manifest = self._generation_manifest
+        if self.exists_policy != "if-changed" and not manifest.exists():
+            return
+        for planned in results:
+            if planned.output_hash is not None:
+                manifest.record(planned.target, planned.output_hash,
+                                planned.template_hash, self._context_hash)
+        manifest.save()
+
+    def _resolve_action(self, file_write_path: str, template_hash: str) -> str:
+        # handle files that already exist according to policy
+        if not os.path.exists(file_write_path):
+            return "CREATED"
+        if os.path.isdir(file_write_path):
+            raise IOError(f"Path is a directory: '{file_write_path}'")
+        if self.exists_policy == "skip":
+            return "SKIPPED"
+        elif self.exists_policy == "error":
+            raise IOError(f"File '{file_write_path}' already exists.")
+        elif self.exists_policy == "overwrite":
+            return "OVERWRITTEN"
+        elif self.exists_policy == "if-changed":
+            entry = self._generation_manifest.get(file_write_path)
+            if entry is None or entry["output"] != hash_file(file_write_path):
+                # not generated by us, or edited by hand since
+                return "MODIFIED"
+            if (entry["template"] == template_hash
+                    and entry["context"] == self._context_hash):
+                return "UNCHANGED"
+            return "UPDATED"
+        else:
+            raise ValueError(
+                f"Encountered unimplemented exists_policy: {self.exists_policy}")
+
+    def render_file(self, planned: PlannedFile) -> PlannedFile:
+        """
+        Render or copy a single planned file, returning it with its final
+        action, output hash, and timings.  Safe to call from several threads
+        at once.
+        """
+        if planned.action in ("SKIPPED", "MODIFIED", "UNCHANGED"):
+            return planned
+        source_path = os.path.join(self.template_root, planned.source)
+
+        if planned.static:
+            if (planned.action == "UPDATED"
+                    and hash_file(planned.target) == planned.template_hash):
+                return planned._replace(action="UNCHANGED",
+                                        output_hash=planned.template_hash)
+            start = time.perf_counter()
+            copy_file(source_path, planned.target)
+            return planned._replace(
+                output_hash=planned.template_hash,
+                write_seconds=time.perf_counter() - start,
+                bytes_written=os.path.getsize(planned.target))
+
+        start = time.perf_counter()
+        _TEMPLATE_LOADS.source = "memory"
+        template = get_environment(self.template_root).get_template(
+            planned.source)
+        planned = planned._replace(
+            compile_seconds=time.perf_counter() - start,
+            template_cache=_TEMPLATE_LOADS.source)
+        if self.stream:
+            return self._render_streaming(template, planned, source_path)
+
+        start = time.perf_counter()
+        output = template.render(**self.template_context).encode()
+        output_hash = hash_bytes(output)
+        planned = planned._replace(
+            output_hash=output_hash,
+            render_seconds=time.perf_counter() - start)
+
+        # leave identical files untouched, so that their mtimes are preserved
+        if (planned.action == "UPDATED"
+                and hash_file(planned.target) == output_hash):
+            return planned._replace(action="UNCHANGED")
+
+        start = time.perf_counter()
+        with open(planned.target, 'wb') as f:
+            f.write(output)
+        shutil.copymode(source_path, planned.target)
+        return planned._replace(
+            write_seconds=time.perf_counter() - start,
+            bytes_written=len(output))
+
+    def _render_streaming(self, template, planned: PlannedFile,
+                          source_path: str) -> PlannedFile:
+        # render chunk by chunk to a temporary file beside the target,
+        # hashing along the way, then move it into place.  A failed render
+        # leaves any existing file untouched, and an identical output can be
+        # discarded without touching it at all.
+        write_path = f"{planned.target}.{os.getpid()}.tmp"
+
+        start = time.perf_counter()
+        write_seconds = 0.0
+        bytes_written = 0
+        digest = hashlib.sha256()
+        try:
+            with open(write_path, 'wb') as f:
+                for chunk in template.generate(**self.template_context):
+                    data = chunk.encode()
+                    digest.update(data)
+                    write_start = time.perf_counter()
+                    f.write(data)
+                    write_seconds += time.perf_counter() - write_start
+                    bytes_written += len(data)
+            planned = planned._replace(
+                output_hash=digest.hexdigest(),
+                render_seconds=time.perf_counter() - start - write_seconds,
+                write_seconds=write_seconds,
+                bytes_written=bytes_written)
+
+            if (planned.action == "UPDATED"
+                    and hash_file(planned.target) == planned.output_hash):
+                return planned._replace(action="UNCHANGED", bytes_written=0)
+            shutil.copymode(source_path, write_path)
+            os.replace(write_path, planned.target)
+        finally:
+            if os.path.exists(write_path):
+                os.remove(write_path)
+        return planned
+
+    def _is_static(self, file_load_path: str, source_path: str) -> bool:
+        relative_path = file_load_path.replace(os.sep, "/")
+        for pattern in self.static_files:
+            if fnmatch.fnmatchcase(relative_path, pattern):
+                return True
+        return is_binary_file(source_path)
+
+    def _walk(self):
+        """Yield (relative_dir, file_names) for the tree, in sorted order"""
+        # walk in sorted order so that plans (and logs) are deterministic
+        for dir_name, dir_list, file_list in os.walk(self.template_root):
+            dir_list.sort()
+            relative_dir = os.path.relpath(dir_name, self.template_root)
+            if relative_dir == os.curdir:
+                relative_dir = ""
+            yield relative_dir, sorted(file_list)
 
     def _ensure_dir(self, directory: str):
         if not os.path.exists(directory):
-            os.makedirs(directory)
+            os.makedirs(directory, exist_ok=True)
             logging.info(f"{directory} - CREATED")
         elif not os.path.isdir(directory):
             raise IOError(f"Path is a non-directory file: '{directory}'")
@@ -0,0 +1,75 @@
+"""mlops_manager templating unit tests"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from mlops_manager.templating import GenerationManifest, TemplateTreeJob
+
+
+class RenderError(Exception):
+    pass
+
+
+def fail():
+    raise RenderError("render failed")
+
+
+def make_template(root, files):
+    os.makedirs(root)
+    for name, body in files.items():
+        with open(os.path.join(root, name), 'w') as f:
+            f.write(body)
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_failed_render_keeps_manifest_of_written_files(tmp_path, jobs):
+    template_root = str(tmp_path / "template")
+    target_root = str(tmp_path / "target")
+    make_template(template_root, {
+        "a.txt": "{{ name }}\n",
+        "b.txt": "{{ fail() }}\n",
+        "c.txt": "{{ name }}\n",
+    })
+
+    job = TemplateTreeJob(
+        template_root, target_root,
+        template_context={"name": "demo", "fail": fail},
+        exists_policy="if-changed", jobs=jobs)
+    with pytest.raises(RenderError):
+        job.run()
+
+    written = sorted(GenerationManifest(target_root).files)
+    # files after the failure are only rendered by a pool
+    assert written == (["a.txt", "c.txt"] if jobs > 1 else ["a.txt"])
+
+
+def test_failed_streaming_render_keeps_existing_file(tmp_path):
+    template_root = str(tmp_path / "template")
+    target_root = tmp_path / "target"
+    make_template(template_root, {
+        "a.txt": "{% for i in range(1000) %}{{ i }}\n{% endfor %}{{ fail() }}",
+    })
+    target_root.mkdir()
+    (target_root / "a.txt").write_text("original\n")
+
+    job = TemplateTreeJob(
+        template_root, str(target_root), template_context={"fail": fail},
+        exists_policy="overwrite", stream=True)
+    with pytest.raises(RenderError):
+        job.run()
+
+    assert (target_root / "a.txt").read_text() == "original\n"
+    assert os.listdir(target_root) == ["a.txt"]
+
+
+def test_execute_rejects_process_pools(tmp_path):
+    template_root = str(tmp_path / "template")
+    make_template(template_root, {"a.txt": "{{ name }}\n"})
+    job = TemplateTreeJob(template_root, str(tmp_path / "target"),
+                          template_context={"name": "demo"})
+
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        with pytest.raises(TypeError):
+            job.execute(job.plan(), pool)
+    assert not (tmp_path / "target").exists()